@@ -0,0 +1,154 @@
+"""
+ディレクトリ走査のベンチマーク
+
+更新変換1回分の「変更の検出 → タイムスタンプファイルの保存」で発生する stat 呼び出しの回数と処理時間を、
+ディレクトリ内のファイル数を変えて計測します。
+
+- legacy : 以前の実装（os.listdir + os.path.isfile + os.path.getmtime を検出時と保存時の2回）
+- scandir: 現在の実装（scan_pukiwiki_stats による os.scandir 1回の走査を検出と保存で共用）
+
+使い方:
+    python benchmarks/bench_directory_scan.py [--sizes 1000 10000 50000] [--latency-ms 2] [--json 結果.json]
+
+--latency-ms を指定すると、ネットワークドライブを想定して「stat 1回 = 1往復」とした場合の推定時間も表示します。
+なお Windows では os.scandir がディレクトリ一覧と一緒に更新時刻・サイズを返すため、DirEntry.stat() は往復を発生させません。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pukiwiki_to_markdown as converter
+
+
+class StatCounter:
+    """os.stat と DirEntry.stat の呼び出し回数を数えます。"""
+    def __init__(self):
+        self.os_stat = 0
+        self.direntry_stat = 0
+
+    @contextlib.contextmanager
+    def patch(self):
+        original_stat = os.stat
+        original_scandir = os.scandir
+        counter = self
+
+        def counting_stat(*args, **kwargs):
+            counter.os_stat += 1
+            return original_stat(*args, **kwargs)
+
+        class CountingEntry:
+            def __init__(self, entry):
+                self._entry = entry
+                self.name = entry.name
+                self.path = entry.path
+
+            def is_file(self, *args, **kwargs):
+                return self._entry.is_file(*args, **kwargs)
+
+            def stat(self, *args, **kwargs):
+                counter.direntry_stat += 1
+                return self._entry.stat(*args, **kwargs)
+
+        @contextlib.contextmanager
+        def counting_scandir(path):
+            with original_scandir(path) as entries:
+                yield (CountingEntry(entry) for entry in entries)
+
+        os.stat = counting_stat
+        os.scandir = counting_scandir
+        try:
+            yield
+        finally:
+            os.stat = original_stat
+            os.scandir = original_scandir
+
+
+def legacy_update_scan(pukiwiki_dir, previous_timestamps):
+    """以前の実装と同じ手順（検出時と保存時にそれぞれ listdir + isfile + getmtime）で走査します。"""
+    updated_files = []
+    for filename in os.listdir(pukiwiki_dir):
+        filepath = os.path.join(pukiwiki_dir, filename)
+        if os.path.isfile(filepath) and (filename.endswith('.txt') or filename.endswith('.page')):
+            mtime = os.path.getmtime(filepath)
+            if filename not in previous_timestamps or previous_timestamps[filename].get('mtime') != mtime:
+                updated_files.append(filename)
+    timestamps = {}
+    for filename in os.listdir(pukiwiki_dir):
+        filepath = os.path.join(pukiwiki_dir, filename)
+        if os.path.isfile(filepath) and (filename.endswith('.txt') or filename.endswith('.page')):
+            timestamps[filename] = os.path.getmtime(filepath)
+    return updated_files, timestamps
+
+
+def scandir_update_scan(pukiwiki_dir, markdown_dir, previous_timestamps):
+    """現在の実装と同じ手順（1回の走査を変更の検出と保存で共用）で走査します。"""
+    file_stats = converter.scan_pukiwiki_stats(pukiwiki_dir)
+    updated_files = converter.get_updated_files(pukiwiki_dir, markdown_dir, previous_timestamps, file_stats)
+    converter.save_timestamps(pukiwiki_dir, markdown_dir, previous_timestamps, file_stats)
+    return updated_files
+
+
+def measure(function, *args):
+    counter = StatCounter()
+    with counter.patch(), contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        function(*args)
+        elapsed = time.perf_counter() - start
+    return {'seconds': round(elapsed, 4), 'os_stat': counter.os_stat, 'direntry_stat': counter.direntry_stat}
+
+
+def run_size(file_count):
+    with tempfile.TemporaryDirectory() as work_dir:
+        pukiwiki_dir = os.path.join(work_dir, 'wiki')
+        markdown_dir = os.path.join(work_dir, 'md')
+        os.makedirs(pukiwiki_dir)
+        os.makedirs(markdown_dir)
+        for i in range(file_count):
+            with open(os.path.join(pukiwiki_dir, f'page{i}.txt'), 'w', encoding='utf-8') as f:
+                f.write(f'*page {i}\n')
+        with contextlib.redirect_stdout(io.StringIO()):
+            converter.save_timestamps(pukiwiki_dir, markdown_dir)
+            previous_timestamps = converter.load_timestamps(markdown_dir)
+
+        return {
+            'files': file_count,
+            'legacy': measure(legacy_update_scan, pukiwiki_dir, previous_timestamps),
+            'scandir': measure(scandir_update_scan, pukiwiki_dir, markdown_dir, previous_timestamps),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ディレクトリ走査（stat 呼び出し回数）のベンチマーク')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='ディレクトリ内のファイル数')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='stat 1回あたりの往復時間（推定時間の計算用）')
+    parser.add_argument('--json', help='結果を保存するJSONファイル')
+    args = parser.parse_args(argv)
+
+    results = []
+    print(f"{'files':>8} | {'legacy stat':>11} {'sec':>8} | {'scandir os.stat':>15} {'DirEntry.stat':>13} {'sec':>8}")
+    for file_count in args.sizes:
+        result = run_size(file_count)
+        legacy, scandir = result['legacy'], result['scandir']
+        print(f"{file_count:>8} | {legacy['os_stat']:>11} {legacy['seconds']:>8.3f} | "
+              f"{scandir['os_stat']:>15} {scandir['direntry_stat']:>13} {scandir['seconds']:>8.3f}")
+        if args.latency_ms:
+            legacy['estimated_seconds'] = round(legacy['os_stat'] * args.latency_ms / 1000, 2)
+            scandir['estimated_seconds'] = round((scandir['os_stat'] + scandir['direntry_stat']) * args.latency_ms / 1000, 2)
+            print(f"{'':>8} | 推定 {legacy['estimated_seconds']} 秒 (legacy) / {scandir['estimated_seconds']} 秒 (scandir、"
+                  f"Windows では DirEntry.stat の往復なし: {round(scandir['os_stat'] * args.latency_ms / 1000, 2)} 秒)")
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'directory_scan', 'latency_ms': args.latency_ms, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
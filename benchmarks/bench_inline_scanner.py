@@ -0,0 +1,154 @@
+"""
+インライン記法のスキャナーのベンチマーク
+
+インライン記法（強調・斜体・取り消し線・&size・&color・エイリアス付きリンク・#ref）を多く含むページを生成し、
+インライン記法の変換だけを次の3つの方法で計測します。
+
+- legacy : 従来の変換エンジンの各段階（emphasis / size_color / links）による文書全体への正規表現置換
+- regex  : stream エンジンの行ごとの正規表現の連鎖
+- scan   : scan_inline による1行1回の走査（入れ子に対応）
+
+それぞれ 行/秒 と MB/秒、legacy に対する速度比を表示します。
+legacy と出力が異なる行の数と例も表示します（入れ子の記法など、scan が意図して異なる変換をする行を含みます）。
+--json を指定すると結果をJSONで保存します。
+
+使い方:
+    python benchmarks/bench_inline_scanner.py [--pages 200] [--lines 40] [--nested 0.2] [--repeat 3] [--seed 0] [--json 結果.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pukiwiki_to_markdown as converter
+import corpus
+
+DIFF_EXAMPLES = 5 # 表示する出力の違いの例の数
+
+
+def nested_fragment(rng, depth):
+    """入れ子の &size / &color と強調を組み合わせた断片を作ります。"""
+    text = rng.choice(corpus.WORDS)
+    for _ in range(depth):
+        roll = rng.random()
+        if roll < 0.4:
+            text = f"&color({rng.choice(corpus.COLORS)}){{{text}}}"
+        elif roll < 0.7:
+            text = f"&size({rng.choice(corpus.SIZES)}){{{text}}}"
+        elif roll < 0.85:
+            text = f"'''{text}'''"
+        else:
+            text = f"''{text}''"
+    return text
+
+
+def inline_line(rng, anchors, page_names, nested_ratio):
+    """インライン記法を多く含む1行を作ります。nested_ratio の割合で入れ子の断片を加えます。"""
+    parts = [corpus.sentence(rng, anchors, page_names) for _ in range(rng.randint(1, 3))]
+    if rng.random() < nested_ratio:
+        parts.insert(rng.randrange(len(parts) + 1), nested_fragment(rng, rng.randint(2, 4)))
+    if rng.random() < 0.1:
+        parts.append(f"#ref({rng.choice(corpus.IMAGES)},{rng.choice(corpus.WORDS)})")
+    return ''.join(parts)
+
+
+def generate_pages(page_count, line_count, nested_ratio, seed):
+    """インライン記法を多く含むページ（行のリスト）を page_count 件作ります。"""
+    pages = []
+    for index in range(page_count):
+        rng = random.Random(f"{seed}:{index}:inline")
+        page_names = [corpus.page_name(seed, rng.randrange(corpus.LINK_TARGETS)) for _ in range(8)]
+        anchors = [f"{rng.getrandbits(32):08x}" for _ in range(4)]
+        pages.append([inline_line(rng, anchors, page_names, nested_ratio) for _ in range(line_count)])
+    return pages
+
+
+def legacy_inline(text):
+    """従来の変換エンジンのインライン記法の段階だけを文書全体に適用します。"""
+    for stage in (converter._legacy_emphasis, converter._legacy_size_color, converter._legacy_links):
+        text = stage(text)
+    return text
+
+
+def regex_inline(text):
+    """stream エンジンの行ごとの正規表現の連鎖を適用します（厳密モードは使わない）。"""
+    return '\n'.join(converter._stream_text_lines(text.split('\n'), False, False))
+
+
+def scan_inline(text):
+    return '\n'.join(converter.scan_inline(line) for line in text.split('\n'))
+
+
+METHODS = (('legacy', legacy_inline), ('regex', regex_inline), ('scan', scan_inline))
+
+
+def measure(function, texts, repeat):
+    """texts をすべて変換する時間を repeat 回計測し、最短の時間と出力を返します。"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [function(text) for text in texts]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, outputs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='インライン記法のスキャナーのベンチマーク')
+    parser.add_argument('--pages', type=int, default=200, help='ページ数')
+    parser.add_argument('--lines', type=int, default=40, help='1ページの行数')
+    parser.add_argument('--nested', type=float, default=0.2, help='入れ子の記法を含む行の割合')
+    parser.add_argument('--repeat', type=int, default=3, help='計測の繰り返し回数（最短の時間を使う）')
+    parser.add_argument('--seed', type=int, default=0, help='乱数の種')
+    parser.add_argument('--json', help='結果を保存するJSONファイル')
+    args = parser.parse_args(argv)
+
+    pages = generate_pages(args.pages, args.lines, args.nested, args.seed)
+    texts = ['\n'.join(lines) for lines in pages]
+    line_count = sum(len(lines) for lines in pages)
+    input_bytes = sum(len(text.encode('utf-8')) for text in texts)
+    print(f"{args.pages} ページ（{line_count} 行、{input_bytes / (1024 * 1024):.2f} MB、入れ子の割合 {args.nested}）")
+
+    results = {}
+    outputs = {}
+    for name, function in METHODS:
+        seconds, outputs[name] = measure(function, texts, args.repeat)
+        results[name] = {'seconds': round(seconds, 4),
+                         'lines_per_second': round(line_count / seconds, 1) if seconds > 0 else None,
+                         'mb_per_second': round(input_bytes / (1024 * 1024) / seconds, 3) if seconds > 0 else None}
+    legacy_seconds = results['legacy']['seconds']
+    for name, measured in results.items():
+        measured['speed_ratio'] = round(legacy_seconds / measured['seconds'], 3) if measured['seconds'] > 0 else None
+        print(f"  {name:<8} {measured['seconds']:>9.4f} 秒 {measured['lines_per_second']:>12} 行/秒 "
+              f"{measured['mb_per_second']:>8} MB/秒  legacy の x{measured['speed_ratio']:.2f}")
+
+    # 出力の違いは行ごとに数える
+    differences = {}
+    for name in ('regex', 'scan'):
+        different = []
+        for page, expected, actual in zip(pages, outputs['legacy'], outputs[name]):
+            for source, expected_line, actual_line in zip(page, expected.split('\n'), actual.split('\n')):
+                if expected_line != actual_line:
+                    different.append({'source': source, 'legacy': expected_line, name: actual_line})
+        differences[name] = {'lines': len(different), 'examples': different[:DIFF_EXAMPLES]}
+        print(f"  {name} と legacy で出力が異なる行: {len(different)} / {line_count}")
+        for example in different[:DIFF_EXAMPLES]:
+            print(f"    元     : {example['source']}")
+            print(f"    legacy : {example['legacy']}")
+            print(f"    {name:<7}: {example[name]}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'inline_scanner', 'seed': args.seed, 'pages': args.pages, 'lines': line_count,
+                       'input_bytes': input_bytes, 'nested': args.nested, 'repeat': args.repeat,
+                       'python': platform.python_version(), 'platform': platform.platform(),
+                       'results': results, 'differences': differences}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
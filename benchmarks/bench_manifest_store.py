@@ -0,0 +1,103 @@
+"""
+タイムスタンプの記録の保存先のベンチマーク
+
+ページ数の多いWikiを想定し、記録の保存にかかる時間を保存先ごとに計測します。
+
+- markdown: timestamps.md（記録全体を1つのJSONとして書き直す）
+- sqlite  : logs/manifest.sqlite3 など（変更された行だけを追加・更新・削除する）
+
+それぞれ「初回の保存（全件）」「1件だけ変更して保存」「--changes 件を変更して保存」「読み込み」の時間を表示します。
+
+使い方:
+    python benchmarks/bench_manifest_store.py [--sizes 10000 100000] [--changes 100] [--json 結果.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pukiwiki_to_markdown as converter
+
+
+# 記録する記法（見出し・リスト・強調・リンクを含む典型的なページ）
+PAGE_FEATURES = converter.FEATURE_HEADING | converter.FEATURE_LIST | converter.FEATURE_EMPHASIS | converter.FEATURE_LINK
+
+
+def make_records(file_count):
+    features = ','.join(converter.feature_names(PAGE_FEATURES))
+    rules = converter.format_rule_versions(PAGE_FEATURES)
+    return {f'{i:08X}.txt': {'mtime': 1700000000.0 + i, 'size': 100 + i, 'hash': f'{i:032x}', 'encoding': 'utf-8',
+                             'output_hash': f'{i + 1:032x}', 'output_mtime': 1700000000.5 + i,
+                             'features': features, 'rules': rules}
+            for i in range(file_count)}
+
+
+def modify(records, change_count):
+    records = converter.copy_manifest(records)
+    for filename in list(records)[:change_count]:
+        records[filename]['mtime'] += 1
+    return records
+
+
+def timed(function, *args):
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = function(*args)
+        return round(time.perf_counter() - start, 4), result
+
+
+def measure(store_factory, file_count, change_count):
+    records = make_records(file_count)
+    store = store_factory()
+    timed(store.load, False)
+    initial, _ = timed(store.save, records)
+    records = modify(records, 1)
+    one_change, _ = timed(store.save, records)
+    records = modify(records, change_count)
+    many_changes, _ = timed(store.save, records)
+    load, loaded = timed(store_factory().load, False)
+    assert loaded == records
+    return {'initial_save': initial, 'save_1_change': one_change, f'save_{change_count}_changes': many_changes, 'load': load}
+
+
+def run_size(file_count, change_count):
+    with tempfile.TemporaryDirectory() as work_dir:
+        markdown_dir = os.path.join(work_dir, 'md')
+        os.makedirs(markdown_dir)
+        database_path = os.path.join(work_dir, 'manifest.sqlite3')
+        return {
+            'files': file_count,
+            'markdown': measure(lambda: converter.MarkdownManifestStore(markdown_dir), file_count, change_count),
+            'sqlite': measure(lambda: converter.SqliteManifestStore(markdown_dir, database_path), file_count, change_count),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='タイムスタンプの記録の保存先（timestamps.md / SQLite）のベンチマーク')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='記録するファイル数')
+    parser.add_argument('--changes', type=int, default=100, help='2回目の変更で書き換える記録の数')
+    parser.add_argument('--json', help='結果を保存するJSONファイル')
+    args = parser.parse_args(argv)
+
+    results = []
+    columns = ['initial_save', 'save_1_change', f'save_{args.changes}_changes', 'load']
+    print(f"{'files':>8} {'backend':>9} | " + ' '.join(f'{column:>16}' for column in columns))
+    for file_count in args.sizes:
+        result = run_size(file_count, args.changes)
+        for backend in ('markdown', 'sqlite'):
+            print(f"{file_count:>8} {backend:>9} | " + ' '.join(f'{result[backend][column]:>16.3f}' for column in columns))
+        results.append(result)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'manifest_store', 'changes': args.changes, 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+変換のスループットのベンチマーク
+
+benchmarks/corpus.py で生成したPukiWikiのページ（乱数の種で内容が決まります）を使い、ページ数ごとに次を計測します。
+
+- converter: 変換関数だけの速度（ページはあらかじめデコードしておき、変換エンジンごとに計測）
+- full     : process_conversion による全変換（読み込み・文字コード判別・変換・書き込み・タイムスタンプの保存・連結ファイルの作成）
+- update   : --update-ratio の割合のページを変更してからの更新変換
+
+それぞれ ページ/秒 と MB/秒（変換元のバイト数で計算）を表示し、--json を指定すると結果をJSONで保存します。
+--compare に以前の結果のJSONを渡すと、ページ/秒の比（今回 / 以前）を表示します。
+変換結果キャッシュは使わずに計測します（キャッシュの効果を除くため）。
+
+使い方:
+    python benchmarks/bench_throughput.py [--sizes 1000 10000 100000] [--encoding mixed] [--engines legacy stream]
+                                          [--workers 1] [--update-ratio 0.01] [--seed 0] [--json 結果.json] [--compare 以前の結果.json]
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pukiwiki_to_markdown as converter
+import corpus
+
+
+def throughput(seconds, pages, input_bytes):
+    return {'seconds': round(seconds, 3), 'pages': pages,
+            'pages_per_second': round(pages / seconds, 1) if seconds > 0 else None,
+            'mb_per_second': round(input_bytes / (1024 * 1024) / seconds, 3) if seconds > 0 else None}
+
+
+def measure_converter(pukiwiki_dir, encodings, engine):
+    """ページをデコードしてから、変換関数だけの時間を計測します。"""
+    convert = converter.get_converter(dict(converter.DEFAULT_ADVANCED_SETTINGS, engine=engine))
+    elapsed = 0.0
+    input_bytes = 0
+    for filename, encoding in encodings.items():
+        with open(os.path.join(pukiwiki_dir, filename), 'rb') as f:
+            data = f.read()
+        input_bytes += len(data)
+        text = data.decode(encoding)
+        start = time.perf_counter()
+        convert(text)
+        elapsed += time.perf_counter() - start
+    return throughput(elapsed, len(encodings), input_bytes)
+
+
+def run_conversion(pukiwiki_dir, markdown_dir, mode, options):
+    """process_conversion を画面出力なしで実行し、(経過時間, 処理結果) を返します。"""
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        start = time.perf_counter()
+        summary = converter.process_conversion(pukiwiki_dir, markdown_dir, None, conversion_mode=mode, options=options,
+                                               reporter=converter.ConsoleReporter(assume_yes=True))
+        elapsed = time.perf_counter() - start
+        converter.flush_error_log()
+    return elapsed, summary
+
+
+def touch_pages(pukiwiki_dir, encodings, ratio):
+    """ratio の割合のページの末尾に1行追加し、(変更したページ数, 変更したページのバイト数) を返します。"""
+    filenames = sorted(encodings)
+    step = max(1, round(1 / ratio)) if ratio > 0 else len(filenames) + 1
+    changed = filenames[::step]
+    changed_bytes = 0
+    for filename in changed:
+        path = os.path.join(pukiwiki_dir, filename)
+        with open(path, 'ab') as f:
+            f.write('追記しました。\n'.encode(encodings[filename]))
+        changed_bytes += os.path.getsize(path)
+    return len(changed), changed_bytes
+
+
+def run_size(page_count, args):
+    original_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as work_dir:
+        pukiwiki_dir = os.path.join(work_dir, 'wiki')
+        markdown_dir = os.path.join(work_dir, 'md')
+        encodings, input_bytes = corpus.write_corpus(pukiwiki_dir, page_count, args.encoding, args.seed)
+        result = {'pages': page_count, 'input_bytes': input_bytes, 'converter': {}}
+        for engine in args.engines:
+            result['converter'][engine] = measure_converter(pukiwiki_dir, encodings, engine)
+
+        # logs ディレクトリ（連結ファイルなど）は作業ディレクトリに作られるため、一時ディレクトリで実行する
+        options = dict(converter.DEFAULT_ADVANCED_SETTINGS, engine=args.engines[0], workers=args.workers, cache_size_mb=0, metrics=False)
+        os.chdir(work_dir)
+        try:
+            elapsed, summary = run_conversion(pukiwiki_dir, markdown_dir, 'full', options)
+            result['full'] = throughput(elapsed, summary['converted'], input_bytes)
+            changed_count, changed_bytes = touch_pages(pukiwiki_dir, encodings, args.update_ratio)
+            elapsed, summary = run_conversion(pukiwiki_dir, markdown_dir, 'update', options)
+            # 更新変換は「このページ数のWikiを確認し終えるまでの速さ」として、Wiki全体のページ数で計算する
+            result['update'] = dict(throughput(elapsed, page_count, input_bytes), converted=summary['converted'], changed=changed_count)
+        finally:
+            os.chdir(original_cwd)
+    return result
+
+
+def print_result(result):
+    print(f"{result['pages']:>8} ページ（{result['input_bytes'] / (1024 * 1024):.1f} MB）")
+    rows = [(f"converter/{engine}", measured) for engine, measured in result['converter'].items()]
+    rows += [('full', result['full']), ('update', result['update'])]
+    for name, measured in rows:
+        note = f"  （変更 {measured['changed']} ページ）" if 'changed' in measured else ''
+        print(f"  {name:<18} {measured['seconds']:>9.3f} 秒 {measured['pages_per_second']:>10} ページ/秒 {measured['mb_per_second']:>8} MB/秒{note}")
+
+
+def print_comparison(results, previous_path):
+    with open(previous_path, encoding='utf-8') as f:
+        previous = {entry['pages']: entry for entry in json.load(f)['results']}
+    print(f"以前の結果 '{previous_path}' との比較（ページ/秒の比、1 より大きければ速くなった）")
+    for result in results:
+        before = previous.get(result['pages'])
+        if before is None:
+            continue
+        pairs = [(f"converter/{engine}", measured, before['converter'].get(engine)) for engine, measured in result['converter'].items()]
+        pairs += [(name, result[name], before.get(name)) for name in ('full', 'update')]
+        for name, now, then in pairs:
+            if then and then.get('pages_per_second') and now.get('pages_per_second'):
+                print(f"  {result['pages']:>8} {name:<18} x{now['pages_per_second'] / then['pages_per_second']:.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='変換のスループットのベンチマーク')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='ページ数')
+    parser.add_argument('--encoding', choices=corpus.ENCODING_CHOICES, default='mixed', help='ページの文字コード（mixed: ページごとに選ぶ）')
+    parser.add_argument('--engines', nargs='+', choices=sorted(converter.CONVERTERS), default=[converter.ENGINE_LEGACY, converter.ENGINE_STREAM],
+                        help='計測する変換エンジン（全変換・更新変換には最初のエンジンを使う）')
+    parser.add_argument('--workers', type=int, default=1, help='全変換・更新変換の並列数')
+    parser.add_argument('--update-ratio', type=float, default=0.01, help='更新変換の前に変更するページの割合')
+    parser.add_argument('--seed', type=int, default=0, help='コーパスの乱数の種')
+    parser.add_argument('--json', help='結果を保存するJSONファイル')
+    parser.add_argument('--compare', help='比較する以前の結果のJSONファイル')
+    args = parser.parse_args(argv)
+
+    results = []
+    for page_count in args.sizes:
+        result = run_size(page_count, args)
+        print_result(result)
+        results.append(result)
+
+    if args.compare:
+        print_comparison(results, args.compare)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'benchmark': 'throughput', 'seed': args.seed, 'encoding': args.encoding, 'engines': args.engines,
+                       'workers': args.workers, 'update_ratio': args.update_ratio,
+                       'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                       'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+ベンチマーク用のPukiWikiページの生成
+
+乱数の種（seed）から、実際のWikiに近いPukiWikiのページを決まった内容で生成します。
+README に記載した記法（見出しとアンカー、入れ子のリスト、強調・取り消し線、&size / &color、リンク、#ref、#br、
+コメント、整形済みテキスト、大きなカンマ区切りテーブルと表組み、[[#アンカー]] へのリンクの多用など）をすべて含みます。
+
+- ページ i の内容は seed と i だけで決まります（ページ数を変えても同じページは同じ内容になります）
+- ファイル名は PukiWiki と同じく、ページ名をそのページの文字コードでバイト列にして16進数（大文字）で表したものです
+- 文字コードは utf-8 / euc-jp / shift_jis、または mixed（ページごとにいずれか）を選べます
+
+使い方（コーパスをディレクトリに書き出す場合）:
+    python benchmarks/corpus.py 出力ディレクトリ [--pages 1000] [--encoding mixed] [--seed 0]
+"""
+import argparse
+import os
+import random
+import sys
+
+ENCODINGS = ('utf-8', 'euc-jp', 'shift_jis')
+ENCODING_CHOICES = ENCODINGS + ('mixed',)
+
+# ページ名・本文に使う語（EUC-JP と Shift_JIS の両方で表せる文字だけを使う）
+WORDS = (
+    'プロジェクト', '会議', '議事録', '設計', '仕様', '手順', '障害', '対応', 'リリース', 'テスト', '運用', '環境',
+    '構築', '確認', '調査', '報告', '予定', '課題', '検討', '作業', 'サーバー', 'データベース', 'ネットワーク', '設定',
+    'バックアップ', '監視', 'ログ', '権限', '申請', '承認', '問い合わせ', '担当者', '期限', '進捗', '品質', '性能',
+    'FAQ', 'API', 'Wiki', 'Linux', 'Windows', 'Python', 'メモ', '一覧', 'まとめ', '注意事項', '参考資料',
+)
+PARTICLES = ('の', 'を', 'に', 'で', 'と', 'は', 'が', 'から', 'まで')
+ENDINGS = ('します。', 'しました。', 'してください。', 'する予定です。', 'を確認済みです。', 'が必要です。', 'について検討中です。')
+COLORS = ('red', 'blue', 'green', 'gray', '#ff0000', '#336699', 'orange')
+BACKGROUNDS = ('yellow', '#eeeeee', 'white', 'pink')
+SIZES = ('10', '12', '14', '18', '24')
+IMAGES = ('image.png', 'diagram.jpg', 'screenshot.png', 'flow.gif')
+CODE_LINES = (
+    'sudo systemctl restart httpd', 'tail -f /var/log/messages', 'SELECT * FROM users WHERE id = 1;',
+    'if (x > 0) { return x; }', 'for i in range(10):', '    print(i)', 'git pull origin main', 'ls -la /etc',
+)
+
+
+LINK_TARGETS = 1000 # リンク先にするページの範囲（ページ 0 から。ページ数によらず同じリンク先になるようにする）
+
+
+def page_name(seed, index):
+    """ページ index の名前を返します（階層を / で表したページ名を含みます）。"""
+    rng = random.Random(f"{seed}:{index}:name")
+    name = rng.choice(WORDS) + rng.choice(WORDS)
+    if rng.random() < 0.4:
+        name = f"{rng.choice(WORDS)}/{name}"
+    return f"{name}{index:06d}"
+
+
+def page_filename(name, encoding):
+    """PukiWiki と同じく、ページ名を16進数で表したファイル名を返します。"""
+    return name.encode(encoding).hex().upper() + '.txt'
+
+
+def sentence(rng, anchors, page_names):
+    """インライン記法を含む1文を作ります。"""
+    parts = []
+    for _ in range(rng.randint(2, 6)):
+        word = rng.choice(WORDS)
+        roll = rng.random()
+        if roll < 0.08:
+            word = f"''{word}''"
+        elif roll < 0.12:
+            word = f"'''{word}'''"
+        elif roll < 0.15:
+            word = f"%%{word}%%"
+        elif roll < 0.19:
+            word = f"&color({rng.choice(COLORS)}){{{word}}}"
+        elif roll < 0.21:
+            word = f"&color({rng.choice(COLORS)},{rng.choice(BACKGROUNDS)}){{{word}}}"
+        elif roll < 0.24:
+            word = f"&size({rng.choice(SIZES)}){{{word}}}"
+        elif roll < 0.29:
+            word = f"[[{rng.choice(page_names)}]]"
+        elif roll < 0.32:
+            word = f"[[{word}>{rng.choice(page_names)}]]"
+        elif roll < 0.42 and anchors:
+            word = f"[[#{rng.choice(anchors)}]]"
+        elif roll < 0.44:
+            word = f"https://example.com/{rng.choice(('docs', 'wiki', 'issues'))}/{rng.randint(1, 9999)}"
+        parts.append(word + rng.choice(PARTICLES))
+    return ''.join(parts) + rng.choice(ENDINGS)
+
+
+def heading_block(rng, anchors):
+    anchor = f"{rng.getrandbits(32):08x}"
+    anchors.append(anchor)
+    level = rng.choice((1, 2, 2, 3, 3, 3))
+    return [f"{'*' * level}{rng.choice(WORDS)}{rng.choice(PARTICLES)}{rng.choice(WORDS)} [#{anchor}]"]
+
+
+def paragraph_block(rng, anchors, page_names):
+    lines = [sentence(rng, anchors, page_names) for _ in range(rng.randint(1, 4))]
+    if len(lines) > 1 and rng.random() < 0.3:
+        lines[0] += '~'
+    return lines
+
+
+def list_block(rng, anchors, page_names):
+    """入れ子のリスト（- / -- / --- / +）と、項目の後続行を作ります。"""
+    lines = []
+    marker = rng.choice(('-', '+'))
+    depth = 1
+    for _ in range(rng.randint(3, 15)):
+        depth = max(1, min(3, depth + rng.choice((-1, 0, 0, 1))))
+        lines.append(f"{marker * depth} {sentence(rng, anchors, page_names)}")
+        if rng.random() < 0.15:
+            lines.append(sentence(rng, anchors, page_names))
+    if rng.random() < 0.1:
+        lines.append(f"-http://example.com/{rng.randint(1, 999)}")
+    return lines
+
+
+def preformatted_block(rng):
+    return [' ' + rng.choice(CODE_LINES) for _ in range(rng.randint(2, 12))]
+
+
+def csv_table_block(rng, large):
+    columns = rng.randint(2, 6)
+    lines = [',' + ','.join(f"{rng.choice(WORDS)}" for _ in range(columns))]
+    for _ in range(rng.randint(30, 150) if large else rng.randint(3, 15)):
+        lines.append(',' + ','.join(str(rng.randint(0, 99999)) if rng.random() < 0.5 else rng.choice(WORDS) for _ in range(columns)))
+    return lines
+
+
+def pipe_table_block(rng, anchors, page_names, large):
+    columns = rng.randint(2, 7)
+    lines = []
+    if rng.random() < 0.5:
+        lines.append('|' + '|'.join(rng.choice(('LEFT:', 'CENTER:', 'RIGHT:', 'LEFT:120', 'CENTER:80')) for _ in range(columns)) + '|c')
+    if rng.random() < 0.5:
+        lines.append('|' + '|'.join(f"~{rng.choice(WORDS)}" for _ in range(columns)) + '|')
+    else:
+        lines.append('|' + '|'.join(rng.choice(WORDS) for _ in range(columns)) + '|h')
+    for _ in range(rng.randint(30, 150) if large else rng.randint(3, 15)):
+        cells = []
+        for _ in range(columns):
+            roll = rng.random()
+            if roll < 0.1:
+                cells.append(f"[[{rng.choice(page_names)}]]")
+            elif roll < 0.15 and anchors:
+                cells.append(f"[[#{rng.choice(anchors)}]]")
+            elif roll < 0.2:
+                cells.append(f"&color({rng.choice(COLORS)}){{{rng.choice(WORDS)}}}")
+            elif roll < 0.5:
+                cells.append(str(rng.randint(0, 99999)))
+            else:
+                cells.append(rng.choice(WORDS))
+        lines.append('|' + '|'.join(cells) + '|')
+    return lines
+
+
+def misc_block(rng, page_names):
+    return [rng.choice((
+        '#br', '#BR', '#contents', '#comment', '----',
+        f"#ref({rng.choice(IMAGES)})", f"#ref({rng.choice(IMAGES)},{rng.choice(WORDS)})",
+        f"// {rng.choice(WORDS)}は後で見直す", f"[[{rng.choice(page_names)}]]を参照",
+    ))]
+
+
+def generate_page(seed, index):
+    """ページ index の内容を返します（seed と index が同じなら常に同じ内容です）。"""
+    rng = random.Random(f"{seed}:{index}")
+    page_names = [page_name(seed, rng.randrange(LINK_TARGETS)) for _ in range(8)]
+    anchors = []
+    # ほとんどのページは小さく、一部に大きなページ（大きな表を含む）がある
+    large = rng.random() < 0.05
+    block_count = rng.randint(40, 120) if large else rng.randint(3, 15)
+    lines = heading_block(rng, anchors)
+    for _ in range(block_count):
+        roll = rng.random()
+        if roll < 0.15:
+            lines += heading_block(rng, anchors)
+        elif roll < 0.45:
+            lines += paragraph_block(rng, anchors, page_names)
+        elif roll < 0.65:
+            lines += list_block(rng, anchors, page_names)
+        elif roll < 0.73:
+            lines += preformatted_block(rng)
+        elif roll < 0.78:
+            lines += csv_table_block(rng, large)
+        elif roll < 0.86:
+            lines += pipe_table_block(rng, anchors, page_names, large)
+        else:
+            lines += misc_block(rng, page_names)
+        if rng.random() < 0.5:
+            lines.append('')
+    return '\n'.join(lines) + '\n'
+
+
+def page_encoding(seed, index, encoding):
+    """ページ index の文字コードを返します（mixed の場合はページごとに決めます）。"""
+    if encoding != 'mixed':
+        return encoding
+    return random.Random(f"{seed}:{index}:encoding").choice(ENCODINGS)
+
+
+def generate_corpus(page_count, encoding='mixed', seed=0):
+    """(ファイル名, 文字コード, ページの内容) を page_count 件返すジェネレーターです。"""
+    for index in range(page_count):
+        page_encoding_name = page_encoding(seed, index, encoding)
+        yield page_filename(page_name(seed, index), page_encoding_name), page_encoding_name, generate_page(seed, index)
+
+
+def write_corpus(directory, page_count, encoding='mixed', seed=0):
+    """コーパスを directory に書き出し、{ファイル名: 文字コード} と書き出したバイト数の合計を返します。"""
+    os.makedirs(directory, exist_ok=True)
+    encodings = {}
+    total_bytes = 0
+    for filename, page_encoding_name, text in generate_corpus(page_count, encoding, seed):
+        data = text.encode(page_encoding_name)
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(data)
+        encodings[filename] = page_encoding_name
+        total_bytes += len(data)
+    return encodings, total_bytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ベンチマーク用のPukiWikiページを生成します')
+    parser.add_argument('directory', help='出力ディレクトリ')
+    parser.add_argument('--pages', type=int, default=1000, help='ページ数')
+    parser.add_argument('--encoding', choices=ENCODING_CHOICES, default='mixed', help='ページの文字コード（mixed: ページごとに選ぶ）')
+    parser.add_argument('--seed', type=int, default=0, help='乱数の種')
+    args = parser.parse_args(argv)
+    encodings, total_bytes = write_corpus(args.directory, args.pages, args.encoding, args.seed)
+    print(f"{len(encodings)} ページ（{total_bytes / (1024 * 1024):.1f} MB）を '{args.directory}' に書き出しました。")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,222 @@
+"""
+2つの変換の実装の出力が一致することを確かめるハーネス
+
+コーパスの各ページを2つの実装（既定では legacy と stream）で変換し、出力を比較します。
+- ページはプロセスプールに分配して並列に変換します
+- 出力が異なるページは、差分の行だけを短い unified diff で表示します
+- 異なるページは、違いが再現する最小の断片まで縮小します（行単位 → 文字単位の delta debugging）
+- 2つの実装の変換時間の合計から速度比を求めます
+
+実装は変換エンジン名（legacy / stream）か、「モジュール:関数名」（例: my_engine:convert）で指定します。
+関数は PukiWiki のテキストを受け取り、Markdown のテキストを返すものとします。例外が発生した場合も差分として扱います。
+
+使い方:
+    python benchmarks/diff_engines.py [PukiWikiディレクトリ] [--generate 1000] [--baseline legacy] [--candidate stream]
+                                      [--workers 0] [--shrink 20] [--json 結果.json]
+
+PukiWikiディレクトリを省略した場合は benchmarks/corpus.py で --generate ページを生成して比較します。
+終了コードは、すべて一致すれば 0、異なるページがあれば 1 です。
+"""
+import argparse
+import difflib
+import importlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# 「モジュール:関数名」で指定する実装は作業ディレクトリからも読み込めるようにする（ワーカーのプロセスでも同じ）
+sys.path.insert(0, os.getcwd())
+import pukiwiki_to_markdown as converter
+import corpus
+
+DIFF_CONTEXT = 1 # 差分の前後に表示する行数
+DIFF_MAX_LINES = 40 # 1ページの差分として表示する最大の行数
+SHRINK_MAX_TESTS = 2000 # 1ページの縮小で変換を試す最大の回数
+
+_resolved = {}
+
+
+def resolve_converter(spec):
+    """変換エンジン名か「モジュール:関数名」から変換関数を返します。"""
+    if spec not in _resolved:
+        if spec in converter.CONVERTERS:
+            _resolved[spec] = converter.get_converter(dict(converter.DEFAULT_ADVANCED_SETTINGS, engine=spec))
+        else:
+            module_name, _, function_name = spec.partition(':')
+            if not function_name:
+                raise ValueError(f"実装 '{spec}' は変換エンジン名か「モジュール:関数名」で指定してください")
+            _resolved[spec] = getattr(importlib.import_module(module_name), function_name)
+    return _resolved[spec]
+
+
+def run_converter(function, text):
+    """変換して (出力, 処理時間) を返します。例外は出力の代わりに文字列で返します（差分として扱うため）。"""
+    start = time.perf_counter()
+    try:
+        output = function(text)
+    except Exception as e:
+        output = f"<例外 {type(e).__name__}: {e}>"
+    return output, time.perf_counter() - start
+
+
+def read_page(path):
+    """convert_file と同じく、文字コードを判別してデコードし、改行コードを \\n に揃えます。"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    encoding, text = converter.detect_encoding_from_bytes(data)
+    if text is None:
+        text = data.decode(encoding or 'utf-8', errors='replace')
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def compare_pages(task):
+    """ワーカー用: ページのリストを2つの実装で変換し、(ページ数, 各実装の時間の合計, 異なるページの一覧) を返します。"""
+    baseline_spec, candidate_spec, paths = task
+    baseline = resolve_converter(baseline_spec)
+    candidate = resolve_converter(candidate_spec)
+    baseline_seconds = candidate_seconds = 0.0
+    differences = []
+    for path in paths:
+        text = read_page(path)
+        expected, seconds = run_converter(baseline, text)
+        baseline_seconds += seconds
+        actual, seconds = run_converter(candidate, text)
+        candidate_seconds += seconds
+        if expected != actual:
+            differences.append({'file': os.path.basename(path), 'path': path, 'diff': minimal_diff(expected, actual)})
+    return len(paths), baseline_seconds, candidate_seconds, differences
+
+
+def minimal_diff(expected, actual):
+    """出力の違いを、前後 DIFF_CONTEXT 行だけを含む unified diff（最大 DIFF_MAX_LINES 行）で返します。"""
+    lines = list(difflib.unified_diff(expected.split('\n'), actual.split('\n'), 'baseline', 'candidate', n=DIFF_CONTEXT, lineterm=''))
+    if len(lines) > DIFF_MAX_LINES:
+        lines = lines[:DIFF_MAX_LINES] + [f"...（残り {len(lines) - DIFF_MAX_LINES} 行）"]
+    return '\n'.join(lines)
+
+
+def ddmin(items, fails, budget):
+    """
+    delta debugging（ddmin）: fails(items) が真のまま items をできるだけ小さくします。
+    budget は fails を呼び出せる残り回数の入ったリストです（縮小が終わらない場合に打ち切るため）。
+    """
+    granularity = 2
+    while len(items) >= 2 and budget[0] > 0:
+        chunk = -(-len(items) // granularity)
+        subsets = [items[start:start + chunk] for start in range(0, len(items), chunk)]
+        for index, subset in enumerate(subsets):
+            complement = [item for other, part in enumerate(subsets) if other != index for item in part]
+            if fails(subset):
+                items, granularity = subset, 2
+                break
+            if fails(complement):
+                items, granularity = complement, max(granularity - 1, 2)
+                break
+        else:
+            if granularity >= len(items):
+                break
+            granularity = min(len(items), granularity * 2)
+    return items
+
+
+def shrink_page(task):
+    """ワーカー用: 出力の違いが再現する最小の断片を求め、(断片, その差分, 試した回数) を返します。"""
+    baseline_spec, candidate_spec, path = task
+    baseline = resolve_converter(baseline_spec)
+    candidate = resolve_converter(candidate_spec)
+    budget = [SHRINK_MAX_TESTS]
+
+    def differs(text):
+        budget[0] -= 1
+        return run_converter(baseline, text)[0] != run_converter(candidate, text)[0]
+
+    text = read_page(path)
+    lines = ddmin(text.split('\n'), lambda part: budget[0] > 0 and differs('\n'.join(part)), budget)
+    characters = ddmin(list('\n'.join(lines)), lambda part: budget[0] > 0 and differs(''.join(part)), budget)
+    snippet = ''.join(characters)
+    if not differs(snippet):
+        # 打ち切った場合などで断片が再現しなければ、行単位の結果を使う
+        snippet = '\n'.join(lines)
+    expected = run_converter(baseline, snippet)[0]
+    actual = run_converter(candidate, snippet)[0]
+    return snippet, minimal_diff(expected, actual), SHRINK_MAX_TESTS - budget[0]
+
+
+def list_pages(pukiwiki_dir):
+    return sorted(os.path.join(pukiwiki_dir, name) for name in os.listdir(pukiwiki_dir)
+                  if name.endswith(('.txt', '.page')) and os.path.isfile(os.path.join(pukiwiki_dir, name)))
+
+
+def run(pukiwiki_dir, args):
+    paths = list_pages(pukiwiki_dir)
+    workers = max(1, min(converter.resolve_worker_count(args.workers), len(paths)))
+    chunk = max(1, min(64, len(paths) // (workers * 4) or 1))
+    tasks = [(args.baseline, args.candidate, paths[start:start + chunk]) for start in range(0, len(paths), chunk)]
+    print(f"{len(paths)} ページを '{args.baseline}'（基準）と '{args.candidate}'（比較対象）で変換して比較します。({workers} プロセス)")
+
+    page_count = 0
+    baseline_seconds = candidate_seconds = 0.0
+    differences = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for count, baseline_time, candidate_time, page_differences in executor.map(compare_pages, tasks):
+            page_count += count
+            baseline_seconds += baseline_time
+            candidate_seconds += candidate_time
+            differences += page_differences
+        shrink_targets = differences[:args.shrink]
+        shrink_tasks = [(args.baseline, args.candidate, difference['path']) for difference in shrink_targets]
+        for difference, (snippet, snippet_diff, tests) in zip(shrink_targets, executor.map(shrink_page, shrink_tasks)):
+            difference.update(snippet=snippet, snippet_diff=snippet_diff, shrink_tests=tests)
+    elapsed = time.perf_counter() - start
+
+    for difference in differences:
+        print(f"\n差分: {difference['file']}")
+        print(difference['diff'])
+        if 'snippet' in difference:
+            print(f"最小の再現例（{len(difference['snippet'])} 文字、{difference['shrink_tests']} 回の変換で縮小）:")
+            print(repr(difference['snippet']))
+            print(difference['snippet_diff'])
+
+    speed_ratio = baseline_seconds / candidate_seconds if candidate_seconds > 0 else None
+    print(f"\n結果: {page_count} ページ中 {len(differences)} ページで出力が異なります。（{elapsed:.1f} 秒）")
+    print(f"変換時間の合計: 基準 {baseline_seconds:.3f} 秒 / 比較対象 {candidate_seconds:.3f} 秒"
+          + (f"（比較対象は基準の x{speed_ratio:.2f} の速さ）" if speed_ratio else ''))
+    return {'baseline': args.baseline, 'candidate': args.candidate, 'pages': page_count, 'different': len(differences),
+            'baseline_seconds': round(baseline_seconds, 3), 'candidate_seconds': round(candidate_seconds, 3),
+            'speed_ratio': round(speed_ratio, 3) if speed_ratio else None,
+            'differences': [{key: value for key, value in difference.items() if key != 'path'} for difference in differences]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='2つの変換の実装の出力が一致することを確かめます')
+    parser.add_argument('pukiwiki_dir', nargs='?', help='比較するPukiWikiディレクトリ（省略時は生成したコーパス）')
+    parser.add_argument('--generate', type=int, default=1000, help='PukiWikiディレクトリを省略した場合に生成するページ数')
+    parser.add_argument('--encoding', choices=corpus.ENCODING_CHOICES, default='mixed', help='生成するページの文字コード')
+    parser.add_argument('--seed', type=int, default=0, help='生成するコーパスの乱数の種')
+    parser.add_argument('--baseline', default=converter.ENGINE_LEGACY, help='基準の実装（変換エンジン名か「モジュール:関数名」）')
+    parser.add_argument('--candidate', default=converter.ENGINE_STREAM, help='比較する実装（変換エンジン名か「モジュール:関数名」）')
+    parser.add_argument('--workers', type=int, default=0, help='並列数（0: CPU数）')
+    parser.add_argument('--shrink', type=int, default=20, help='最小の再現例まで縮小するページ数の上限')
+    parser.add_argument('--json', help='結果を保存するJSONファイル')
+    args = parser.parse_args(argv)
+
+    if args.pukiwiki_dir:
+        report = run(args.pukiwiki_dir, args)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            corpus.write_corpus(work_dir, args.generate, args.encoding, args.seed)
+            report = run(work_dir, args)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(dict(report, benchmark='diff_engines'), f, ensure_ascii=False, indent=2)
+    return 1 if report['different'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
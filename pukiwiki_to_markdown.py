@@ -1,12 +1,16 @@
 import argparse
+import atexit # 終了時にエラーログを書き込む用
+import collections # エラーログの記録をためる用、実行の記録の集計用
 import os
 import re
 import sys
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk # ttk をインポート
 import configparser # 設定ファイルの読み書き用
 import datetime # エラーログのタイムスタンプ用
+import hashlib # 更新変換でのファイル内容の比較用
+import heapq # プロファイルで時間のかかったページを集計する用
 import json # タイムスタンプファイルの読み書き用
+import queue # GUIとバックグラウンドの変換の間の受け渡し用
+import sqlite3 # タイムスタンプの記録をSQLiteに保存する場合用
 import threading # 自動更新機能用
 import time # 自動更新機能用
 
@@ -18,44 +22,178 @@ KEY_ENCODING = 'Encoding'
 KEY_CONVERSION_MODE = 'ConversionMode'  # 追加: 変換モード（全変換/更新変換）
 KEY_AUTO_UPDATE = 'AutoUpdate'  # 追加: 自動更新の有効/無効
 KEY_UPDATE_INTERVAL = 'UpdateInterval'  # 追加: 更新間隔（分）
+KEY_ENGINE = 'Engine'  # 変換エンジン（legacy/stream/scan）
+KEY_LITERAL_PREFORMATTED = 'LiteralPreformatted'  # 整形済みテキスト内でインライン記法を変換しない（streamのみ）
+KEY_WORKERS = 'Workers'  # 並列変換のプロセス数（1: 並列化しない、0: CPU数）
+KEY_MANIFEST_BACKEND = 'ManifestBackend'  # タイムスタンプの記録の保存先（markdown/sqlite）
+KEY_MANIFEST_PATH = 'ManifestPath'  # sqlite の場合のデータベースファイル（省略時は logs/manifest.sqlite3）
+KEY_CACHE_SIZE = 'CacheSize'  # 変換結果キャッシュの上限サイズ（MB、0: キャッシュしない）
+KEY_CACHE_PATH = 'CachePath'  # 変換結果キャッシュのファイル（省略時は logs/conversion_cache.sqlite3）
+KEY_LOG_JSONL = 'LogJsonl'  # エラーログと同じ内容を構造化ログ（logs/conversion_errors.jsonl）にも書き込む
+KEY_PROFILE = 'Profile'  # 変換の段階ごとの処理時間を計測して報告する
+KEY_METRICS = 'Metrics'  # 実行ごとの記録（ファイルごとの処理時間・バイト数など）を logs に保存する
 ERROR_LOG_FILE = 'conversion_errors.log' # エラーログファイル名
 LOG_DIR = 'logs' # エラーログを保存するディレクトリ
 TIMESTAMP_FILE = 'timestamps.md' # タイムスタンプファイル名
+CONCAT_INDEX_FILE = 'obsidian_segments.json' # 連結ファイル（日付_obsidian.md）のセグメント一覧（LOG_DIR 内）
+ENCODINGS_TO_TRY = ['utf-8', 'euc-jp', 'shift_jis'] # 文字コード自動判別で試す順番
+
+ENGINE_LEGACY = 'legacy' # 正規表現を文書全体に順に適用する従来の変換エンジン
+ENGINE_STREAM = 'stream' # 行単位の1回の走査で変換するエンジン
+ENGINE_SCAN = 'scan' # stream の行単位の走査に加え、インライン記法を入れ子も含めて1回の走査で変換するエンジン
+
+# INIファイルでのみ指定する詳細設定の既定値
+DEFAULT_ADVANCED_SETTINGS = {
+    'engine': ENGINE_LEGACY,
+    'literal_preformatted': False,
+    'workers': 1,
+    'manifest_backend': 'markdown',
+    'manifest_path': '',
+    'cache_size_mb': 100,
+    'cache_path': '',
+    'log_jsonl': False,
+    'profile': False,
+    'metrics': True,
+}
 
 # 自動更新用のグローバル変数
-auto_update_timer = None
+auto_update_watcher = None
 auto_update_running = False
+auto_update_thread = None # 自動更新（監視）スレッド
+auto_update_cancel_event = None # 自動更新による変換を中止するイベント（schedule_auto_update に渡されたもの）
+# 手動の変換と自動更新の変換が同じ出力ファイルと記録に同時に書き込まないよう、変換中はこのロックを持つ
+conversion_lock = threading.Lock()
 
-def write_error_log(message):
-    """エラーメッセージをタイムスタンプ付きでログファイルに書き込みます。"""
-    try:
-        # ログディレクトリが存在しない場合は作成
-        if not os.path.exists(LOG_DIR):
-            os.makedirs(LOG_DIR)
-        
+# --- エラーログ --- START
+ERROR_LOG_JSONL_FILE = 'conversion_errors.jsonl' # 構造化ログ（1行1件のJSON、LOG_DIR 内。LogJsonl を有効にした場合のみ）
+ERROR_LOG_BATCH = 1000 # この件数がたまったら、書き込み間隔を待たずにエラーログに書き込む
+ERROR_LOG_FLUSH_INTERVAL = 0.5 # ためたエラーログの記録を書き込む間隔（秒）
+
+class ErrorLogWriter:
+    """
+    エラーログの記録をメモリにため、バックグラウンドのスレッドでまとめて書き込みます。
+    記録するたびにログファイルを開き直さないため、エラーが大量に出るWikiでも変換が遅くなりません。
+    まだ書き込んでいない記録は flush() で書き込みます（終了時には atexit で必ず書き込みます）。
+    jsonl を有効にすると、人が読むログと同じ記録を ERROR_LOG_JSONL_FILE にも1行1件のJSONで書き込みます。
+    """
+    def __init__(self):
+        self.jsonl = False
+        self.pending = collections.deque()
+        self.wakeup = threading.Event()
+        self.write_lock = threading.Lock()
+        self.thread = None
+        self.pid = os.getpid()
+        atexit.register(self.flush)
+
+    def write(self, level, message, fields):
+        """記録を1件ためます（書き込みはバックグラウンドのスレッドが ERROR_LOG_FLUSH_INTERVAL ごとに行います）。"""
+        record = {'time': datetime.datetime.now(), 'level': level, 'message': message}
+        record.update(fields)
+        self.pending.append(record)
+        if self.thread is None:
+            with self.write_lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name='error-log', daemon=True)
+                    self.thread.start()
+        if len(self.pending) >= ERROR_LOG_BATCH:
+            self.wakeup.set()
+
+    def flush(self):
+        """ためている記録をすべて書き込みます（呼び出し元のスレッドで書き込み、終わるまで戻りません）。"""
+        with self.write_lock:
+            batch = []
+            while self.pending:
+                batch.append(self.pending.popleft())
+            self._write_batch(batch)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(ERROR_LOG_FLUSH_INTERVAL)
+            self.wakeup.clear()
+            self.flush()
+
+    def _write_batch(self, batch):
+        if not batch:
+            return
         log_file_path = os.path.join(LOG_DIR, ERROR_LOG_FILE)
-        with open(log_file_path, 'a', encoding='utf-8') as f:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            f.write(f"[{timestamp}] {message}\n")
-    except IOError as e:
-        # ログファイルへの書き込み自体に失敗した場合はコンソールに出力
-        print(f"重大なエラー: ログファイル '{log_file_path}' への書き込みに失敗しました: {e}", file=sys.stderr)
-        print(f"元のエラーメッセージ: {message}", file=sys.stderr)
-    except Exception as e:
-        print(f"ログ書き込み中に予期しないエラーが発生しました: {e}", file=sys.stderr)
-        print(f"元のエラーメッセージ: {message}", file=sys.stderr)
+        try:
+            # ログディレクトリが存在しない場合は作成
+            if not os.path.exists(LOG_DIR):
+                os.makedirs(LOG_DIR)
+
+            with open(log_file_path, 'a', encoding='utf-8') as f:
+                for record in batch:
+                    if record['level'] == 'error':
+                        f.write(f"[{record['time'].strftime('%Y-%m-%d %H:%M:%S')}] {record['message']}\n")
+            if self.jsonl:
+                log_file_path = os.path.join(LOG_DIR, ERROR_LOG_JSONL_FILE)
+                with open(log_file_path, 'a', encoding='utf-8') as f:
+                    for record in batch:
+                        line = dict(record, time=record['time'].isoformat(timespec='milliseconds'))
+                        f.write(json.dumps(line, ensure_ascii=False) + '\n')
+        except IOError as e:
+            # ログファイルへの書き込み自体に失敗した場合はコンソールに出力
+            print(f"重大なエラー: ログファイル '{log_file_path}' への書き込みに失敗しました: {e}", file=sys.stderr)
+            for record in batch:
+                print(f"元のエラーメッセージ: {record['message']}", file=sys.stderr)
+        except Exception as e:
+            print(f"ログ書き込み中に予期しないエラーが発生しました: {e}", file=sys.stderr)
+            for record in batch:
+                print(f"元のエラーメッセージ: {record['message']}", file=sys.stderr)
+
+_error_log_writer = None
+
+def get_error_log_writer():
+    """このプロセスのエラーログの書き込み先を返します（プロセスプールのワーカーでは別に作ります）。"""
+    global _error_log_writer
+    if _error_log_writer is None or _error_log_writer.pid != os.getpid():
+        _error_log_writer = ErrorLogWriter()
+    return _error_log_writer
+
+def configure_error_log(options=None):
+    """詳細設定の log_jsonl に従って、構造化ログ（JSONL）を書き込むかどうかを切り替えます。"""
+    options = options or DEFAULT_ADVANCED_SETTINGS
+    get_error_log_writer().jsonl = bool(options.get('log_jsonl', False))
+
+def write_error_log(message, **fields):
+    """
+    エラーメッセージをタイムスタンプ付きでログファイルに書き込みます。
+    書き込みはバックグラウンドでまとめて行います（すぐに書き込む必要があれば flush_error_log を呼び出します）。
+    fields には構造化ログに追加する項目（file など）を渡します。
+    """
+    get_error_log_writer().write('error', message, fields)
+
+def write_event_log(event, message, **fields):
+    """変換の開始・完了などの出来事を構造化ログ（JSONL）にだけ記録します（人が読むエラーログには書き込みません）。"""
+    writer = get_error_log_writer()
+    if writer.jsonl:
+        writer.write('info', message, dict(fields, event=event))
+
+def flush_error_log():
+    """まだ書き込んでいないエラーログの記録をすべて書き込みます。"""
+    if _error_log_writer is not None and _error_log_writer.pid == os.getpid():
+        _error_log_writer.flush()
+# --- エラーログ --- END
 
 def save_settings(pukiwiki_dir, markdown_dir, encoding, conversion_mode='full', auto_update=False, update_interval=60):
     """選択されたディレクトリとエンコーディング設定をINIファイルに保存します。"""
     config = configparser.ConfigParser()
-    config[CONFIG_SECTION] = {
+    # 手動で追加された詳細設定を消さないよう、既存の内容を読み込んでから上書きする
+    if os.path.exists(CONFIG_FILE):
+        try:
+            config.read(CONFIG_FILE, encoding='utf-8')
+        except configparser.Error as e:
+            print(f"既存の設定ファイルの読み込みに失敗しました: {e}", file=sys.stderr)
+    if not config.has_section(CONFIG_SECTION):
+        config.add_section(CONFIG_SECTION)
+    config[CONFIG_SECTION].update({
         KEY_PUKIWIKI_DIR: pukiwiki_dir,
         KEY_MARKDOWN_DIR: markdown_dir,
         KEY_ENCODING: encoding,
         KEY_CONVERSION_MODE: conversion_mode,
         KEY_AUTO_UPDATE: str(auto_update),
         KEY_UPDATE_INTERVAL: str(update_interval)
-    }
+    })
     try:
         with open(CONFIG_FILE, 'w', encoding='utf-8') as configfile:
             config.write(configfile)
@@ -79,22 +217,271 @@ def load_settings():
             print(f"設定ファイルの読み込み中にエラーが発生しました: {e}", file=sys.stderr)
     return '', '', 'auto', 'full', False, 60 # デフォルト値
 
-def convert_pukiwiki_to_markdown(pukiwiki_text):
+def load_advanced_settings():
+    """INIファイルから変換エンジンなどの詳細設定を読み込みます。"""
+    settings = dict(DEFAULT_ADVANCED_SETTINGS)
+    config = configparser.ConfigParser()
+    if os.path.exists(CONFIG_FILE):
+        try:
+            config.read(CONFIG_FILE, encoding='utf-8')
+            settings['engine'] = config.get(CONFIG_SECTION, KEY_ENGINE, fallback=settings['engine']).strip().lower()
+            settings['literal_preformatted'] = config.getboolean(CONFIG_SECTION, KEY_LITERAL_PREFORMATTED, fallback=settings['literal_preformatted'])
+            settings['workers'] = config.getint(CONFIG_SECTION, KEY_WORKERS, fallback=settings['workers'])
+            settings['manifest_backend'] = config.get(CONFIG_SECTION, KEY_MANIFEST_BACKEND, fallback=settings['manifest_backend']).strip().lower()
+            settings['manifest_path'] = config.get(CONFIG_SECTION, KEY_MANIFEST_PATH, fallback=settings['manifest_path']).strip()
+            settings['cache_size_mb'] = config.getint(CONFIG_SECTION, KEY_CACHE_SIZE, fallback=settings['cache_size_mb'])
+            settings['cache_path'] = config.get(CONFIG_SECTION, KEY_CACHE_PATH, fallback=settings['cache_path']).strip()
+            settings['log_jsonl'] = config.getboolean(CONFIG_SECTION, KEY_LOG_JSONL, fallback=settings['log_jsonl'])
+            settings['profile'] = config.getboolean(CONFIG_SECTION, KEY_PROFILE, fallback=settings['profile'])
+            settings['metrics'] = config.getboolean(CONFIG_SECTION, KEY_METRICS, fallback=settings['metrics'])
+        except (configparser.Error, IOError, ValueError) as e:
+            print(f"詳細設定の読み込み中にエラーが発生しました: {e}", file=sys.stderr)
+    return settings
+
+def convert_size(match):
+    """&size(サイズ){テキスト} のマッチをHTMLのspan要素に変換します。"""
+    return format_size_span(match.group(1), match.group(2))
+
+def format_size_span(size, text):
+    """&size(サイズ){テキスト} のサイズとテキストからHTMLのspan要素を作ります。"""
+    # サイズが数値のみの場合はpxを付加、既に単位がある場合はそのまま使用
+    if size.isdigit():
+        size += 'px'
+    return f'<span style="font-size: {size};">{text}</span>'
+
+def convert_color(match):
+    """&color(文字色,背景色){テキスト} のマッチをHTMLのspan要素に変換します。"""
+    return format_color_span(match.group(1), match.group(2))
+
+def format_color_span(colors, text):
+    """&color(文字色,背景色){テキスト} の色指定とテキストからHTMLのspan要素を作ります。"""
+    # カンマで区切られているかチェック
+    if ',' in colors:
+        color_parts = colors.split(',', 1)
+        text_color = color_parts[0].strip()
+        bg_color = color_parts[1].strip()
+        
+        # 空の色指定を処理
+        style_parts = []
+        if text_color:
+            style_parts.append(f'color: {text_color}')
+        if bg_color:
+            style_parts.append(f'background-color: {bg_color}')
+        
+        if style_parts:
+            style = '; '.join(style_parts)
+            return f'<span style="{style};">{text}</span>'
+        else:
+            return text  # 色指定がない場合はテキストのみ返す
+    else:
+        # 文字色のみの場合
+        text_color = colors.strip()
+        if text_color:
+            return f'<span style="color: {text_color};">{text}</span>'
+        else:
+            return text  # 色指定がない場合はテキストのみ返す
+
+_HEADING_LINK_RE = re.compile(r'\[\[#([^\]]+)\]\]')
+_HEADING_MARK_RE = re.compile(r'^#+', re.MULTILINE)
+
+def build_heading_anchor_index(markdown_text):
     """
-    PukiWikiのテキストをMarkdown形式に変換します。
+    見出しのアンカー [#id] から (見出しレベル, 見出しタイトル) への索引を1回の走査で作成します。
+    従来の検索 '^(#+)\s*([^[]*?)\s*\[#id\]' と同じく、'#' で始まる行から次の '[' までを
+    見出しとみなし、同じ id が複数ある場合は最初のものを採用します。
     """
-    markdown_text = pukiwiki_text
-
+    index = {}
+    heading_marks = [(m.start(), m.end() - m.start()) for m in _HEADING_MARK_RE.finditer(markdown_text)]
+    mark_count = len(heading_marks)
+    mark_idx = 0
+    previous_bracket = -1
+    bracket = markdown_text.find('[')
+    while bracket != -1:
+        # 直前の '[' より後にある最初の見出し行が、この '[' までを見出しとして持つ
+        while mark_idx < mark_count and heading_marks[mark_idx][0] < previous_bracket:
+            mark_idx += 1
+        if (mark_idx < mark_count and heading_marks[mark_idx][0] < bracket and
+                markdown_text.startswith('[#', bracket)):
+            close = markdown_text.find(']', bracket + 2)
+            if close > bracket + 2:
+                anchor_id = markdown_text[bracket + 2:close]
+                if anchor_id not in index:
+                    start, level = heading_marks[mark_idx]
+                    index[anchor_id] = (level, markdown_text[start + level:bracket].strip())
+        previous_bracket = bracket
+        bracket = markdown_text.find('[', bracket + 1)
+    return index
+
+def process_heading_links(text, anchor_index=None):
+    """
+    [[#文字列]]形式のリンクを処理し、同一ファイル内に対応する見出しがある場合、
+    リンク先の内容を追記します。
+    anchor_index に build_heading_anchor_index() の結果を渡すと、索引を再作成しません。
+    """
+    if anchor_index is None:
+        anchor_index = build_heading_anchor_index(text)
+    
+    def replace_heading_link(match):
+        anchor_id = match.group(1)
+        original_link = match.group(0)
+        
+        heading = anchor_index.get(anchor_id)
+        if heading:
+            # リンク先情報を追記
+            heading_title = heading[1]
+            return f"{original_link}\n  リンク先 [[#{heading_title} [ {anchor_id}]]]"
+        # 対応する見出しが見つからない場合は元のリンクをそのまま返す
+        return original_link
+    
+    # 全ての[[#文字列]]リンクを処理
+    return _HEADING_LINK_RE.sub(replace_heading_link, text)
+
+# --- 表組み変換 --- START
+# パイプ区切り表・カンマ区切り表を行単位で変換する共通部品。
+# convert_pukiwiki_to_markdown と convert_pukiwiki_to_markdown_stream の両方が使用する。
+# 各行の分割は1回だけ行い、列の揃え指定もデータ行を1回走査するだけで決定する。
+
+# 表の文字揃え指定: (指定, 省略形, 区切り行の記号)
+_TABLE_ALIGNMENTS = (
+    ('CENTER:', 'C:', ':---:'),
+    ('RIGHT:', 'R:', '---:'),
+    ('LEFT:', 'L:', ':---'),
+)
+# 揃え指定の先頭文字（大半のセルはこの判定だけで済ませる）
+_TABLE_ALIGNMENT_HEADS = ('C', 'R', 'L')
+
+def convert_csv_tables(lines):
+    """カンマ区切りテーブルの変換 (例: ,A,B,C や 空欄,A,B,C)"""
+    rows = []
+    for line in lines:
+        comma = line.find(',')
+        if comma == 0 or (comma > 0 and line.count(',') >= 2):
+            if not line.startswith('|'):
+                rows.append(line)
+                continue
+        if rows:
+            # 表の途中にあるカンマ1つだけの行や '|' で始まる行は、表を終了させず出力もしない（以前からの動作）
+            if comma != -1:
+                continue
+            yield from _csv_table_rows(rows)
+            rows = []
+        yield line
+    # ファイル末尾がカンマ区切りテーブルの場合
+    if rows:
+        yield from _csv_table_rows(rows)
+
+def _csv_table_rows(rows):
+    header_cells = rows[0].split(',')
+    # 先頭のセルが空の場合は除外
+    if header_cells[0] == '':
+        header_cells = header_cells[1:]
+    width = len(header_cells)
+
+    yield ''  # テーブルの前に改行を挿入
+    yield '| ' + ' | '.join(header_cells) + ' |'
+    yield '| ' + ' | '.join(['---'] * width) + ' |'
+    for row_line in rows[1:]:
+        cells = row_line.split(',')
+        if cells[0] == '':
+            cells = cells[1:]
+        # セル数がヘッダーセル数より少ない場合は空セルで埋め、多い場合は切り捨てる
+        if len(cells) < width:
+            cells.extend([''] * (width - len(cells)))
+        yield '| ' + ' | '.join(cells[:width]) + ' |'
+    yield ''
+
+def convert_pipe_tables(lines):
+    """パイプ区切りの表組みの変換 (|A|B|C| や |A|B|C|h)"""
+    rows = []
+    for line in lines:
+        if line.startswith('|') and (line.endswith('|') or line.endswith('|h')):
+            if line.endswith('|h'):
+                line = line[:-1]  # |h の h を除去して | で終わるようにする
+            rows.append(line)
+            continue
+        if rows:
+            yield from _pipe_table_rows(rows, at_eof=False)
+            rows = []
+        yield line
+    # ファイル末尾が表の場合
+    if rows:
+        yield from _pipe_table_rows(rows, at_eof=True)
+
+def _table_alignment(cell):
+    """セルの揃え指定に対応する区切り行の記号と指定部分の長さを返します。"""
+    for long_prefix, short_prefix, marker in _TABLE_ALIGNMENTS:
+        if cell.startswith(long_prefix):
+            return marker, len(long_prefix), len(long_prefix)
+        if cell.startswith(short_prefix):
+            return marker, len(short_prefix), len(long_prefix)
+    return None, 0, 0
+
+def _pipe_table_rows(rows, at_eof):
+    header_cells = [cell.strip('~').strip() for cell in rows[0].strip('|').split('|')]
+    cleaned_header_cells = []
+    column_alignments = []
+    for cell in header_cells:
+        marker, prefix_length, long_length = _table_alignment(cell)
+        if marker:
+            # 表が文書の途中にある場合、ヘッダーの省略形 (C: など) も正式名の長さで切り取る（以前からの動作）
+            cell = cell[prefix_length if at_eof else long_length:].strip()
+        cleaned_header_cells.append(cell)
+        column_alignments.append(marker or '---')
+
+    # ヘッダーで揃えが指定されていない列は、データ行の最初の指定を1回の走査で調べる
+    undecided = [col for col, alignment in enumerate(column_alignments) if alignment == '---']
+    body_lines = []
+    for row_line in rows[1:]:
+        cells = row_line.strip('|').split('|')
+        if undecided:
+            remaining = []
+            for col in undecided:
+                marker = None
+                if col < len(cells):
+                    cell = cells[col].strip()
+                    if cell.startswith(_TABLE_ALIGNMENT_HEADS):
+                        marker = _table_alignment(cell)[0]
+                if marker:
+                    column_alignments[col] = marker
+                else:
+                    remaining.append(col)
+            undecided = remaining
+        row_cells = []
+        for cell in cells:
+            cell = cell.strip('~').strip()
+            # 揃え指定を削除
+            if cell.startswith(_TABLE_ALIGNMENT_HEADS):
+                prefix_length = _table_alignment(cell)[1]
+                if prefix_length:
+                    cell = cell[prefix_length:].strip()
+            row_cells.append(cell)
+        body_lines.append('| ' + ' | '.join(row_cells) + ' |')
+
+    yield ''  # テーブルの前に改行を挿入
+    yield '| ' + ' | '.join(cleaned_header_cells) + ' |'
+    yield '| ' + ' | '.join(column_alignments) + ' |'
+    yield from body_lines
+    yield ''
+
+# --- 表組み変換 --- END
+
+# --- 従来の変換エンジンの各段階 --- START
+# convert_pukiwiki_to_markdown は文書全体に対して LEGACY_STAGES の各段階を順に適用する。
+# 段階ごとに関数を分けているのは、プロファイル（convert_with_profile）で段階ごとの処理時間を計測するため。
+
+def _legacy_comments(markdown_text):
     # コメントを除去 (行頭または空白の後の // から行末まで)
     # 以前の実装: markdown_text = re.sub(r'//.*$', '', markdown_text, flags=re.MULTILINE)
     # URLのhttps://などが誤って削除されるのを防ぐため、行頭または空白の後の//のみをコメントとして扱う
-    markdown_text = re.sub(r'(^|\s)//.*$', r'\1', markdown_text, flags=re.MULTILINE)
+    return re.sub(r'(^|\s)//.*$', r'\1', markdown_text, flags=re.MULTILINE)
 
+def _legacy_headings(markdown_text):
     # 見出しの変換
     markdown_text = re.sub(r'^\*\*\*(.+)$', r'### \1', markdown_text, flags=re.MULTILINE)
     markdown_text = re.sub(r'^\*\*(.+)$', r'## \1', markdown_text, flags=re.MULTILINE)
-    markdown_text = re.sub(r'^\*(.+)$', r'# \1', markdown_text, flags=re.MULTILINE)
+    return re.sub(r'^\*(.+)$', r'# \1', markdown_text, flags=re.MULTILINE)
 
+def _legacy_lists(markdown_text):
     # リストの変換
     markdown_text = re.sub(r'^- (.+)$', r'- \1', markdown_text, flags=re.MULTILINE)
     # プラス記号とテキストの間にスペースがない場合、スペースを追加
@@ -116,8 +503,9 @@ def convert_pukiwiki_to_markdown(pukiwiki_text):
     
     # 特定のパターンの修正（行頭以外の場所での-httpを- httpに変換）
     # URLパターン（https://、http://）は除外して、単独の-httpパターンのみを対象とする
-    markdown_text = re.sub(r'(?<!s:/)(?<!:\/)\-http(?!s?://)', r'- http', markdown_text)
+    return re.sub(r'(?<!s:/)(?<!:\/)\-http(?!s?://)', r'- http', markdown_text)
 
+def _legacy_list_indent(markdown_text):
     # リスト項目の後続行にインデントを追加
     lines = markdown_text.split('\n')
     
@@ -159,61 +547,26 @@ def convert_pukiwiki_to_markdown(pukiwiki_text):
         
         i += 1
     
-    markdown_text = '\n'.join(lines)
+    return '\n'.join(lines)
 
+def _legacy_emphasis(markdown_text):
     # 強調の変換
     markdown_text = re.sub(r"'''(.*?)'''", r'**\1**', markdown_text)
     markdown_text = re.sub(r"''(.*?)''", r'*\1*', markdown_text)
     
     # 取り消し線の変換 (PukiWiki: %%text%% -> Obsidian: ~~text~~)
     # 前後のスペースを削除して変換する
-    markdown_text = re.sub(r"%%(.+?)%%", lambda m: f'~~{m.group(1).strip()}~~', markdown_text)
+    return re.sub(r"%%(.+?)%%", lambda m: f'~~{m.group(1).strip()}~~', markdown_text)
 
+def _legacy_size_color(markdown_text):
     # フォントサイズ指定の変換 (PukiWiki: &size(サイズ){テキスト} -> Obsidian: <span style="font-size: サイズpx;">テキスト</span>)
-    def convert_size(match):
-        size = match.group(1)
-        text = match.group(2)
-        # サイズが数値のみの場合はpxを付加、既に単位がある場合はそのまま使用
-        if size.isdigit():
-            size += 'px'
-        return f'<span style="font-size: {size};">{text}</span>'
-    
     markdown_text = re.sub(r'&size\(([^)]+)\)\{([^}]+)\}', convert_size, markdown_text)
 
     # 色指定の変換 (PukiWiki: &color(色){テキスト} -> Obsidian: <span style="color: 色;">テキスト</span>)
     # &color(文字色,背景色){テキスト} -> <span style="color: 文字色; background-color: 背景色;">テキスト</span>
-    def convert_color(match):
-        colors = match.group(1)
-        text = match.group(2)
-        
-        # カンマで区切られているかチェック
-        if ',' in colors:
-            color_parts = colors.split(',', 1)
-            text_color = color_parts[0].strip()
-            bg_color = color_parts[1].strip()
-            
-            # 空の色指定を処理
-            style_parts = []
-            if text_color:
-                style_parts.append(f'color: {text_color}')
-            if bg_color:
-                style_parts.append(f'background-color: {bg_color}')
-            
-            if style_parts:
-                style = '; '.join(style_parts)
-                return f'<span style="{style};">{text}</span>'
-            else:
-                return text  # 色指定がない場合はテキストのみ返す
-        else:
-            # 文字色のみの場合
-            text_color = colors.strip()
-            if text_color:
-                return f'<span style="color: {text_color};">{text}</span>'
-            else:
-                return text  # 色指定がない場合はテキストのみ返す
-    
-    markdown_text = re.sub(r'&color\(([^)]*)\)\{([^}]+)\}', convert_color, markdown_text)
+    return re.sub(r'&color\(([^)]*)\)\{([^}]+)\}', convert_color, markdown_text)
 
+def _legacy_links(markdown_text):
     # リンクの変換 [[エイリアス>ページ名]] -> [[ページ名|エイリアス]] (Obsidian形式)
     markdown_text = re.sub(r'\[\[([^>\]]+)>([^\]]+)\]\]', r'[[\2|\1]]', markdown_text)
     # リンクの変換 [[ページ名]] -> [[ページ名]] (Obsidian形式, .md を削除)
@@ -221,12 +574,14 @@ def convert_pukiwiki_to_markdown(pukiwiki_text):
 
     # 画像の変換 #ref(画像ファイル名) -> ![[画像ファイル名]] (Obsidian形式)
     # #ref(画像ファイル名,altテキスト) -> ![[画像ファイル名]] (altテキストは無視)
-    markdown_text = re.sub(r'#ref\(([^,)]+)(?:,[^)]*)?\)', r'![[\1]]', markdown_text)
+    return re.sub(r'#ref\(([^,)]+)(?:,[^)]*)?\)', r'![[\1]]', markdown_text)
 
+def _legacy_line_breaks(markdown_text):
     # 行頭のbr/BRを改行に変換
     markdown_text = re.sub(r'^#br\s*$', '\n', markdown_text, flags=re.MULTILINE)
-    markdown_text = re.sub(r'^#BR\s*$', '\n', markdown_text, flags=re.MULTILINE)
+    return re.sub(r'^#BR\s*$', '\n', markdown_text, flags=re.MULTILINE)
 
+def _legacy_preformatted(markdown_text):
     # 整形済みテキスト (行頭が半角スペース) の変換
     # 元のテキスト位置を保持しながら処理
     lines = markdown_text.split('\n')
@@ -255,374 +610,779 @@ def convert_pukiwiki_to_markdown(pukiwiki_text):
         processed_lines.append(code_block)
 
     # processed_lines を結合してテキストを再構築
-    markdown_text = "\n".join(processed_lines)
+    return "\n".join(processed_lines)
 
+def _legacy_csv_tables(markdown_text):
     # カンマ区切りテーブルの変換
     # 例: ,A,B,C や 空欄,A,B,C
-    csv_table_lines = []
-    csv_other_lines = []
-    is_csv_table = False
-    for line in markdown_text.split('\n'):
-        # 行頭がカンマで始まるか、カンマを含む行を検出
-        if line.startswith(',') or (re.match(r'^[^,]+,', line) and line.count(',') >= 2):
-            # すでにテーブル行として処理されていないか確認（|| や | で始まる行は除外）
-            if not line.startswith('|'):
-                csv_table_lines.append(line)
-                is_csv_table = True
-                continue
-        
-        # テーブル行でない場合、または区切りを検出した場合
-        if is_csv_table and csv_table_lines and (not line.startswith(',') and not re.match(r'^[^,]+,', line)):
-            # テーブルの終了を検出
-            header = csv_table_lines[0]
-            header_cells = header.split(',')
-            
-            # 先頭のセルが空の場合は除外
-            if header_cells[0] == '':
-                header_cells = header_cells[1:]
-            
-            # テーブルのヘッダー行を生成
-            markdown_table = "| " + " | ".join(header_cells) + " |\n"
-            # 区切り行を生成
-            markdown_table += "| " + " | ".join(["---"] * len(header_cells)) + " |\n"
-            
-            # データ行の処理
-            for row_line in csv_table_lines[1:]:
-                cells = row_line.split(',')
-                
-                # 先頭のセルが空の場合は除外
-                if cells[0] == '':
-                    cells = cells[1:]
-                
-                # セル数がヘッダーセル数より少ない場合、空セルで埋める
-                while len(cells) < len(header_cells):
-                    cells.append('')
-                
-                # ヘッダーセル数より多い場合は切り捨て
-                cells = cells[:len(header_cells)]
-                
-                markdown_table += "| " + " | ".join(cells) + " |\n"
-            
-            csv_other_lines.append("") # テーブルの前に改行を挿入
-            csv_other_lines.append(markdown_table)
-            
-            # テーブル処理の終了
-            csv_table_lines = []
-            is_csv_table = False
-        
-        if not is_csv_table:
-            csv_other_lines.append(line)
-    
-    # ファイル末尾がカンマ区切りテーブルの場合の処理
-    if is_csv_table and csv_table_lines:
-        header = csv_table_lines[0]
-        header_cells = header.split(',')
-        
-        # 先頭のセルが空の場合は除外
-        if header_cells[0] == '':
-            header_cells = header_cells[1:]
-        
-        # テーブルのヘッダー行を生成
-        markdown_table = "| " + " | ".join(header_cells) + " |\n"
-        # 区切り行を生成
-        markdown_table += "| " + " | ".join(["---"] * len(header_cells)) + " |\n"
-        
-        # データ行の処理
-        for row_line in csv_table_lines[1:]:
-            cells = row_line.split(',')
-            
-            # 先頭のセルが空の場合は除外
-            if cells[0] == '':
-                cells = cells[1:]
-            
-            # セル数がヘッダーセル数より少ない場合、空セルで埋める
-            while len(cells) < len(header_cells):
-                cells.append('')
-            
-            # ヘッダーセル数より多い場合は切り捨て
-            cells = cells[:len(header_cells)]
-            
-            markdown_table += "| " + " | ".join(cells) + " |\n"
-        
-        csv_other_lines.append("") # テーブルの前に改行を挿入
-        csv_other_lines.append(markdown_table)
-    
-    markdown_text = "\n".join(csv_other_lines)
+    return "\n".join(convert_csv_tables(markdown_text.split('\n')))
 
+def _legacy_pipe_tables(markdown_text):
     # 表組みの変換 (簡易的な対応)
     # |A|B|C| や |~A|~B|~C| や |A|B|C|h (ヘッダー行)
-    table_lines = []
-    other_lines = []
-    is_table = False
-    for line in markdown_text.split('\n'):
-        # |h で終わる行（ヘッダー行）や |で終わる行をテーブル行として認識
-        if line.startswith('|') and (line.endswith('|') or line.endswith('|h')):
-            # |h で終わる行は |h を除去してからテーブル行として追加
-            if line.endswith('|h'):
-                line = line[:-1]  # |h の h を除去して | で終わるようにする
-            table_lines.append(line)
-            is_table = True
-        else:
-            if is_table: # 表の終わり
-                if table_lines:
-                    header = table_lines[0]
-                    header_cells = [cell.strip('~') for cell in header.strip('|').split('|')]
-                    
-                    # CENTER:, C: などの揃え指定をヘッダーセルから除去
-                    cleaned_header_cells = []
-                    for cell in header_cells:
-                        cell = cell.strip()
-                        if cell.startswith(('CENTER:', 'C:')):
-                            cell = cell[7:].strip()
-                        elif cell.startswith(('RIGHT:', 'R:')):
-                            cell = cell[6:].strip()
-                        elif cell.startswith(('LEFT:', 'L:')):
-                            cell = cell[5:].strip()
-                        cleaned_header_cells.append(cell)
-                    
-                    markdown_table = "| " + " | ".join(cleaned_header_cells) + " |\n"
-                    
-                    # 各列の配置を分析
-                    column_alignments = []
-                    for col_idx in range(len(cleaned_header_cells)):
-                        col_alignment = "---"  # デフォルトは左揃え
-                        
-                        # ヘッダー行から配置情報を取得
-                        if col_idx < len(header_cells):
-                            original_cell = header_cells[col_idx].strip()
-                            if original_cell.startswith(('CENTER:', 'C:')):
-                                col_alignment = ":---:"
-                            elif original_cell.startswith(('RIGHT:', 'R:')):
-                                col_alignment = "---:"
-                            elif original_cell.startswith(('LEFT:', 'L:')):
-                                col_alignment = ":---"
-                        
-                        # データ行からも配置情報を確認（ヘッダーで指定されていない場合）
-                        if col_alignment == "---":
-                            for row_idx in range(1, len(table_lines)):
-                                cells = table_lines[row_idx].strip('|').split('|')
-                                if col_idx < len(cells):
-                                    cell_content = cells[col_idx].strip()
-                                    # CENTER:, C: 指定の確認（中央揃え）
-                                    if cell_content.startswith(('CENTER:', 'C:')):
-                                        col_alignment = ":---:"
-                                        break
-                                    # RIGHT:, R: 指定の確認（右揃え）
-                                    elif cell_content.startswith(('RIGHT:', 'R:')):
-                                        col_alignment = "---:"
-                                        break
-                                    # LEFT:, L: 指定の確認（左揃え - 明示的に指定された場合）
-                                    elif cell_content.startswith(('LEFT:', 'L:')):
-                                        col_alignment = ":---"
-                                        break
-                        
-                        column_alignments.append(col_alignment)
-                    
-                    # 区切り行の作成
-                    markdown_table += "| " + " | ".join(column_alignments) + " |\n"
-                    
-                    # データ行の処理
-                    for row_line in table_lines[1:]:
-                        row_cells = []
-                        cells = row_line.strip('|').split('|')
-                        
-                        for i, cell in enumerate(cells):
-                            cell = cell.strip('~').strip()
-                            # 揃え指定を削除
-                            if cell.startswith(('CENTER:', 'C:')):
-                                if cell.startswith('CENTER:'):
-                                    cell = cell[7:].strip()
-                                else:  # C:
-                                    cell = cell[2:].strip()
-                            elif cell.startswith(('RIGHT:', 'R:')):
-                                if cell.startswith('RIGHT:'):
-                                    cell = cell[6:].strip()
-                                else:  # R:
-                                    cell = cell[2:].strip()
-                            elif cell.startswith(('LEFT:', 'L:')):
-                                if cell.startswith('LEFT:'):
-                                    cell = cell[5:].strip()
-                                else:  # L:
-                                    cell = cell[2:].strip()
-                            
-                            row_cells.append(cell)
-                        
-                        markdown_table += "| " + " | ".join(row_cells) + " |\n"
-                    
-                    other_lines.append("") # テーブルの前に改行を挿入
-                    other_lines.append(markdown_table)
-                table_lines = []
-                is_table = False
-            other_lines.append(line)
-
-    if is_table and table_lines: # ファイル末尾が表の場合
-        header = table_lines[0]
-        header_cells = [cell.strip('~') for cell in header.strip('|').split('|')]
-        
-        # CENTER:, C: などの揃え指定をヘッダーセルから除去
-        cleaned_header_cells = []
-        for cell in header_cells:
-            cell = cell.strip()
-            if cell.startswith(('CENTER:', 'C:')):
-                if cell.startswith('CENTER:'):
-                    cell = cell[7:].strip()
-                else:  # C:
-                    cell = cell[2:].strip()
-            elif cell.startswith(('RIGHT:', 'R:')):
-                if cell.startswith('RIGHT:'):
-                    cell = cell[6:].strip()
-                else:  # R:
-                    cell = cell[2:].strip()
-            elif cell.startswith(('LEFT:', 'L:')):
-                if cell.startswith('LEFT:'):
-                    cell = cell[5:].strip()
-                else:  # L:
-                    cell = cell[2:].strip()
-            cleaned_header_cells.append(cell)
-        
-        markdown_table = "| " + " | ".join(cleaned_header_cells) + " |\n"
-        
-        # 各列の配置を分析
-        column_alignments = []
-        for col_idx in range(len(cleaned_header_cells)):
-            col_alignment = "---"  # デフォルトは左揃え
-            
-            # ヘッダー行から配置情報を取得
-            if col_idx < len(header_cells):
-                original_cell = header_cells[col_idx].strip()
-                if original_cell.startswith(('CENTER:', 'C:')):
-                    col_alignment = ":---:"
-                elif original_cell.startswith(('RIGHT:', 'R:')):
-                    col_alignment = "---:"
-                elif original_cell.startswith(('LEFT:', 'L:')):
-                    col_alignment = ":---"
-            
-            # データ行からも配置情報を確認（ヘッダーで指定されていない場合）
-            if col_alignment == "---":
-                for row_idx in range(1, len(table_lines)):
-                    cells = table_lines[row_idx].strip('|').split('|')
-                    if col_idx < len(cells):
-                        cell_content = cells[col_idx].strip()
-                        # CENTER:, C: 指定の確認（中央揃え）
-                        if cell_content.startswith(('CENTER:', 'C:')):
-                            col_alignment = ":---:"
-                            break
-                        # RIGHT:, R: 指定の確認（右揃え）
-                        elif cell_content.startswith(('RIGHT:', 'R:')):
-                            col_alignment = "---:"
-                            break
-                        # LEFT:, L: 指定の確認（左揃え - 明示的に指定された場合）
-                        elif cell_content.startswith(('LEFT:', 'L:')):
-                            col_alignment = ":---"
-                            break
-            
-            column_alignments.append(col_alignment)
-        
-        # 区切り行の作成
-        markdown_table += "| " + " | ".join(column_alignments) + " |\n"
-        
-        # データ行の処理
-        for row_line in table_lines[1:]:
-            row_cells = []
-            cells = row_line.strip('|').split('|')
-            
-            for i, cell in enumerate(cells):
-                cell = cell.strip('~').strip()
-                # 揃え指定を削除
-                if cell.startswith(('CENTER:', 'C:')):
-                    if cell.startswith('CENTER:'):
-                        cell = cell[7:].strip()
-                    else:  # C:
-                        cell = cell[2:].strip()
-                elif cell.startswith(('RIGHT:', 'R:')):
-                    if cell.startswith('RIGHT:'):
-                        cell = cell[6:].strip()
-                    else:  # R:
-                        cell = cell[2:].strip()
-                elif cell.startswith(('LEFT:', 'L:')):
-                    if cell.startswith('LEFT:'):
-                        cell = cell[5:].strip()
-                    else:  # L:
-                        cell = cell[2:].strip()
-                
-                row_cells.append(cell)
-            
-            markdown_table += "| " + " | ".join(row_cells) + " |\n"
-        
-        other_lines.append("") # テーブルの前に改行を挿入
-        other_lines.append(markdown_table)
-
-    markdown_text = "\n".join(other_lines)
+    return "\n".join(convert_pipe_tables(markdown_text.split('\n')))
 
+def _legacy_anchors(markdown_text):
+    # [#文字列] 形式のパターンを削除
+    return re.sub(r'\[#[^\]]+\]', '', markdown_text)
+
+# 従来の変換エンジンの段階（名前, 変換関数）。この順に適用する
+LEGACY_STAGES = (
+    ('comments', _legacy_comments),
+    ('headings', _legacy_headings),
+    ('lists', _legacy_lists),
+    ('list_indent', _legacy_list_indent),
+    ('emphasis', _legacy_emphasis),
+    ('size_color', _legacy_size_color),
+    ('links', _legacy_links),
+    ('line_breaks', _legacy_line_breaks),
+    ('preformatted', _legacy_preformatted),
+    ('csv_tables', _legacy_csv_tables),
+    ('pipe_tables', _legacy_pipe_tables),
     # [[#文字列]]リンクの処理：同一ファイル内に対応する見出しがある場合、リンク先情報を追記
-    def process_heading_links(text):
-        """
-        [[#文字列]]形式のリンクを処理し、同一ファイル内に対応する見出しがある場合、
-        リンク先の内容を追記します。
-        """
-        # [[#文字列]]パターンを検索
-        heading_link_pattern = r'\[\[#([^\]]+)\]\]'
-        
-        def replace_heading_link(match):
-            anchor_id = match.group(1)
-            original_link = match.group(0)
-            
-            # 同一テキスト内で [#anchor_id] を含む見出し行を検索
-            heading_pattern = r'^(#+)\s*([^[]*?)\s*\[#' + re.escape(anchor_id) + r'\].*$'
-            heading_matches = re.findall(heading_pattern, text, re.MULTILINE)
-            
-            if heading_matches:
-                # 最初に見つかった見出しを使用
-                heading_level, heading_title = heading_matches[0]
-                heading_title = heading_title.strip()
-                
-                # リンク先情報を追記
-                result = f"{original_link}\n  リンク先 [[#{heading_title} [ {anchor_id}]]]"
-                return result
-            else:
-                # 対応する見出しが見つからない場合は元のリンクをそのまま返す
-                return original_link
-        
-        # 全ての[[#文字列]]リンクを処理
-        return re.sub(heading_link_pattern, replace_heading_link, text)
-    
-    # 見出しリンクの処理を実行
-    markdown_text = process_heading_links(markdown_text)
+    ('heading_links', process_heading_links),
+    ('anchors', _legacy_anchors),
+)
+# --- 従来の変換エンジンの各段階 --- END
+
+# --- 記法の事前確認 --- START
+# 大半のページは表・色指定・アンカーなどを含まないため、変換の前にページが含む記法を1回だけ調べ（sniff_features）、
+# 出力を変えることのない段階を省く。調べた結果は記法ごとのビット（FEATURE_*）の論理和で表す。
+# 前の段階の変換で後の段階の記法が現れる場合があるため、その記法のビットも立てておく（省いてよいと言える段階だけを省く）。
+# - 色指定のない &color(){テキスト} はテキストだけになり、前後の文字と合わせて任意の記法を作り得る
+# - &size / &color の <span style="...">（引数の [[ や # を含む）は、'">' が [[エイリアス>ページ名]] の > になるなど、
+#   リンク・見出しへのリンク・アンカーを作り得る
+# - 行をまたぐ [[エイリアス>ページ名]] は [[ページ名|エイリアス]] の順に並べ替えるため、| で始まる行や
+#   カンマを2つ含む行（表の行）を作り得る
+# - [[エイリアス>#アンカー]] と #ref(#...) は変換後に [[# を含む。[[ の並べ替えや #ref(...) の ![[...]] は、
+#   後ろの [#アンカー] と合わせて [[#アンカー]] を作り得る（#ref([#a) -> ![[[#a]]）
+# - 整形済みテキストの行は先頭のスペースを除くため、' ,' や ' |' で始まる行は表の行になる
+# - カンマ区切りテーブルは表組みの行を出力する
+FEATURE_COMMENT = 1 << 0 # // コメント
+FEATURE_HEADING = 1 << 1 # 行頭の * 見出し
+FEATURE_LIST = 1 << 2 # 行頭の - / + リスト、-http
+FEATURE_LIST_ITEM = 1 << 3 # 後続行にインデントを付けるリスト項目（- / * / + と空白で始まる行）
+FEATURE_EMPHASIS = 1 << 4 # '' / ''' 強調、%% 取り消し線
+FEATURE_SIZE = 1 << 5 # &size(
+FEATURE_COLOR = 1 << 6 # &color(
+FEATURE_LINK = 1 << 7 # [[ リンク、#ref( 画像
+FEATURE_LINE_BREAK = 1 << 8 # #br / #BR
+FEATURE_PREFORMATTED = 1 << 9 # 行頭のスペース
+FEATURE_CSV_TABLE = 1 << 10 # カンマ区切りテーブルの行
+FEATURE_PIPE_TABLE = 1 << 11 # | で始まる表組みの行
+FEATURE_HEADING_LINK = 1 << 12 # [[#アンカー]] リンク
+FEATURE_ANCHOR = 1 << 13 # [#アンカー]
+
+FEATURE_NAMES = (
+    (FEATURE_COMMENT, 'comment'),
+    (FEATURE_HEADING, 'heading'),
+    (FEATURE_LIST, 'list'),
+    (FEATURE_LIST_ITEM, 'list_item'),
+    (FEATURE_EMPHASIS, 'emphasis'),
+    (FEATURE_SIZE, 'size'),
+    (FEATURE_COLOR, 'color'),
+    (FEATURE_LINK, 'link'),
+    (FEATURE_LINE_BREAK, 'line_break'),
+    (FEATURE_PREFORMATTED, 'preformatted'),
+    (FEATURE_CSV_TABLE, 'csv_table'),
+    (FEATURE_PIPE_TABLE, 'pipe_table'),
+    (FEATURE_HEADING_LINK, 'heading_link'),
+    (FEATURE_ANCHOR, 'anchor'),
+)
+# 色指定のない &color(){テキスト} の後に適用する段階の記法（どれが現れるかは変換するまで分からない）
+_FEATURES_AFTER_BARE_COLOR = (FEATURE_LINK | FEATURE_LINE_BREAK | FEATURE_PREFORMATTED | FEATURE_CSV_TABLE
+                              | FEATURE_PIPE_TABLE | FEATURE_HEADING_LINK | FEATURE_ANCHOR)
+# &size / &color の <span> の出力が作り得る記法
+_FEATURES_AFTER_SPAN = FEATURE_LINK | FEATURE_HEADING_LINK | FEATURE_ANCHOR
+# 行をまたぐリンクの並べ替えが作り得る記法
+_FEATURES_AFTER_MULTILINE_LINK = FEATURE_CSV_TABLE | FEATURE_PIPE_TABLE
+
+# 段階ごとの、その段階が出力を変え得る記法。いずれのビットも立っていないページではその段階を省く
+LEGACY_STAGE_FEATURES = {
+    'comments': FEATURE_COMMENT,
+    'headings': FEATURE_HEADING,
+    'lists': FEATURE_LIST,
+    'list_indent': FEATURE_LIST | FEATURE_LIST_ITEM,
+    'emphasis': FEATURE_EMPHASIS,
+    'size_color': FEATURE_SIZE | FEATURE_COLOR,
+    'links': FEATURE_LINK,
+    'line_breaks': FEATURE_LINE_BREAK,
+    'preformatted': FEATURE_PREFORMATTED,
+    'csv_tables': FEATURE_CSV_TABLE,
+    'pipe_tables': FEATURE_CSV_TABLE | FEATURE_PIPE_TABLE,
+    'heading_links': FEATURE_HEADING_LINK,
+    'anchors': FEATURE_HEADING_LINK | FEATURE_ANCHOR,
+}
+
+_SNIFF_LIST_ITEM_RE = re.compile(r'^\s*[-*+] ', re.MULTILINE)
+_SNIFF_CSV_ROW_RE = re.compile(r'^ ?,|,[^\n]*,', re.MULTILINE)
+_SNIFF_BARE_COLOR_RE = re.compile(r'&color\([\s,]*\)')
+_SNIFF_MULTILINE_LINK_RE = re.compile(r'\[\[[^\]]*\n')
+
+def _has_line_starting_with(text, prefixes):
+    return text.startswith(prefixes) or any('\n' + prefix in text for prefix in prefixes)
+
+def sniff_features(pukiwiki_text):
+    """
+    ページが含む記法を調べ、FEATURE_* の論理和を返します（変換の途中で現れる記法も含みます）。
+    文字列の検索と数個の正規表現の検索だけで調べるため、変換よりも十分に速く済みます。
+    """
+    text = pukiwiki_text
+    features = 0
+    if '//' in text:
+        features |= FEATURE_COMMENT
+    if _has_line_starting_with(text, ('*',)):
+        features |= FEATURE_HEADING
+    if _has_line_starting_with(text, ('-', '+')) or '-http' in text:
+        features |= FEATURE_LIST
+    if _SNIFF_LIST_ITEM_RE.search(text):
+        features |= FEATURE_LIST_ITEM
+    if "''" in text or '%%' in text:
+        features |= FEATURE_EMPHASIS
+    if '&size(' in text:
+        features |= FEATURE_SIZE | _FEATURES_AFTER_SPAN
+    if '&color(' in text:
+        features |= FEATURE_COLOR | _FEATURES_AFTER_SPAN
+        if _SNIFF_BARE_COLOR_RE.search(text):
+            features |= _FEATURES_AFTER_BARE_COLOR
+    if '[[' in text:
+        features |= FEATURE_LINK
+        if '\n' in text and _SNIFF_MULTILINE_LINK_RE.search(text):
+            features |= _FEATURES_AFTER_MULTILINE_LINK
+    elif '#ref(' in text:
+        features |= FEATURE_LINK
+    if '#br' in text or '#BR' in text:
+        features |= FEATURE_LINE_BREAK
+    if _has_line_starting_with(text, (' ',)):
+        features |= FEATURE_PREFORMATTED
+    if ',' in text and _SNIFF_CSV_ROW_RE.search(text):
+        features |= FEATURE_CSV_TABLE
+    if _has_line_starting_with(text, ('|', ' |')):
+        features |= FEATURE_PIPE_TABLE
+    if '[[#' in text or '>#' in text or '#ref(#' in text:
+        features |= FEATURE_HEADING_LINK | FEATURE_ANCHOR
+    elif '[#' in text and ('[[' in text or '#ref(' in text):
+        features |= FEATURE_HEADING_LINK | FEATURE_ANCHOR
+    elif '[#' in text:
+        features |= FEATURE_ANCHOR
+    return features
+
+def feature_names(features):
+    """FEATURE_* の論理和を記法の名前のリストにします。"""
+    return [name for feature, name in FEATURE_NAMES if features & feature]
+
+def legacy_stages_for(features):
+    """features のページに適用する LEGACY_STAGES の段階（名前, 変換関数）のリストを返します。"""
+    return [(name, stage) for name, stage in LEGACY_STAGES if LEGACY_STAGE_FEATURES[name] & features]
+# --- 記法の事前確認 --- END
+
+# --- 変換規則のバージョン --- START
+# 記法ごとの変換規則のバージョン。同じ入力に対する変換結果が変わる修正をしたら、その記法の規則のバージョンを上げる
+# （例: &color の変換を直したら 'color' を上げる）。タイムスタンプの記録にはページが含む記法と、変換に使った規則の
+# バージョンを保存し、規則の変更の反映（変換モード 'affected'）では、バージョンが上がった規則で変換したページだけを変換し直す。
+# 'base' は記法によらずすべてのページに適用する規則。新しい記法に対応した場合は、既存のページがその記法を含むかを
+# 記録から判断できないため 'base' を上げる（すべてのページが変換し直しの対象になる）。
+# 記法の事前確認（sniff_features）を直して段階を省くページが変わった場合も、出力が変わり得る記法の規則を上げる。
+CONVERSION_RULE_VERSIONS = {
+    'base': 1,
+    'comment': 1,
+    'heading': 1,
+    'list': 1,
+    'list_item': 1,
+    'emphasis': 1,
+    'size': 2,
+    'color': 2,
+    'link': 3,
+    'line_break': 1,
+    'preformatted': 1,
+    'csv_table': 1,
+    'pipe_table': 1,
+    'heading_link': 1,
+    'anchor': 1,
+}
+
+def format_rule_versions(features):
+    """features のページの変換に使う規則とそのバージョンを、タイムスタンプの記録に保存する形式（'base:1,heading:1'）で返します。"""
+    return ','.join(f"{name}:{CONVERSION_RULE_VERSIONS[name]}" for name in ['base'] + feature_names(features))
+
+def get_changed_rules(rule_versions):
+    """記録された規則のバージョン（format_rule_versions の形式）のうち、現在のバージョンと異なる規則の名前のリストを返します。"""
+    changed = []
+    for item in rule_versions.split(','):
+        name, _, version = item.partition(':')
+        if str(CONVERSION_RULE_VERSIONS.get(name)) != version:
+            changed.append(name)
+    return changed
+# --- 変換規則のバージョン --- END
+
+def convert_pukiwiki_to_markdown(pukiwiki_text, features=None):
+    """
+    PukiWikiのテキストをMarkdown形式に変換します。
+    ページが含まない記法の段階は省きます。features に sniff_features の結果を渡すと、記法を調べ直しません。
+    """
+    if features is None:
+        features = sniff_features(pukiwiki_text)
+    markdown_text = pukiwiki_text
+    for _, stage in legacy_stages_for(features):
+        markdown_text = stage(markdown_text)
+    return markdown_text.strip()
 
-    # [#文字列] 形式のパターンを削除
-    markdown_text = re.sub(r'\[#[^\]]+\]', '', markdown_text)
+# --- 行単位ストリーミング変換エンジン --- START
+# convert_pukiwiki_to_markdown は文書全体に対して約30回の正規表現置換を順に適用するため、
+# 置換のたびに文書全体のコピーが作られる。ここでは各行を先頭文字で1回だけ分類し、
+# 行単位のジェネレーターを連結して1回の走査でMarkdownを出力する。
+# 出力は従来実装とバイト単位で一致させる。従来実装では行をまたいで一致する記法
+# （閉じていない &size( や [[、単独の "-" 行など）を見つけた場合は、同じ結果を
+# 保証するためそのページだけ従来実装で変換する。
+
+_STREAM_COMMENT_RE = re.compile(r'(^|\s)//.*$')
+_STREAM_HTTP_LIST_RULES = (
+    (re.compile(r'^---http(?!s?://)'), '- -- http'),
+    (re.compile(r'^--http(?!s?://)'), '- - http'),
+    (re.compile(r'^-http(?!s?://)'), '- http'),
+)
+_STREAM_DASH_LIST_RULES = (
+    (re.compile(r'^-([^ ](?!http).+)$'), r'- \1'),
+    (re.compile(r'^--([^ ](?!http).+)$'), r'-- \1'),
+    (re.compile(r'^---([^ ](?!http).+)$'), r'---- \1'),
+)
+_STREAM_INLINE_HTTP_RE = re.compile(r'(?<!s:/)(?<!:\/)\-http(?!s?://)')
+_STREAM_BOLD_RE = re.compile(r"'''(.*?)'''")
+_STREAM_ITALIC_RE = re.compile(r"''(.*?)''")
+_STREAM_STRIKE_RE = re.compile(r"%%(.+?)%%")
+_STREAM_SIZE_RE = re.compile(r'&size\(([^)]+)\)\{([^}]+)\}')
+_STREAM_COLOR_RE = re.compile(r'&color\(([^)]*)\)\{([^}]+)\}')
+_STREAM_ALIAS_LINK_RE = re.compile(r'\[\[([^>\]]+)>([^\]]+)\]\]')
+_STREAM_REF_RE = re.compile(r'#ref\(([^,)]+)(?:,[^)]*)?\)')
+_STREAM_ANCHOR_RE = re.compile(r'\[#[^\]]+\]')
+# 行末までに閉じていない記法（従来実装では次の行以降まで一致する可能性がある）
+_STREAM_OPEN_SIZE_RE = re.compile(r'&size\((?:[^)]*$|[^)]+\)\{[^}]*$)')
+_STREAM_OPEN_COLOR_RE = re.compile(r'&color\((?:[^)]*$|[^)]*\)\{[^}]*$)')
+_STREAM_OPEN_ALIAS_LINK_RE = re.compile(r'\[\[(?:[^>\]]*$|[^>\]]+>[^\]]*$)')
+_STREAM_OPEN_REF_RE = re.compile(r'#ref\((?:[^,)]*$|[^,)]+,[^)]*$)')
+# 整形済みテキストを退避する際の目印（'[' を含めて見出し検索がコードブロックをまたがないようにする）
+_STREAM_LITERAL_TOKEN = '\x00[literal:{}]\x00'
+_STREAM_LITERAL_TOKEN_RE = re.compile(r'\x00\[literal:(\d+)\]\x00')
+
+class _StreamFallback(Exception):
+    """行単位の処理では従来実装と同じ結果を保証できないページで送出します。"""
+
+def _strike_replacement(match):
+    return f'~~{match.group(1).strip()}~~'
+
+def _stream_text_lines(lines, strict, literal_preformatted, inline_scanner=False):
+    """
+    コメント・見出し・リスト・リストの後続行インデント・インライン記法を1行ずつ変換します。
+    inline_scanner=True の場合、インライン記法は正規表現の代わりに scan_inline で変換します。
+    """
+    in_list_item = False
+    for line in lines:
+        # コメントを除去 (行頭または空白の後の // から行末まで)
+        if '//' in line:
+            line = _STREAM_COMMENT_RE.sub(r'\1', line)
+
+        head = line[:1]
+        if head == '*':
+            # 見出しの変換
+            if line.startswith('***') and len(line) > 3:
+                line = '### ' + line[3:]
+            elif line.startswith('**') and len(line) > 2:
+                line = '## ' + line[2:]
+            elif len(line) > 1:
+                line = '# ' + line[1:]
+        elif head == '+':
+            # 単独の "+" は従来実装では次の行と連結して一致する
+            if line == '+' and strict:
+                raise _StreamFallback()
+            if len(line) >= 3 and line[1] != ' ':
+                line = '+ ' + line[1:]
+            if line.startswith('+ ') and len(line) >= 3:
+                line = '* ' + line[2:]
+        elif head == '-':
+            # 単独の "-" "--" は従来実装では次の行と連結して一致する
+            if line in ('-', '--') and strict:
+                raise _StreamFallback()
+            if 'http' in line:
+                for pattern, replacement in _STREAM_HTTP_LIST_RULES:
+                    line = pattern.sub(replacement, line)
+            for pattern, replacement in _STREAM_DASH_LIST_RULES:
+                line = pattern.sub(replacement, line)
+
+        if '-http' in line:
+            line = _STREAM_INLINE_HTTP_RE.sub('- http', line)
+
+        # リスト項目の後続行にインデントを追加
+        stripped_line = line.strip()
+        if stripped_line.startswith(('- ', '* ', '+ ')):
+            in_list_item = True
+        elif in_list_item:
+            if (not stripped_line or
+                stripped_line.startswith(('#', '|', '```'))):
+                in_list_item = False
+            elif not line.startswith(('\t', '    ')):
+                line = '\t' + line
+
+        # 整形済みテキストとなる行にはインライン記法を適用しない（literal_preformatted 指定時）
+        if literal_preformatted and line.startswith(' '):
+            yield line
+            continue
+
+        if inline_scanner:
+            yield scan_inline(line)
+            continue
+
+        if "''" in line:
+            line = _STREAM_BOLD_RE.sub(r'**\1**', line)
+            line = _STREAM_ITALIC_RE.sub(r'*\1*', line)
+        if '%%' in line:
+            line = _STREAM_STRIKE_RE.sub(_strike_replacement, line)
+        if '&size(' in line:
+            if strict and _STREAM_OPEN_SIZE_RE.search(line):
+                raise _StreamFallback()
+            line = _STREAM_SIZE_RE.sub(convert_size, line)
+        if '&color(' in line:
+            if strict and _STREAM_OPEN_COLOR_RE.search(line):
+                raise _StreamFallback()
+            line = _STREAM_COLOR_RE.sub(convert_color, line)
+        if '[[' in line:
+            if strict and _STREAM_OPEN_ALIAS_LINK_RE.search(line):
+                raise _StreamFallback()
+            line = _STREAM_ALIAS_LINK_RE.sub(r'[[\2|\1]]', line)
+        if '#ref(' in line:
+            if strict and _STREAM_OPEN_REF_RE.search(line):
+                raise _StreamFallback()
+            line = _STREAM_REF_RE.sub(r'![[\1]]', line)
+        yield line
+
+def _stream_break_lines(lines, directive):
+    """
+    行頭の #br / #BR を改行に変換します。
+    従来実装の '^#br\\s*$' は直後の空白だけの行も巻き込むため、それらの行も取り除きます。
+    """
+    absorbing = False
+    for line in lines:
+        if absorbing:
+            if not line or line.isspace():
+                continue
+            absorbing = False
+        if line.startswith(directive) and (len(line) == len(directive) or line[len(directive):].isspace()):
+            yield ''
+            yield ''
+            absorbing = True
+            continue
+        yield line
 
+def _stream_preformatted_lines(lines, literal_blocks):
+    """行頭が半角スペースの連続行をコードブロックに変換します。"""
+    block = None
+    for line in lines:
+        if line.startswith(' '):
+            if block is None:
+                block = []
+            block.append(line[1:])  # 先頭のスペースを除去
+            continue
+        if block is not None:
+            yield from _stream_code_block(block, literal_blocks)
+            block = None
+        yield line
+    # ファイル末尾が整形済みテキストの場合
+    if block is not None:
+        yield from _stream_code_block(block, literal_blocks)
+
+def _stream_code_block(block, literal_blocks):
+    if literal_blocks is None:
+        yield '```'
+        yield from block
+        yield '```'
+    else:
+        # 後段の表・見出しリンク処理から保護するため、目印に置き換えて最後に戻す
+        literal_blocks.append('\n'.join(['```'] + block + ['```']))
+        yield _STREAM_LITERAL_TOKEN.format(len(literal_blocks) - 1)
+
+def _convert_stream(pukiwiki_text, literal_preformatted, inline_scanner=False):
+    # インライン記法のスキャナーを使う場合、行をまたぐインライン記法では切り替えない（リストなど行単位の記法では切り替える）
+    strict = not literal_preformatted
+    literal_blocks = [] if literal_preformatted else None
+
+    lines = _stream_text_lines(pukiwiki_text.split('\n'), strict, literal_preformatted, inline_scanner)
+    lines = _stream_break_lines(lines, '#br')
+    lines = _stream_break_lines(lines, '#BR')
+    lines = _stream_preformatted_lines(lines, literal_blocks)
+    lines = convert_csv_tables(lines)
+    lines = convert_pipe_tables(lines)
+    markdown_text = '\n'.join(lines)
+
+    # 見出しリンクとアンカー削除は文書全体を参照するため、最後にまとめて行う
+    if '[[#' in markdown_text:
+        markdown_text = process_heading_links(markdown_text)
+    if '[#' in markdown_text:
+        markdown_text = _STREAM_ANCHOR_RE.sub('', markdown_text)
+    if literal_blocks:
+        markdown_text = _STREAM_LITERAL_TOKEN_RE.sub(lambda m: literal_blocks[int(m.group(1))], markdown_text)
     return markdown_text.strip()
 
+def convert_pukiwiki_to_markdown_stream(pukiwiki_text, literal_preformatted=False):
+    """
+    PukiWikiのテキストを行単位の1回の走査でMarkdown形式に変換します。
+    出力は convert_pukiwiki_to_markdown と同一です。
+    literal_preformatted=True の場合は、整形済みテキストの中でインライン記法・表・
+    見出しリンクの変換を行いません（従来実装とは出力が異なります）。
+    """
+    try:
+        return _convert_stream(pukiwiki_text, literal_preformatted)
+    except _StreamFallback:
+        return convert_pukiwiki_to_markdown(pukiwiki_text)
+
+# --- 行単位ストリーミング変換エンジン --- END
+
+# --- インライン記法のスキャナー --- START
+# 従来実装は強調・斜体・取り消し線・&size・&color・リンク・#ref をそれぞれ文書全体への正規表現置換で変換するため、
+# 記法の種類の数だけ文書全体を走査し直し、{([^}]+)} のパターンでは &color(red){&size(20){x}} のような入れ子も扱えない。
+# scan_inline は1行を左から右へ1回だけ走査し、記法の開始を見つけるたびにその記法の処理関数に任せる。
+# 記法の中身は再帰的に走査するため、入れ子の記法も内側から変換される。
+# 閉じていない記法は、従来実装と同じくその部分を変換せずにそのまま出力する。
+
+_INLINE_TOKEN_RE = re.compile(r"'''''|'''|''|%%|&size\(|&color\(|\[\[|#ref\(|\}")
+INLINE_MAX_DEPTH = 32 # 入れ子として変換する最大の深さ（これより深い記法はそのまま出力する）
+
+def _scan_inline(text, pos, in_braces, depth, memo):
+    """
+    text[pos:] のインライン記法を変換し、(出力, 走査を終えた位置, '}' で閉じたかどうか) を返します。
+    in_braces が真の場合は、対応する '}' に達した時点で走査を終えます。
+    memo には1行の走査の間だけ使う辞書を渡します（_scan_braced を参照）。
+    """
+    output = []
+    while True:
+        match = _INLINE_TOKEN_RE.search(text, pos)
+        if match is None:
+            output.append(text[pos:])
+            return ''.join(output), len(text), False
+        token = match.group()
+        output.append(text[pos:match.start()])
+        if token == '}':
+            if in_braces:
+                return ''.join(output), match.end(), True
+            converted = None
+        elif depth < INLINE_MAX_DEPTH:
+            converted = _INLINE_HANDLERS[token](text, match.start(), depth + 1, memo)
+        else:
+            converted = None
+        if converted is None:
+            output.append(token)
+            pos = match.end()
+        else:
+            output.append(converted[0])
+            pos = converted[1]
+
+def _scan_delimited(text, start, delimiter, min_length, depth, memo):
+    """同じ区切りで囲む記法（'''...''' など）の (中身の変換結果, 終了位置) を返します。閉じていなければ None です。"""
+    content_start = start + len(delimiter)
+    close = text.find(delimiter, content_start + min_length)
+    if close == -1:
+        return None
+    return _scan_inline(text[content_start:close], 0, False, depth, memo)[0], close + len(delimiter)
+
+def _scan_bold_italic(text, start, depth, memo):
+    scanned = _scan_delimited(text, start, "'''''", 0, depth, memo)
+    if scanned is None:
+        return _scan_bold(text, start, depth, memo)
+    # '''''テキスト''''' は、従来実装と同じく強調と斜体の両方を適用する
+    return f'***{scanned[0]}***', scanned[1]
+
+def _scan_bold(text, start, depth, memo):
+    scanned = _scan_delimited(text, start, "'''", 0, depth, memo)
+    if scanned is None:
+        # 閉じていない ''' は、従来実装と同じく '' の斜体として変換できるかを試す
+        return _scan_italic(text, start, depth, memo)
+    return f'**{scanned[0]}**', scanned[1]
+
+def _scan_italic(text, start, depth, memo):
+    scanned = _scan_delimited(text, start, "''", 0, depth, memo)
+    if scanned is None:
+        return None
+    return f'*{scanned[0]}*', scanned[1]
+
+def _scan_strike(text, start, depth, memo):
+    scanned = _scan_delimited(text, start, '%%', 1, depth, memo)
+    if scanned is None:
+        return None
+    # 前後のスペースを削除して変換する
+    return f'~~{scanned[0].strip()}~~', scanned[1]
+
+def _scan_braced(text, start, prefix_length, allow_empty_argument, depth, memo):
+    """
+    &名前(引数){テキスト} の (引数, テキストの変換結果, 終了位置) を返します。形が合わなければ None です。
+    テキストの走査結果は位置ごとに memo に記録し、同じ位置からの走査を繰り返しません（閉じていない &size(1){ が続く行では、
+    外側の記法が閉じずに失敗するたびに内側の記法を走査し直すため、記録しないと記法の数に対して指数関数的に時間がかかります）。
+    記録は最初に走査したときの深さで求めたものを使うため、INLINE_MAX_DEPTH に達する入れ子の行では、深さの上限が
+    記法ごとに厳密には適用されない場合があります（同じ行は常に同じ出力になります）。
+    """
+    argument_start = start + prefix_length
+    argument_end = text.find(')', argument_start)
+    if argument_end == -1 or (argument_end == argument_start and not allow_empty_argument):
+        return None
+    if not text.startswith('{', argument_end + 1):
+        return None
+    if text.find('}', argument_end + 2) == -1:
+        return None
+    key = (text, argument_end + 2)
+    scanned = memo.get(key)
+    if scanned is None:
+        scanned = memo[key] = _scan_inline(text, argument_end + 2, True, depth, memo)
+    content, end, closed = scanned
+    if not closed or end == argument_end + 3:  # 閉じていない、またはテキストが空
+        return None
+    return text[argument_start:argument_end], content, end
+
+def _scan_size(text, start, depth, memo):
+    scanned = _scan_braced(text, start, len('&size('), False, depth, memo)
+    if scanned is None:
+        return None
+    return format_size_span(scanned[0], scanned[1]), scanned[2]
+
+def _scan_color(text, start, depth, memo):
+    scanned = _scan_braced(text, start, len('&color('), True, depth, memo)
+    if scanned is None:
+        return None
+    return format_color_span(scanned[0], scanned[1]), scanned[2]
+
+def _scan_link(text, start, depth, memo):
+    """[[エイリアス>ページ名]] を [[ページ名|エイリアス]] に変換します。[[ページ名]] はそのまま出力します。"""
+    close = text.find(']]', start + 2)
+    if close == -1:
+        return None
+    inner = text[start + 2:close]
+    alias, separator, page = inner.partition('>')
+    if not separator:
+        return text[start:close + 2], close + 2
+    if not alias or not page or ']' in inner:
+        return None
+    return f'[[{page}|{_scan_inline(alias, 0, False, depth, memo)[0]}]]', close + 2
+
+def _scan_ref(text, start, depth, memo):
+    """#ref(画像ファイル名,オプション) を ![[画像ファイル名]] に変換します。"""
+    close = text.find(')', start + len('#ref('))
+    if close == -1:
+        return None
+    filename = text[start + len('#ref('):close].split(',', 1)[0]
+    if not filename:
+        return None
+    return f'![[{filename}]]', close + 1
+
+_INLINE_HANDLERS = {
+    "'''''": _scan_bold_italic,
+    "'''": _scan_bold,
+    "''": _scan_italic,
+    '%%': _scan_strike,
+    '&size(': _scan_size,
+    '&color(': _scan_color,
+    '[[': _scan_link,
+    '#ref(': _scan_ref,
+}
+
+def scan_inline(line):
+    """
+    1行のインライン記法（強調・斜体・取り消し線・&size・&color・エイリアス付きリンク・#ref）を1回の走査で変換します。
+    &color(red){&size(20){x}} のような入れ子の記法にも対応します。
+    """
+    return _scan_inline(line, 0, False, 0, {})[0]
+
+def _scan_inline_stage(markdown_text):
+    return '\n'.join(scan_inline(line) for line in markdown_text.split('\n'))
+
+# 行単位の処理で従来実装と同じ結果を保証できないページに適用する段階。
+# 従来実装の段階のうち、インライン記法の3段階（強調・&size/&color・リンク）を scan_inline の1段階に置き換える
+SCAN_FALLBACK_STAGES = tuple(
+    ('inline', _scan_inline_stage) if name == 'emphasis' else (name, stage)
+    for name, stage in LEGACY_STAGES if name not in ('size_color', 'links'))
+
+def convert_pukiwiki_to_markdown_scan(pukiwiki_text, literal_preformatted=False):
+    """
+    PukiWikiのテキストを行単位の1回の走査で変換し、インライン記法は scan_inline で変換します。
+    入れ子の記法を変換するため、入れ子や記法が重なる箇所、行をまたぐインライン記法では従来実装と出力が異なる場合があります。
+    単独の "-" 行などリストや表の記法は、従来実装と同じ出力になるように変換します。
+    """
+    try:
+        return _convert_stream(pukiwiki_text, literal_preformatted, inline_scanner=True)
+    except _StreamFallback:
+        markdown_text = pukiwiki_text
+        for _, stage in SCAN_FALLBACK_STAGES:
+            markdown_text = stage(markdown_text)
+        return markdown_text.strip()
+# --- インライン記法のスキャナー --- END
+
+CONVERTERS = {
+    ENGINE_LEGACY: convert_pukiwiki_to_markdown,
+    ENGINE_STREAM: convert_pukiwiki_to_markdown_stream,
+    ENGINE_SCAN: convert_pukiwiki_to_markdown_scan,
+}
+
+def get_converter(options=None):
+    """詳細設定で選択された変換エンジンの変換関数を返します。"""
+    options = options or DEFAULT_ADVANCED_SETTINGS
+    engine = options.get('engine', ENGINE_LEGACY)
+    if engine not in CONVERTERS:
+        error_message = f"警告: 不明な変換エンジン '{engine}' が指定されました。'{ENGINE_LEGACY}' を使用します。"
+        print(error_message, file=sys.stderr)
+        write_error_log(error_message)
+        engine = ENGINE_LEGACY
+    if engine in (ENGINE_STREAM, ENGINE_SCAN) and options.get('literal_preformatted'):
+        return lambda text: CONVERTERS[engine](text, literal_preformatted=True)
+    return CONVERTERS[engine]
+
+# --- 変換のプロファイル --- START
+PROFILE_SLOWEST_PAGES = 10 # プロファイルの報告に表示する、変換に時間のかかったページの件数
+
+def convert_with_profile(pukiwiki_text, options=None, features=None):
+    """
+    詳細設定の変換エンジンで変換し、(Markdown, 段階ごとの計測結果のリスト) を返します。
+    計測結果は (段階の名前, 処理時間（秒）, 入力の文字数, 出力の文字数) です。従来の変換エンジンでは LEGACY_STAGES の段階ごとに、
+    それ以外のエンジンでは変換全体を1つの段階（エンジン名）として計測します。
+    従来の変換エンジンでは、ページが含まない記法の段階（sniff_features を参照）は省き、計測結果にも含めません。
+    """
+    converter = get_converter(options)
+    stages = []
+    if converter is convert_pukiwiki_to_markdown:
+        if features is None:
+            features = sniff_features(pukiwiki_text)
+        markdown_text = pukiwiki_text
+        for name, stage in legacy_stages_for(features):
+            start = time.perf_counter()
+            output = stage(markdown_text)
+            stages.append((name, time.perf_counter() - start, len(markdown_text), len(output)))
+            markdown_text = output
+        return markdown_text.strip(), stages
+    start = time.perf_counter()
+    markdown_text = converter(pukiwiki_text)
+    engine = (options or DEFAULT_ADVANCED_SETTINGS).get('engine', ENGINE_LEGACY)
+    stages.append((engine, time.perf_counter() - start, len(pukiwiki_text), len(markdown_text)))
+    return markdown_text, stages
+
+class ConversionProfile:
+    """convert_with_profile の計測結果を1回の変換全体で集計し、時間のかかった段階とページの順位を報告します。"""
+
+    def __init__(self, slowest_pages=PROFILE_SLOWEST_PAGES):
+        self.stages = {} # 段階の名前 -> [回数, 処理時間の合計, 入力の文字数の合計, 出力の文字数の合計]
+        self.page_count = 0
+        self.slowest_pages = slowest_pages
+        self._slowest = [] # (処理時間, 通し番号, ファイル名, 入力の文字数, 最も時間のかかった段階, その処理時間) のヒープ
+
+    def add(self, filename, stages):
+        """1ページ分の計測結果を集計に加えます（stages が空のページは、処理時間 0 のページとして数えます）。"""
+        for name, seconds, chars_in, chars_out in stages:
+            totals = self.stages.setdefault(name, [0, 0.0, 0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += chars_in
+            totals[3] += chars_out
+        self.page_count += 1
+        if not stages:
+            # 記法を含まず、従来の変換エンジンのどの段階も適用しなかったページ
+            return
+        page_seconds = sum(stage[1] for stage in stages)
+        slowest_stage = max(stages, key=lambda stage: stage[1])
+        entry = (page_seconds, self.page_count, filename, stages[0][2], slowest_stage[0], slowest_stage[1])
+        if len(self._slowest) < self.slowest_pages:
+            heapq.heappush(self._slowest, entry)
+        elif entry > self._slowest[0]:
+            heapq.heapreplace(self._slowest, entry)
+
+    def report(self):
+        """段階ごとの処理時間の順位と、時間のかかったページをコンソールに表示し、集計結果を辞書で返します。"""
+        total_seconds = sum(totals[1] for totals in self.stages.values())
+        stages = [{'name': name, 'calls': calls, 'seconds': round(seconds, 6),
+                   'share': round(seconds / total_seconds, 4) if total_seconds else 0.0,
+                   'chars_in': chars_in, 'chars_out': chars_out}
+                  for name, (calls, seconds, chars_in, chars_out) in sorted(self.stages.items(), key=lambda item: -item[1][1])]
+        pages = [{'file': filename, 'seconds': round(seconds, 6), 'chars': chars,
+                  'slowest_stage': stage_name, 'slowest_stage_seconds': round(stage_seconds, 6)}
+                 for seconds, _, filename, chars, stage_name, stage_seconds in sorted(self._slowest, reverse=True)]
+
+        print(f"情報: 変換のプロファイル（{self.page_count} ページ、変換の合計 {total_seconds:.3f} 秒）")
+        # 見出しと各行は同じ幅で揃える（全角文字は2桁分で表示され幅がずれるため、見出しは半角で表示する）
+        row_format = "  {:<16} {:>9} {:>6} {:>9} {:>12} {:>12}"
+        print(row_format.format('stage', 'total(s)', 'share', 'avg(ms)', 'chars_in', 'chars_out'))
+        for stage in stages:
+            print(row_format.format(stage['name'], f"{stage['seconds']:.3f}", f"{stage['share'] * 100:.1f}%",
+                                    f"{stage['seconds'] * 1000 / stage['calls']:.3f}", stage['chars_in'], stage['chars_out']))
+        if pages:
+            print(f"情報: 変換に時間のかかったページ（上位 {len(pages)} 件）")
+            for rank, page in enumerate(pages, 1):
+                print(f"  {rank:>2}. {page['file']}: {page['seconds'] * 1000:.1f} ms（{page['chars']} 文字、"
+                      f"最も時間のかかった段階: {page['slowest_stage']} {page['slowest_stage_seconds'] * 1000:.1f} ms）")
+        return {'pages': self.page_count, 'seconds': round(total_seconds, 6), 'stages': stages, 'slowest_pages': pages}
+# --- 変換のプロファイル --- END
+
 def get_timestamp_file_path(markdown_dir):
     """タイムスタンプファイルのパスを取得します。"""
     return os.path.join(markdown_dir, TIMESTAMP_FILE)
 
-def save_timestamps(pukiwiki_dir, markdown_dir):
-    """PukiWikiディレクトリの全ファイルのタイムスタンプをMarkdownディレクトリのタイムスタンプファイルに保存します。"""
+def compute_content_hash(data):
+    """ファイル内容（バイト列）の変更検出用ハッシュ値を返します。"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def scan_pukiwiki_stats(pukiwiki_dir, filenames=None):
+    """
+    PukiWikiファイルの更新時刻とサイズを調べ、ファイル名→(更新時刻, サイズ) の辞書を返します。
+    ディレクトリは os.scandir で1回だけ走査し、ファイルの種類はディレクトリ一覧の情報から判定します
+    （Windows では更新時刻とサイズもディレクトリ一覧から取得されるため、ファイルごとの問い合わせが発生しません）。
+    filenames を渡すと、ディレクトリを走査せずにそのファイルだけを調べます（存在しないファイルは含めません）。
+    """
+    stats = {}
+    if filenames is not None:
+        for filename in sorted(filenames):
+            filepath = os.path.join(pukiwiki_dir, filename)
+            if (filename.endswith('.txt') or filename.endswith('.page')) and os.path.isfile(filepath):
+                stat = os.stat(filepath)
+                stats[filename] = (stat.st_mtime, stat.st_size)
+        return stats
+    with os.scandir(pukiwiki_dir) as entries:
+        for entry in entries:
+            if (entry.name.endswith('.txt') or entry.name.endswith('.page')) and entry.is_file():
+                stat = entry.stat()
+                stats[entry.name] = (stat.st_mtime, stat.st_size)
+    return stats
+
+def is_same_file_stat(entry, file_stat):
+    """記録されたタイムスタンプ情報と現在の (更新時刻, サイズ) で、更新時刻とサイズが一致するかを返します。"""
+    mtime, size = file_stat
+    # サイズを記録していない以前の形式では、従来どおり更新時刻だけで判定する
+    recorded_size = entry.get('size')
+    return entry.get('mtime') == mtime and (recorded_size is None or recorded_size == size)
+
+def build_timestamp_records(manifest, file_stats):
+    """
+    保存するタイムスタンプの記録（ファイル名→{'mtime', 'size', 'hash', 'encoding', ...}）を作成します。
+    manifest を省略すると file_stats の更新時刻とサイズだけを記録します。
+    走査の後に更新されたファイルや、記録のないファイルは、次回の更新変換で確認されるよう現在の状態では記録しません。
+    """
     timestamps = {}
-    
+    for filename, file_stat in file_stats.items():
+        if manifest is None:
+            timestamps[filename] = {'mtime': file_stat[0], 'size': file_stat[1], 'hash': None, 'encoding': None}
+            continue
+        entry = manifest.get(filename)
+        if entry is None:
+            continue
+        if is_same_file_stat(entry, file_stat):
+            entry = dict(entry, size=file_stat[1])
+        timestamps[filename] = entry
+    return timestamps
+
+def save_timestamps(pukiwiki_dir, markdown_dir, manifest=None, file_stats=None, store=None):
+    """
+    PukiWikiディレクトリの全ファイルのタイムスタンプを記録の保存先に保存します。
+    manifest（ファイル名→{'mtime', 'size', 'hash', 'encoding'}）を渡すと、その内容を記録します。
+    file_stats には処理の開始時に scan_pukiwiki_stats で調べた結果を渡します（省略時はここで走査します）。
+    store には open_manifest_store で開いた保存先を渡します（省略時は出力ディレクトリの timestamps.md）。
+    """
     try:
-        for filename in os.listdir(pukiwiki_dir):
-            filepath = os.path.join(pukiwiki_dir, filename)
-            if os.path.isfile(filepath) and (filename.endswith('.txt') or filename.endswith('.page')):
-                # ファイルの最終更新時刻を取得
-                mtime = os.path.getmtime(filepath)
-                timestamps[filename] = mtime
-        
-        # タイムスタンプファイルに保存
-        timestamp_file_path = get_timestamp_file_path(markdown_dir)
-        
-        # Markdownファイル形式で保存
-        with open(timestamp_file_path, 'w', encoding='utf-8') as f:
-            f.write("# PukiWiki Files Timestamp Record\n\n")
-            f.write(f"生成日時: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-            f.write("## ファイルタイムスタンプ一覧\n\n")
-            f.write("```json\n")
-            json.dump(timestamps, f, indent=2, ensure_ascii=False)
-            f.write("\n```\n")
-        
-        print(f"情報: タイムスタンプファイル '{timestamp_file_path}' を更新しました。({len(timestamps)} ファイル)")
+        if file_stats is None:
+            file_stats = scan_pukiwiki_stats(pukiwiki_dir)
+        timestamps = build_timestamp_records(manifest, file_stats)
+        if store is None:
+            store = MarkdownManifestStore(markdown_dir)
+        store.save(timestamps)
         return timestamps
         
     except Exception as e:
@@ -631,12 +1391,17 @@ def save_timestamps(pukiwiki_dir, markdown_dir):
         write_error_log(error_message)
         return {}
 
-def load_timestamps(markdown_dir):
-    """タイムスタンプファイルから前回のタイムスタンプを読み込みます。"""
+def load_timestamps(markdown_dir, verbose=True):
+    """
+    タイムスタンプファイルから前回のタイムスタンプを読み込みます。
+    戻り値はファイル名→{'mtime': 更新時刻, 'encoding': 文字コード} の辞書です。
+    更新時刻だけを記録していた以前の形式のファイルもこの形に揃えて返します。
+    """
     timestamp_file_path = get_timestamp_file_path(markdown_dir)
     
     if not os.path.exists(timestamp_file_path):
-        print("情報: タイムスタンプファイルが存在しません。全変換を実行します。")
+        if verbose:
+            print("情報: タイムスタンプファイルが存在しません。全変換を実行します。")
         return {}
     
     try:
@@ -649,10 +1414,13 @@ def load_timestamps(markdown_dir):
         if json_match:
             json_content = json_match.group(1)
             timestamps = json.loads(json_content)
-            print(f"情報: タイムスタンプファイルから {len(timestamps)} 件のタイムスタンプを読み込みました。")
+            timestamps = {filename: (entry if isinstance(entry, dict) else {'mtime': entry}) for filename, entry in timestamps.items()}
+            if verbose:
+                print(f"情報: タイムスタンプファイルから {len(timestamps)} 件のタイムスタンプを読み込みました。")
             return timestamps
         else:
-            print("警告: タイムスタンプファイルからJSONデータを抽出できませんでした。")
+            if verbose:
+                print("警告: タイムスタンプファイルからJSONデータを抽出できませんでした。")
             return {}
             
     except Exception as e:
@@ -661,82 +1429,1304 @@ def load_timestamps(markdown_dir):
         write_error_log(error_message)
         return {}
 
-def get_updated_files(pukiwiki_dir, markdown_dir):
-    """更新されたファイルのリストを取得します。"""
-    current_timestamps = {}
-    previous_timestamps = load_timestamps(markdown_dir)
+# --- タイムスタンプ記録の保存先 --- START
+MANIFEST_BACKEND_MARKDOWN = 'markdown' # 出力ディレクトリの timestamps.md（Markdown内のJSON、既定）
+MANIFEST_BACKEND_SQLITE = 'sqlite' # 出力ディレクトリの外に置くSQLiteデータベース（変更された記録だけを書き込む）
+MANIFEST_DATABASE_FILE = 'manifest.sqlite3' # SQLiteデータベースの既定のファイル名（LOG_DIR 内）
+MANIFEST_FIELDS = ('mtime', 'size', 'hash', 'encoding', 'output_hash', 'output_mtime', 'features', 'rules') # 1ファイル分の記録の項目
+
+def copy_manifest(timestamps):
+    """記録の辞書を複製します（get_updated_files などが記録を書き換えても、保存済みの内容と比較できるようにするため）。"""
+    return {filename: dict(entry) for filename, entry in timestamps.items()}
+
+class MarkdownManifestStore:
+    """
+    出力ディレクトリの timestamps.md に記録を保存します（既定の保存先）。
+    記録全体を1つのJSONとして書き込むため、内容が前回と同じ場合だけ書き込みを省きます。
+    """
+    name = MANIFEST_BACKEND_MARKDOWN
+
+    def __init__(self, markdown_dir):
+        self.markdown_dir = markdown_dir
+        self.saved = None # 読み込み時または保存時の記録（保存が必要かの判定用）
+
+    def load(self, verbose=True):
+        timestamps = load_timestamps(self.markdown_dir, verbose)
+        self.saved = copy_manifest(timestamps)
+        return timestamps
+
+    def save(self, timestamps):
+        timestamp_file_path = get_timestamp_file_path(self.markdown_dir)
+        saved = self.saved if self.saved is not None else load_timestamps(self.markdown_dir, verbose=False)
+
+        # 記録内容が前回と同じ場合は、出力ディレクトリの同期を避けるため書き込まない
+        if os.path.exists(timestamp_file_path) and saved == timestamps:
+            print(f"情報: タイムスタンプファイル '{timestamp_file_path}' に変更はありません。")
+            return
+
+        # Markdownファイル形式で保存（書き込み中に中断されても記録が壊れないよう、一時ファイルに書いてから置き換える）
+        temp_file_path = timestamp_file_path + '.tmp'
+        with open(temp_file_path, 'w', encoding='utf-8') as f:
+            f.write("# PukiWiki Files Timestamp Record\n\n")
+            f.write(f"生成日時: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+            f.write("## ファイルタイムスタンプ一覧\n\n")
+            f.write("```json\n")
+            json.dump(timestamps, f, indent=2, ensure_ascii=False)
+            f.write("\n```\n")
+        os.replace(temp_file_path, timestamp_file_path)
+
+        self.saved = copy_manifest(timestamps)
+        print(f"情報: タイムスタンプファイル '{timestamp_file_path}' を更新しました。({len(timestamps)} ファイル)")
+
+class SqliteManifestStore:
+    """
+    出力ディレクトリの外に置くSQLiteデータベースに記録を保存します。
+    1ファイル1行で記録し、保存時は前回から変わった行だけを追加・更新・削除するため、
+    ページ数が多くても保存にかかる時間は変更されたファイルの数に比例します。
+    1つのデータベースに複数の出力ディレクトリの記録を、出力ディレクトリの絶対パスで区別して保存します。
+    記録がまだない出力ディレクトリに timestamps.md があれば、初回の読み込み時にその内容を移行します。
+    """
+    name = MANIFEST_BACKEND_SQLITE
+
+    def __init__(self, markdown_dir, database_path=None):
+        self.markdown_dir = markdown_dir
+        self.database_path = database_path or os.path.join(LOG_DIR, MANIFEST_DATABASE_FILE)
+        self.key = os.path.normcase(os.path.abspath(markdown_dir))
+        self.saved = None # 読み込み時または保存時の記録（変更された行の判定用）
+
+    def _connect(self):
+        directory = os.path.dirname(self.database_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        connection = sqlite3.connect(self.database_path)
+        connection.execute("CREATE TABLE IF NOT EXISTS manifest (markdown_dir TEXT NOT NULL, filename TEXT NOT NULL, "
+                           "PRIMARY KEY (markdown_dir, filename))")
+        # 記録の項目が増えた場合は列を追加する
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(manifest)")}
+        for field in MANIFEST_FIELDS:
+            if field not in columns:
+                connection.execute(f"ALTER TABLE manifest ADD COLUMN {field}")
+        return connection
+
+    def _upsert(self, connection, timestamps):
+        placeholders = ', '.join('?' * (len(MANIFEST_FIELDS) + 2))
+        connection.executemany(
+            f"INSERT OR REPLACE INTO manifest (markdown_dir, filename, {', '.join(MANIFEST_FIELDS)}) VALUES ({placeholders})",
+            ((self.key, filename) + tuple(entry.get(field) for field in MANIFEST_FIELDS) for filename, entry in timestamps.items()))
+
+    def load(self, verbose=True):
+        try:
+            connection = self._connect()
+            try:
+                rows = connection.execute(f"SELECT filename, {', '.join(MANIFEST_FIELDS)} FROM manifest WHERE markdown_dir = ?", (self.key,))
+                timestamps = {row[0]: dict(zip(MANIFEST_FIELDS, row[1:])) for row in rows}
+                timestamp_file_path = get_timestamp_file_path(self.markdown_dir)
+                if not timestamps and os.path.exists(timestamp_file_path):
+                    # 以前の形式（timestamps.md）からの移行は、この出力ディレクトリの記録がまだない場合に1回だけ行う
+                    migrated = load_timestamps(self.markdown_dir, verbose=False)
+                    timestamps = {filename: {field: entry.get(field) for field in MANIFEST_FIELDS} for filename, entry in migrated.items()}
+                    with connection:
+                        self._upsert(connection, timestamps)
+                    print(f"情報: タイムスタンプファイル '{timestamp_file_path}' の {len(timestamps)} 件の記録を '{self.database_path}' に移行しました。"
+                          f"（以後 timestamps.md は使用しません）")
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            error_message = f"タイムスタンプの記録 '{self.database_path}' の読み込み中にエラーが発生しました: {e}"
+            print(error_message, file=sys.stderr)
+            write_error_log(error_message)
+            return {}
+
+        if verbose:
+            if timestamps:
+                print(f"情報: '{self.database_path}' から {len(timestamps)} 件のタイムスタンプを読み込みました。")
+            else:
+                print("情報: タイムスタンプの記録がありません。全変換を実行します。")
+        self.saved = copy_manifest(timestamps)
+        return timestamps
+
+    def save(self, timestamps):
+        saved = self.saved if self.saved is not None else self.load(verbose=False)
+        changed = {}
+        for filename, entry in timestamps.items():
+            if saved.get(filename) != entry:
+                entry = {field: entry.get(field) for field in MANIFEST_FIELDS}
+                if saved.get(filename) != entry:
+                    changed[filename] = entry
+        removed = [filename for filename in saved if filename not in timestamps]
+        if not changed and not removed:
+            print(f"情報: タイムスタンプの記録 '{self.database_path}' に変更はありません。")
+            return
+
+        connection = self._connect()
+        try:
+            with connection:
+                self._upsert(connection, changed)
+                connection.executemany("DELETE FROM manifest WHERE markdown_dir = ? AND filename = ?",
+                                       ((self.key, filename) for filename in removed))
+        finally:
+            connection.close()
+
+        saved.update(changed)
+        for filename in removed:
+            del saved[filename]
+        self.saved = saved
+        print(f"情報: タイムスタンプの記録 '{self.database_path}' を更新しました。(更新 {len(changed)} 件、削除 {len(removed)} 件、全 {len(timestamps)} ファイル)")
+
+MANIFEST_STORES = {
+    MANIFEST_BACKEND_MARKDOWN: MarkdownManifestStore,
+    MANIFEST_BACKEND_SQLITE: SqliteManifestStore,
+}
+
+def open_manifest_store(markdown_dir, options=None):
+    """詳細設定で選択された保存先（timestamps.md または SQLite）を返します。"""
+    options = options or DEFAULT_ADVANCED_SETTINGS
+    backend = options.get('manifest_backend', MANIFEST_BACKEND_MARKDOWN)
+    if backend not in MANIFEST_STORES:
+        error_message = f"警告: 不明なタイムスタンプの保存先 '{backend}' が指定されました。'{MANIFEST_BACKEND_MARKDOWN}' を使用します。"
+        print(error_message, file=sys.stderr)
+        write_error_log(error_message)
+        backend = MANIFEST_BACKEND_MARKDOWN
+    if backend == MANIFEST_BACKEND_SQLITE:
+        return SqliteManifestStore(markdown_dir, options.get('manifest_path') or None)
+    return MarkdownManifestStore(markdown_dir)
+# --- タイムスタンプ記録の保存先 --- END
+
+def get_updated_files(pukiwiki_dir, markdown_dir, previous_timestamps=None, file_stats=None):
+    """
+    更新されたファイルのリストを取得します。
+    読み込み済みのタイムスタンプがあれば previous_timestamps に渡します（省略時はファイルから読み込みます）。
+    file_stats には scan_pukiwiki_stats で調べた結果を渡します（省略時はここで走査します）。
+    更新時刻かサイズが記録と異なるファイルのうち、サイズが同じものは内容のハッシュ値で判定し、
+    内容が変わっていなければ更新対象にせず、previous_timestamps の記録の更新時刻を現在の値に書き換えます。
+    """
+    if previous_timestamps is None:
+        previous_timestamps = load_timestamps(markdown_dir)
+    if file_stats is None:
+        file_stats = scan_pukiwiki_stats(pukiwiki_dir)
     updated_files = []
+    unchanged_content_count = 0
     
-    # 現在のタイムスタンプを取得
-    for filename in os.listdir(pukiwiki_dir):
-        filepath = os.path.join(pukiwiki_dir, filename)
-        if os.path.isfile(filepath) and (filename.endswith('.txt') or filename.endswith('.page')):
-            mtime = os.path.getmtime(filepath)
-            current_timestamps[filename] = mtime
-            
-            # 前回のタイムスタンプと比較
-            if filename not in previous_timestamps or previous_timestamps[filename] != mtime:
-                updated_files.append(filename)
+    for filename, file_stat in file_stats.items():
+        # 前回のタイムスタンプ・サイズと比較
+        entry = previous_timestamps.get(filename)
+        if entry is None:
+            updated_files.append(filename)
+            continue
+        if is_same_file_stat(entry, file_stat):
+            continue
+
+        # バックアップからの復元などで更新時刻だけが変わった場合は、内容のハッシュ値で判定する
+        mtime, size = file_stat
+        if entry.get('hash') and entry.get('size') == size:
+            try:
+                with open(os.path.join(pukiwiki_dir, filename), 'rb') as f:
+                    content_hash = compute_content_hash(f.read())
+            except OSError:
+                content_hash = None
+            if content_hash == entry['hash']:
+                entry['mtime'] = mtime
+                unchanged_content_count += 1
+                continue
+        updated_files.append(filename)
     
+    if unchanged_content_count > 0:
+        print(f"情報: 更新時刻のみ変わった {unchanged_content_count} 個のファイルは内容が同じため変換しません。")
     print(f"情報: {len(updated_files)} 個のファイルが更新されています。")
     if updated_files:
         print(f"更新ファイル: {', '.join(updated_files[:5])}" + ("..." if len(updated_files) > 5 else ""))
     
     return updated_files
 
+def get_rule_affected_files(previous_timestamps, file_stats, updated_files):
+    """
+    規則の変更の反映（変換モード 'affected'）で変換し直すファイルのリストを返します。
+    更新されていないファイルのうち、記録された規則のバージョン（記録の 'rules'）が現在の CONVERSION_RULE_VERSIONS と異なるファイルと、
+    規則のバージョンを記録していないファイル（記録する前に変換したファイル）が対象です。
+    """
+    updated = set(updated_files)
+    affected_files = []
+    changed_rules = collections.Counter()
+    unrecorded_count = 0
+    for filename in file_stats:
+        entry = previous_timestamps.get(filename)
+        if entry is None or filename in updated:
+            continue
+        if not entry.get('rules'):
+            affected_files.append(filename)
+            unrecorded_count += 1
+            continue
+        changed = get_changed_rules(entry['rules'])
+        if changed:
+            affected_files.append(filename)
+            changed_rules.update(changed)
+
+    print(f"情報: 変換規則が変わった {len(affected_files)} 個のファイルを変換し直します。（全 {len(file_stats)} ファイル）")
+    if changed_rules:
+        print(f"変更された規則: {', '.join(f'{name} {count} 件' for name, count in changed_rules.most_common())}")
+    if unrecorded_count:
+        print(f"情報: 規則のバージョンの記録がない {unrecorded_count} 個のファイルも変換し直します。")
+    return affected_files
+
+def is_recorded_output(markdown_filepath, entry):
+    """.md ファイルが前回の記録（出力のハッシュ値）と同じ内容のままかを返します。"""
+    if not entry.get('output_hash'):
+        return False
+    try:
+        stat = os.stat(markdown_filepath)
+        if entry.get('output_mtime') == stat.st_mtime:
+            return True
+        with open(markdown_filepath, 'rb') as f:
+            return compute_content_hash(f.read()) == entry['output_hash']
+    except OSError:
+        return False
+
+def propagate_removed_pages(pukiwiki_dir, markdown_dir, previous_timestamps, file_stats, updated_files):
+    """
+    更新変換で、前回の記録にあって現在のPukiWikiディレクトリにないページ（削除・名前変更されたページ）を出力に反映します。
+    新しく見つかったページの内容のハッシュ値が、なくなったページの記録と一致する場合は名前の変更とみなし、
+    変換せずに .md ファイルの名前を変更します（.md ファイルが記録した出力のままの場合のみ）。
+    それ以外のなくなったページの .md ファイルは削除します。ほかのページの出力と同じ名前の .md ファイルは削除しません。
+    previous_timestamps は反映した内容に書き換え、(変換が必要なファイルのリスト, 名前を変更した数, 削除した数) を返します。
+    """
+    removed_files = sorted(filename for filename in previous_timestamps if filename not in file_stats)
+    if not removed_files:
+        return updated_files, 0, 0
+
+    # 名前の変更の検出：なくなったページの内容のハッシュ値 → ファイル名
+    removed_by_hash = {}
+    for filename in removed_files:
+        content_hash = previous_timestamps[filename].get('hash')
+        if content_hash:
+            removed_by_hash.setdefault(content_hash, []).append(filename)
+
+    current_outputs = {os.path.normcase(get_markdown_filename(filename)) for filename in file_stats}
+    remaining_files = []
+    renamed_count = 0
+    for filename in updated_files:
+        candidates = None
+        if filename not in previous_timestamps and removed_by_hash:
+            try:
+                with open(os.path.join(pukiwiki_dir, filename), 'rb') as f:
+                    candidates = removed_by_hash.get(compute_content_hash(f.read()))
+            except OSError:
+                candidates = None
+        if not candidates:
+            remaining_files.append(filename)
+            continue
+
+        old_filename = candidates[0]
+        entry = previous_timestamps[old_filename]
+        old_markdown_filepath = os.path.join(markdown_dir, get_markdown_filename(old_filename))
+        new_markdown_filepath = os.path.join(markdown_dir, get_markdown_filename(filename))
+        if not is_recorded_output(old_markdown_filepath, entry):
+            # 出力が記録と異なる（手で編集された・見つからない）場合は、名前を変更せずに変換し直す
+            remaining_files.append(filename)
+            continue
+        try:
+            if os.path.normcase(old_markdown_filepath) != os.path.normcase(new_markdown_filepath):
+                if os.path.normcase(os.path.basename(old_markdown_filepath)) in current_outputs:
+                    # 古い出力がほかのページの出力を兼ねている場合は残し、新しい名前で変換する
+                    remaining_files.append(filename)
+                    continue
+                os.replace(old_markdown_filepath, new_markdown_filepath)
+        except OSError as e:
+            error_message = f"エラー: ファイル '{old_markdown_filepath}' の名前の変更に失敗しました: {e}"
+            print(error_message, file=sys.stderr)
+            write_error_log(error_message)
+            remaining_files.append(filename)
+            continue
+
+        print(f"  名前を変更しました: {old_markdown_filepath} -> {new_markdown_filepath}（ページの名前の変更: '{old_filename}' -> '{filename}'）")
+        mtime, size = file_stats[filename]
+        previous_timestamps[filename] = dict(entry, mtime=mtime, size=size)
+        del previous_timestamps[old_filename]
+        candidates.pop(0)
+        renamed_count += 1
+
+    deleted_count = 0
+    for filename in removed_files:
+        if filename not in previous_timestamps:
+            continue # 名前の変更として反映済み
+        del previous_timestamps[filename]
+        markdown_filename = get_markdown_filename(filename)
+        if os.path.normcase(markdown_filename) in current_outputs:
+            continue
+        markdown_filepath = os.path.join(markdown_dir, markdown_filename)
+        if not os.path.exists(markdown_filepath):
+            continue
+        try:
+            os.remove(markdown_filepath)
+            print(f"  削除しました: {markdown_filepath}（ページの削除: '{filename}'）")
+            deleted_count += 1
+        except OSError as e:
+            error_message = f"エラー: ファイル '{markdown_filepath}' の削除に失敗しました: {e}"
+            print(error_message, file=sys.stderr)
+            write_error_log(error_message)
+
+    if renamed_count or deleted_count:
+        print(f"情報: 削除・名前変更されたページを反映しました。（名前の変更: {renamed_count} 件、削除: {deleted_count} 件）")
+    return remaining_files, renamed_count, deleted_count
+
 def detect_encoding(file_path):
     """
     ファイルの文字コードを判定します。
     判定可能な文字コード: UTF-8, EUC-JP, Shift_JIS
     """
-    encodings_to_try = ['utf-8', 'euc-jp', 'shift_jis']
+    with open(file_path, 'rb') as f:
+        return detect_encoding_from_bytes(f.read())[0]
+
+def detect_encoding_from_bytes(data, preferred_encoding=None):
+    """
+    読み込み済みのバイト列の文字コードを判定し、(文字コード, デコードしたテキスト) を返します。
+    判定できなかった場合は (None, None) を返します。
+    結果は常に ENCODINGS_TO_TRY の順で最初にデコードできた文字コードになります。
+    preferred_encoding（前回の判別結果など）を指定するとその文字コードから試し、
+    成功した場合は、それより優先順位の高い文字コードでデコードできないことだけを確認します。
+    """
+    encodings_to_try = ENCODINGS_TO_TRY
+    if preferred_encoding in encodings_to_try:
+        try:
+            text = data.decode(preferred_encoding)
+        except UnicodeDecodeError:
+            encodings_to_try = [enc for enc in encodings_to_try if enc != preferred_encoding]
+        else:
+            encodings_to_try = encodings_to_try[:encodings_to_try.index(preferred_encoding)]
+            for enc in encodings_to_try:
+                try:
+                    return enc, data.decode(enc)
+                except UnicodeDecodeError:
+                    continue
+            return preferred_encoding, text
     for enc in encodings_to_try:
         try:
-            with open(file_path, 'r', encoding=enc) as f:
-                f.read()
-            return enc
+            return enc, data.decode(enc)
         except UnicodeDecodeError:
             continue
-    return None # 判定できなかった場合
+    return None, None # 判定できなかった場合
+
+def get_encoding_hints(filenames, timestamps):
+    """
+    タイムスタンプファイルに記録された文字コードから、各ファイルで最初に試す文字コードを求めます。
+    記録のないファイルには、ディレクトリ内で最も多く使われている文字コードを割り当てます。
+    """
+    counts = {}
+    for entry in timestamps.values():
+        encoding = entry.get('encoding')
+        if encoding:
+            counts[encoding] = counts.get(encoding, 0) + 1
+    most_common = max(counts, key=counts.get) if counts else None
+    return {filename: (timestamps.get(filename, {}).get('encoding') or most_common) for filename in filenames}
+
+def get_markdown_filename(filename, result=None):
+    """
+    PukiWikiのファイル名から出力するMarkdownファイル名を求めます。
+    result を渡すと、ファイル名のデコードに関するメッセージをその 'log' に追加します。
+    """
+    original_basename, ext = os.path.splitext(filename)
+    decoded_basename = original_basename
+    try:
+        # ファイル名がすべて16進数文字で構成され、かつ偶数長であるかを確認
+        # あまりにも短いファイル名は誤変換の可能性を考慮し、一定長以上(例: 4文字以上)を対象とする
+        if all(c in '0123456789abcdefABCDEF' for c in original_basename) and len(original_basename) % 2 == 0 and len(original_basename) >= 2:
+            decoded_bytes = bytes.fromhex(original_basename)
+            decoded_basename_candidate = decoded_bytes.decode('utf-8')
+            # デコード結果が空文字列や制御文字のみになる場合などを避けるため、
+            # 簡単なチェックとして、デコード後も何らかの表示可能文字が含まれることを期待する。
+            # より厳密には、デコード後の文字列が妥当なファイル名文字だけで構成されているかを確認すべきだが、
+            # ここではPukiWikiのエンコード仕様が不明なため、一旦デコード成功をもって良しとする。
+            # ただし、元のファイル名と全く同じ場合はヘキサエンコードではなかったとみなす。
+            if decoded_basename_candidate != original_basename:
+                decoded_basename = decoded_basename_candidate
+                if result is not None:
+                    result['log'].append(('info', f"  情報: ファイル名 '{original_basename}{ext}' を '{decoded_basename}{ext}' にデコードしました。"))
+    except ValueError:
+        # fromhexでエラー (奇数長や16進数以外の文字が含まれる場合など)
+        # この場合はヘキサエンコードされたファイル名ではないと判断し、元のファイル名を使用
+        pass
+    except UnicodeDecodeError:
+        if result is not None:
+            result['log'].append(('error', f"  警告: ファイル名 '{original_basename}{ext}' のUTF-8デコードに失敗しました。元のファイル名を使用します。"))
+
+    # Windowsの不正ファイル名文字を安全な文字に置換
+    # 不正な文字: < > : " | ? * および制御文字
+    # また、ファイル名に / が含まれる場合はディレクトリ区切り文字として認識されるため、全角スラッシュに置換
+    invalid_chars = '<>:"|?*'
+    for char in invalid_chars:
+        decoded_basename = decoded_basename.replace(char, '_')
+    
+    # スラッシュとバックスラッシュも安全な文字に置換
+    decoded_basename = decoded_basename.replace('/', '／')  # 全角スラッシュ
+    decoded_basename = decoded_basename.replace('\\', '￥')  # 全角円記号
+    
+    # 制御文字の除去
+    decoded_basename = ''.join(char for char in decoded_basename if ord(char) >= 32)
+    
+    # ファイル名が空になった場合のフォールバック
+    if not decoded_basename.strip():
+        decoded_basename = original_basename
+
+    return decoded_basename + '.md'
+
+def write_output_if_changed(markdown_filepath, output_bytes, previous_entry=None):
+    """
+    変換結果を書き込みます。既存のファイルと内容が同じ場合は書き込みません（クラウド同期の再アップロードを避けるため）。
+    previous_entry にタイムスタンプファイルの前回の記録を渡すと、記録した出力のハッシュ値・更新時刻と
+    既存のファイルが一致する場合は、既存のファイルを読み込まずに同じ内容と判断します。
+    戻り値は (書き込んだかどうか, 出力のハッシュ値, 出力ファイルの更新時刻) です。
+    """
+    output_hash = compute_content_hash(output_bytes)
+    previous_entry = previous_entry or {}
+    try:
+        stat = os.stat(markdown_filepath)
+    except OSError:
+        stat = None
+    if stat is not None and stat.st_size == len(output_bytes):
+        if previous_entry.get('output_hash') == output_hash and previous_entry.get('output_mtime') == stat.st_mtime:
+            return False, output_hash, stat.st_mtime
+        with open(markdown_filepath, 'rb') as f:
+            if f.read() == output_bytes:
+                return False, output_hash, stat.st_mtime
+
+    with open(markdown_filepath, 'wb') as f:
+        f.write(output_bytes)
+    return True, output_hash, os.stat(markdown_filepath).st_mtime
+
+# --- 変換結果キャッシュ --- START
+# 変換結果には、そのページの変換に使った規則のバージョン（format_rule_versions）も保存し、現在のバージョンと異なる場合は使わない。
+# 規則のバージョンを上げても、その規則の記法を含むページの変換結果だけが使われなくなる。
+CONVERSION_CACHE_FILE = 'conversion_cache.sqlite3' # 変換結果キャッシュの既定のファイル名（LOG_DIR 内）
+CONVERSION_CACHE_BATCH = 500 # 変換結果キャッシュにまとめて書き込む件数
+
+class ConversionCache:
+    """
+    変換結果（出力する .md のバイト列、ページが含む記法、変換に使った規則のバージョン）を、変換元の内容のハッシュ値と
+    変換エンジンなどをキーにしてSQLiteデータベースに保存するキャッシュです。合計サイズが max_bytes を超えると、最後に使われた時刻が古いものから削除します。
+    プロセスプールのワーカーは get だけを行い、キャッシュへの書き込みはメインプロセスがまとめて行います。
+    """
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.pid = os.getpid() # fork したワーカーでは親プロセスの接続を使わない
+        self._connection = None
+        self._used_keys = []
+        self._new_entries = []
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout=30)
+            # 書き込み中もワーカーが読み込めるようにする
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS conversion_cache (key TEXT PRIMARY KEY, encoding TEXT, "
+                               "output BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS conversion_cache_last_used ON conversion_cache (last_used)")
+            # ページが含む記法（sniff_features の結果）と変換に使った規則のバージョンの列は後から追加したため、ない場合は追加する
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(conversion_cache)")}
+            if 'features' not in columns:
+                connection.execute("ALTER TABLE conversion_cache ADD COLUMN features INTEGER")
+            if 'rules' not in columns:
+                connection.execute("ALTER TABLE conversion_cache ADD COLUMN rules TEXT")
+            self._connection = connection
+        return self._connection
+
+    def get(self, key):
+        """
+        キャッシュされた (判別した文字コード, 出力のバイト列, ページが含む記法) を返します。ない場合や読み込めない場合は None です。
+        ページの記法の規則のいずれかのバージョンが保存時から変わった変換結果も None を返します（新しい変換結果で置き換えます）。
+        """
+        try:
+            row = self._connect().execute("SELECT encoding, output, features, rules FROM conversion_cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or row[2] is None or row[3] != format_rule_versions(row[2]):
+            return None
+        return row[0], bytes(row[1]), row[2]
+
+    def record(self, result):
+        """convert_file の結果をヒット・ミスとして数え、使われた時刻の更新や新しい変換結果の保存を予約します。"""
+        if result.get('cache_key') is None:
+            return
+        if result['cache_hit']:
+            self.hits += 1
+            self._used_keys.append(result['cache_key'])
+        else:
+            self.misses += 1
+            if result['cache_output'] is not None:
+                self._new_entries.append((result['cache_key'], result['cache_encoding'], result['cache_output'], result['features'],
+                                          format_rule_versions(result['features'])))
+        if len(self._used_keys) + len(self._new_entries) >= CONVERSION_CACHE_BATCH:
+            self.flush()
+
+    def flush(self):
+        """予約した書き込みをまとめて行い、合計サイズが上限を超えていれば古いものから削除します。"""
+        if not self._used_keys and not self._new_entries:
+            return
+        now = time.time()
+        try:
+            connection = self._connect()
+            with connection:
+                connection.executemany("UPDATE conversion_cache SET last_used = ? WHERE key = ?", ((now, key) for key in self._used_keys))
+                connection.executemany("INSERT OR REPLACE INTO conversion_cache (key, encoding, output, size, last_used, features, rules) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                       ((key, encoding, output, len(output), now, features, rules)
+                                        for key, encoding, output, features, rules in self._new_entries))
+                total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM conversion_cache").fetchone()[0]
+                if total_size > self.max_bytes:
+                    evicted_keys = []
+                    for key, size in connection.execute("SELECT key, size FROM conversion_cache ORDER BY last_used, key"):
+                        if total_size <= self.max_bytes:
+                            break
+                        evicted_keys.append((key,))
+                        total_size -= size
+                    connection.executemany("DELETE FROM conversion_cache WHERE key = ?", evicted_keys)
+        except sqlite3.Error as e:
+            error_message = f"警告: 変換結果キャッシュ '{self.path}' への書き込みに失敗しました: {e}"
+            print(error_message, file=sys.stderr)
+            write_error_log(error_message)
+        self._used_keys = []
+        self._new_entries = []
+
+    def total_size(self):
+        try:
+            return self._connect().execute("SELECT COALESCE(SUM(size), 0) FROM conversion_cache").fetchone()[0]
+        except sqlite3.Error:
+            return 0
+
+    def report(self):
+        """この実行でのヒット・ミスの件数を表示し、数えた件数をリセットします。"""
+        self.flush()
+        lookups = self.hits + self.misses
+        if lookups:
+            print(f"情報: 変換結果キャッシュ: ヒット {self.hits} 件、ミス {self.misses} 件（ヒット率 {self.hits * 100 // lookups}%）、"
+                  f"サイズ {self.total_size() / (1024 * 1024):.1f} MB / 上限 {self.max_bytes / (1024 * 1024):.0f} MB")
+        self.hits = 0
+        self.misses = 0
+
+_conversion_caches = threading.local() # スレッド（およびワーカープロセス）ごとのキャッシュ（SQLiteの接続はスレッド間で共有できないため）
+
+def get_conversion_cache(options=None):
+    """
+    詳細設定に応じた変換結果キャッシュを返します。キャッシュを使わない設定（サイズ 0）では None を返します。
+    プロファイルを取る設定では、全ページを実際に変換して計測するためキャッシュを使いません（None を返します）。
+    """
+    options = options or DEFAULT_ADVANCED_SETTINGS
+    size_mb = options.get('cache_size_mb', 0)
+    if not size_mb or size_mb <= 0 or options.get('profile'):
+        return None
+    path = options.get('cache_path') or os.path.join(LOG_DIR, CONVERSION_CACHE_FILE)
+    caches = _conversion_caches.__dict__.setdefault('caches', {})
+    cache = caches.get(path)
+    if cache is None or cache.pid != os.getpid():
+        cache = caches[path] = ConversionCache(path, int(size_mb * 1024 * 1024))
+    cache.max_bytes = int(size_mb * 1024 * 1024)
+    return cache
+
+def get_conversion_cache_key(content_hash, specified_encoding=None, options=None):
+    """
+    変換結果キャッシュのキー（内容のハッシュ値・変換エンジン・文字コードの指定・改行コード）を返します。
+    変換規則のバージョンはキーに含めず、ページごとに変換結果と一緒に保存します（ConversionCache.get を参照）。
+    """
+    options = options or DEFAULT_ADVANCED_SETTINGS
+    engine = options.get('engine', ENGINE_LEGACY)
+    literal_preformatted = int(engine in (ENGINE_STREAM, ENGINE_SCAN) and bool(options.get('literal_preformatted')))
+    newline = 'crlf' if os.linesep == '\r\n' else 'lf'
+    return f"{content_hash}:{engine}:{literal_preformatted}:{specified_encoding or 'auto'}:{newline}"
+# --- 変換結果キャッシュ --- END
+
+def convert_file(pukiwiki_dir, markdown_dir, filename, specified_encoding=None, options=None, encoding_hint=None, previous_entry=None):
+    """
+    1つのPukiWikiファイルについて、読み込み→文字コード判別→変換→書き込みを行います。
+    ファイルは1回だけバイト列として読み込み、文字コードの判別とデコードはメモリ上で行います。
+    encoding_hint には自動判別で最初に試す文字コードを渡します（get_encoding_hints を参照）。
+    previous_entry にはタイムスタンプファイルの前回の記録を渡します（write_output_if_changed を参照）。
+    プロセスプールのワーカーからも呼び出せるよう、画面やログファイルには直接出力せず、
+    出力するメッセージを出力順に ('info' または 'error', メッセージ) として 'log' に、
+    自動判別した文字コードを 'encoding' に、読み込んだ時点のタイムスタンプ情報を 'mtime' / 'size' / 'hash' に、
+    出力を書き込んだかどうかを 'written' に、出力の情報を 'output_hash' / 'output_mtime' に
+    入れた辞書を返します。'error' のメッセージはエラーログにも残します。
+    変換結果キャッシュを使う設定では、キャッシュのキーを 'cache_key' に、ヒットしたかどうかを 'cache_hit' に入れ、
+    ミスした場合は保存する出力と文字コードを 'cache_output' / 'cache_encoding' に入れます（保存は ConversionCache.record で行います）。
+    プロファイルを取る設定では、段階ごとの計測結果（convert_with_profile を参照）を 'profile' に入れます。
+    ページが含む記法（sniff_features を参照。キャッシュを使った場合はキャッシュに保存した値）を 'features' に入れます。
+    実行の記録（RunMetrics）用に、読み込み・変換・書き込みの処理時間（秒）を 'read_seconds' / 'convert_seconds' / 'write_seconds' に、
+    出力のバイト数を 'output_bytes' に入れます。
+    """
+    result = {'filename': filename, 'markdown_filename': None, 'ok': False, 'encoding': None,
+              'mtime': None, 'size': None, 'hash': None,
+              'written': False, 'output_hash': None, 'output_mtime': None, 'log': [],
+              'cache_key': None, 'cache_hit': False, 'cache_encoding': None, 'cache_output': None, 'profile': None, 'features': None,
+              'output_bytes': None, 'read_seconds': None, 'convert_seconds': None, 'write_seconds': None}
+    pukiwiki_filepath = os.path.join(pukiwiki_dir, filename)
+    markdown_filename = get_markdown_filename(filename, result)
+    result['markdown_filename'] = markdown_filename
+    markdown_filepath = os.path.join(markdown_dir, markdown_filename)
+
+    try:
+        read_start = time.perf_counter()
+        with open(pukiwiki_filepath, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            pukiwiki_bytes = f.read()
+        result['mtime'] = stat.st_mtime
+        result['size'] = stat.st_size
+        result['hash'] = compute_content_hash(pukiwiki_bytes)
+        convert_start = time.perf_counter()
+        result['read_seconds'] = convert_start - read_start
+
+        # 同じ内容を同じ設定で変換したことがあれば、キャッシュした出力を使う（文字コードの判別も省く）
+        cache = get_conversion_cache(options)
+        cached = None
+        if cache is not None:
+            result['cache_key'] = get_conversion_cache_key(result['hash'], specified_encoding, options)
+            cached = cache.get(result['cache_key'])
+            result['cache_hit'] = cached is not None
+
+        pukiwiki_content = None
+        encoding_to_use = specified_encoding
+        if not encoding_to_use:
+            if cached is not None:
+                encoding_to_use = cached[0]
+            else:
+                encoding_to_use, pukiwiki_content = detect_encoding_from_bytes(pukiwiki_bytes, encoding_hint)
+            result['encoding'] = encoding_to_use
+
+        if not encoding_to_use:
+            result['log'].append(('error', f"警告: ファイル '{pukiwiki_filepath}' の文字コードを自動判別できませんでした。UTF-8として処理を試みます。"))
+            encoding_to_use = 'utf-8' # デフォルトフォールバック
+
+        result['log'].append(('info', f"  変換中: '{pukiwiki_filepath}' (encoding: {encoding_to_use})"))
+        if cached is not None:
+            output_bytes = cached[1]
+            result['features'] = cached[2]
+        else:
+            if pukiwiki_content is None:
+                pukiwiki_content = pukiwiki_bytes.decode(encoding_to_use, errors='replace')
+            # テキストモードで読み込んだ場合と同じく、改行コードを \n に揃える
+            pukiwiki_content = pukiwiki_content.replace('\r\n', '\n').replace('\r', '\n')
+
+            # ページが含む記法を1回だけ調べ、従来の変換エンジンではその結果で使われていない記法の段階を省く
+            result['features'] = features = sniff_features(pukiwiki_content)
+            if options and options.get('profile'):
+                markdown_content, result['profile'] = convert_with_profile(pukiwiki_content, options, features)
+            else:
+                convert = get_converter(options)
+                if convert is convert_pukiwiki_to_markdown:
+                    markdown_content = convert(pukiwiki_content, features)
+                else:
+                    markdown_content = convert(pukiwiki_content)
+
+            # テキストモードで書き込んだ場合と同じバイト列（改行コードは OS の既定）にする
+            if os.linesep != '\n':
+                markdown_content = markdown_content.replace('\n', os.linesep)
+            output_bytes = markdown_content.encode('utf-8')
+            if cache is not None:
+                result['cache_encoding'] = result['encoding']
+                result['cache_output'] = output_bytes
+        write_start = time.perf_counter()
+        result['convert_seconds'] = write_start - convert_start
+        result['output_bytes'] = len(output_bytes)
+        result['written'], result['output_hash'], result['output_mtime'] = write_output_if_changed(
+            markdown_filepath, output_bytes, previous_entry)
+        result['write_seconds'] = time.perf_counter() - write_start
+
+        result['ok'] = True
+    except Exception as e:
+        result['log'].append(('error', f"エラー: ファイル '{pukiwiki_filepath}' の変換中にエラーが発生しました: {e}"))
+    return result
+
+def _convert_file_task(task):
+    """プロセスプール用: 引数のタプルを展開して convert_file を呼び出します。"""
+    try:
+        return convert_file(*task)
+    finally:
+        # ワーカーのプロセスは atexit を実行せずに終了するため、ワーカーで記録したエラーログはここで書き込む
+        flush_error_log()
+
+def resolve_worker_count(workers):
+    """詳細設定の並列数を実際のプロセス数に変換します（0 以下は CPU 数）。"""
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+def iter_conversion_results(pukiwiki_dir, markdown_dir, filenames, specified_encoding=None, options=None, manifest=None):
+    """
+    filenames を変換し、convert_file の結果をファイルの順番どおりに返すジェネレーターです。
+    manifest には前回のタイムスタンプファイルの記録を渡します（文字コードの判別と出力の比較に使います）。
+    詳細設定の workers が2以上の場合は、ファイルをまとめて（chunksize 単位で）プロセスプールに渡し並列に変換します。
+    途中でジェネレーターを閉じると、プロセスプールに渡したまだ始まっていない変換は行いません。
+    """
+    options = options or DEFAULT_ADVANCED_SETTINGS
+    manifest = manifest or {}
+    encoding_hints = get_encoding_hints(filenames, manifest)
+    workers = min(resolve_worker_count(options.get('workers', 1)), len(filenames))
+    if workers > 1:
+        # タスク投入のオーバーヘッドを抑えつつ、ワーカー間の負荷が偏らない程度にまとめる
+        chunksize = max(1, min(64, len(filenames) // (workers * 4)))
+        tasks = [(pukiwiki_dir, markdown_dir, filename, specified_encoding, options, encoding_hints[filename], manifest.get(filename)) for filename in filenames]
+        done_count = 0
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+            from concurrent.futures.process import BrokenProcessPool
+            print(f"情報: {workers} プロセスで並列変換します。(chunksize: {chunksize})")
+            executor = ProcessPoolExecutor(max_workers=workers)
+            try:
+                for result in executor.map(_convert_file_task, tasks, chunksize=chunksize):
+                    done_count += 1
+                    yield result
+            finally:
+                # 変換が中止された（ジェネレーターが閉じられた）場合は、まだ始まっていない変換を取り消す
+                executor.shutdown(wait=True, cancel_futures=True)
+            return
+        except (ImportError, OSError, NotImplementedError, BrokenProcessPool) as e:
+            error_message = f"警告: 並列変換を継続できませんでした。残り {len(filenames) - done_count} ファイルを順に変換します: {e}"
+            print(error_message, file=sys.stderr)
+            write_error_log(error_message)
+            filenames = filenames[done_count:]
+
+    for filename in filenames:
+        yield convert_file(pukiwiki_dir, markdown_dir, filename, specified_encoding, options, encoding_hints[filename], manifest.get(filename))
+
+def build_concatenated_markdown(markdown_dir, concatenated_filepath):
+    """
+    markdown_dir 内の .md ファイルを1つに連結して concatenated_filepath に保存します。
+    ページごとの区切り（セグメント）は順にファイルへ書き出し、全ページをメモリに保持しません。
+    各セグメントの位置・長さ・ハッシュ値は LOG_DIR の CONCAT_INDEX_FILE に記録し、次回は更新時刻とサイズが
+    変わっていないページのセグメントを前回の連結ファイルからコピーします（そのページの .md は読み込みません）。
+    記録には markdown_dir も保存し、前回と異なるディレクトリを連結する場合は前回のセグメントを使いません。
+    戻り値は (連結したページ数, 前回の連結ファイルから再利用したページ数) です。
+    """
+    # 前回の連結ファイルとそのセグメント一覧（連結ファイルが書き換えられていれば使わない）
+    index_filepath = os.path.join(LOG_DIR, CONCAT_INDEX_FILE)
+    previous_segments = {}
+    base_filepath = None
+    try:
+        with open(index_filepath, 'r', encoding='utf-8') as f_index:
+            index = json.load(f_index)
+        base_filepath = index['path']
+        if (index['markdown_dir'] == os.path.abspath(markdown_dir) and
+                os.path.isfile(base_filepath) and os.path.getsize(base_filepath) == index['size']):
+            previous_segments = {segment['file']: segment for segment in index['segments']}
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    # markdown_dir 内の .md ファイルをソートして取得 (順序をある程度一定にするため)
+    md_files = sorted([f for f in os.listdir(markdown_dir) if f.endswith('.md') and f != TIMESTAMP_FILE])
+
+    segments = []
+    offset = 0
+    reused_count = 0
+    temp_filepath = concatenated_filepath + '.tmp'
+    base_file = open(base_filepath, 'rb') if previous_segments else None
+    try:
+        with open(temp_filepath, 'wb') as f_concat:
+            for md_filename in md_files:
+                md_filepath = os.path.join(markdown_dir, md_filename)
+                segment_bytes = None
+                try:
+                    stat = os.stat(md_filepath)
+                    previous = previous_segments.get(md_filename)
+                    if previous and previous['mtime'] == stat.st_mtime and previous['md_size'] == stat.st_size:
+                        base_file.seek(previous['offset'])
+                        data = base_file.read(previous['length'])
+                        if compute_content_hash(data) == previous['hash']:
+                            segment_bytes = data
+                            reused_count += 1
+                    if segment_bytes is None:
+                        with open(md_filepath, 'rb') as f_md:
+                            content = f_md.read().decode('utf-8')
+                        # テキストモードで読み書きした場合と同じバイト列にする
+                        content = content.replace('\r\n', '\n').replace('\r', '\n')
+                        segment_text = f"\n\n---\n## FILE: {md_filename}\n---\n\n{content}"
+                        if os.linesep != '\n':
+                            segment_text = segment_text.replace('\n', os.linesep)
+                        segment_bytes = segment_text.encode('utf-8')
+                except Exception as e_read_md:
+                    error_message = f"連結用Markdownファイル '{md_filepath}' の読み込み中にエラー: {e_read_md}"
+                    print(error_message, file=sys.stderr)
+                    write_error_log(error_message)
+                    continue
+
+                f_concat.write(segment_bytes)
+                segments.append({'file': md_filename, 'offset': offset, 'length': len(segment_bytes),
+                                 'hash': compute_content_hash(segment_bytes), 'mtime': stat.st_mtime, 'md_size': stat.st_size})
+                offset += len(segment_bytes)
+    except Exception:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+        raise
+    finally:
+        if base_file:
+            base_file.close()
+
+    if not segments:
+        os.remove(temp_filepath)
+        return 0, 0
+
+    os.replace(temp_filepath, concatenated_filepath)
+    with open(index_filepath, 'w', encoding='utf-8') as f_index:
+        json.dump({'path': concatenated_filepath, 'markdown_dir': os.path.abspath(markdown_dir), 'size': offset, 'segments': segments},
+                  f_index, ensure_ascii=False)
+    return len(segments), reused_count
+
+class ConsoleReporter:
+    """
+    GUIを使わずに実行する場合の通知先です。
+    tkinter.messagebox と同じ名前のメソッドを持ち、process_conversion の reporter として渡せます。
+    通知の内容は process_conversion がコンソールにも出力しているため、ここでは表示しません。
+    """
+    def __init__(self, assume_yes=False):
+        self.assume_yes = assume_yes # askyesno の問い合わせに対する回答
+
+    def showinfo(self, title, message):
+        pass
+
+    showwarning = showinfo
+    showerror = showinfo
+
+    def askyesno(self, title, message):
+        answer = "はい" if self.assume_yes else "いいえ"
+        print(f"{title}: {message} -> {answer}")
+        return self.assume_yes
+
+GUI_REFRESH_INTERVAL_MS = 100 # バックグラウンドの変換の進捗を画面に反映する間隔（ミリ秒）
+CONVERSION_THREAD_NAME = 'conversion' # GUIから実行する変換のスレッドの名前
+
+class GuiRelay:
+    """
+    バックグラウンドのスレッドで実行する変換と、GUI（tkinter）のスレッドの間の受け渡し口です。
+    process_conversion には progress_bar / status_var / reporter の代わりにこのオブジェクトの同名の属性を渡します。
+    進捗やステータスの更新は最新の値を上書きするだけなので、ファイルごとに画面を描き直すことはありません。
+    GUIのスレッドは after() で一定間隔ごとに take_latest と run_pending_calls を呼び出して画面に反映します。
+    メッセージボックスの表示はGUIのスレッドで行い、変換のスレッドは表示が終わるまで（askyesno は回答まで）待ちます。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {} # 'maximum' / 'value' / 'info' / 'status' / 'finished' → 最新の値
+        self._calls = queue.Queue() # (メソッド名, 引数, 結果の受け渡し用の辞書, 完了の通知)
+        self._closed = False
+        self.progress_bar = _RelayProgressBar(self)
+        self.status_var = _RelayStatusVar(self)
+        self.reporter = _RelayReporter(self)
+
+    def post(self, key, value):
+        with self._lock:
+            self._latest[key] = value
+
+    def take_latest(self):
+        """前回の呼び出しから更新された値（キーごとに最新のもの）を返します。GUIのスレッドから呼び出します。"""
+        with self._lock:
+            latest, self._latest = self._latest, {}
+        return latest
+
+    def call(self, name, *args):
+        """GUIのスレッドでメッセージボックスを表示し、その戻り値を返します。ウィンドウを閉じた後は表示せずに None を返します。"""
+        if self._closed:
+            return None
+        result = {}
+        done = threading.Event()
+        self._calls.put((name, args, result, done))
+        done.wait()
+        return result.get('value')
+
+    def run_pending_calls(self, target):
+        """依頼されたメッセージボックスを target（tkinter.messagebox）で表示します。GUIのスレッドから呼び出します。"""
+        while True:
+            try:
+                name, args, result, done = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                result['value'] = getattr(target, name)(*args)
+            finally:
+                done.set()
+
+    def close(self):
+        """ウィンドウを閉じるときに呼び出し、表示を待っている変換のスレッドを先に進めます。"""
+        self._closed = True
+        while True:
+            try:
+                _, _, _, done = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            done.set()
+
+class _RelayProgressBar:
+    """GuiRelay の progress_bar（ttk.Progressbar の代わりに進捗を受け取ります）。"""
+    def __init__(self, relay):
+        self._relay = relay
+
+    def __setitem__(self, key, value):
+        self._relay.post(key, value)
+
+    def update_progress_info(self, current, total):
+        self._relay.post('info', (current, total))
+
+class _RelayStatusVar:
+    """GuiRelay の status_var（tk.StringVar の代わりにステータスを受け取ります）。"""
+    def __init__(self, relay):
+        self._relay = relay
+
+    def set(self, value):
+        self._relay.post('status', value)
+
+class _RelayReporter:
+    """GuiRelay の reporter（tkinter.messagebox の代わりに通知を受け取り、GUIのスレッドで表示します）。"""
+    def __init__(self, relay):
+        self._relay = relay
+
+    def showinfo(self, title, message):
+        self._relay.call('showinfo', title, message)
+
+    def showwarning(self, title, message):
+        self._relay.call('showwarning', title, message)
+
+    def showerror(self, title, message):
+        self._relay.call('showerror', title, message)
+
+    def askyesno(self, title, message):
+        return bool(self._relay.call('askyesno', title, message))
+
+def report_error(reporter, message):
+    """エラーをコンソールに出力し、reporter にも通知します。"""
+    print(f"エラー: {message}", file=sys.stderr)
+    reporter.showerror("エラー", message)
+
+# --- 実行の記録 --- START
+METRICS_RUNS_FILE = 'conversion_runs.jsonl' # 実行ごとの集計を1行ずつ追記するファイル（LOG_DIR 内）
+METRICS_DIR = 'metrics' # 実行ごとのファイル単位の記録を保存するディレクトリ（LOG_DIR 内）
+METRICS_KEEP_RUNS = 10 # METRICS_DIR に残す実行の件数（古いものから削除）
+METRICS_RUNS_MAX_BYTES = 4 * 1024 * 1024 # METRICS_RUNS_FILE がこのサイズを超えたら古い行を削除する
+METRICS_KEEP_RUN_SUMMARIES = 1000 # METRICS_RUNS_FILE の古い行を削除するときに残す、新しい実行の件数
+
+class RunMetrics:
+    """
+    1回の変換のファイルごとの処理時間・バイト数・文字コード・キャッシュと書き込みの判断を集め、
+    機械で読める形式（JSONL）で LOG_DIR に保存します。
+    - METRICS_RUNS_FILE: 実行ごとの集計（件数・バイト数・処理時間・ページ/秒・MB/秒）を1行ずつ追記します（性能の推移の監視用）。
+      METRICS_RUNS_MAX_BYTES を超えたら新しい METRICS_KEEP_RUN_SUMMARIES 件だけを残します
+    - METRICS_DIR/run_日時.jsonl: 1行目に集計、2行目以降にファイルごとの記録を保存します（遅くなったページの調査用）
+    集計には、変換したページが含む記法ごとのページ数と、従来の変換エンジンで省いた段階ごとのページ数も含めます。
+    """
+
+    def __init__(self, pukiwiki_dir, markdown_dir, mode, options, pages_scanned):
+        self.started = datetime.datetime.now()
+        self.start = time.perf_counter()
+        self.elapsed = None
+        self.run = {'pukiwiki_dir': os.path.abspath(pukiwiki_dir), 'markdown_dir': os.path.abspath(markdown_dir), 'mode': mode,
+                    'engine': options.get('engine', ENGINE_LEGACY), 'workers': resolve_worker_count(options.get('workers', 1)),
+                    'pages_scanned': pages_scanned}
+        self.files = []
+        self.pages_sniffed = 0
+        self.feature_pages = collections.Counter()
+        self.skipped_stages = collections.Counter()
+
+    def add(self, result):
+        """convert_file の結果を1件記録します。"""
+        if result['cache_key'] is None:
+            cache = 'off'
+        else:
+            cache = 'hit' if result['cache_hit'] else 'miss'
+        if result['ok']:
+            write = 'written' if result['written'] else 'unchanged'
+        else:
+            write = 'error'
+        record = {'type': 'file', 'file': result['filename'], 'markdown_file': result['markdown_filename'], 'ok': result['ok'],
+                  'encoding': result['encoding'], 'input_bytes': result['size'], 'output_bytes': result['output_bytes']}
+        for name in ('read_seconds', 'convert_seconds', 'write_seconds'):
+            record[name] = round(result[name], 6) if result[name] is not None else None
+        record.update(cache=cache, write=write)
+        features = result.get('features')
+        if features is not None:
+            record['features'] = feature_names(features)
+            self.pages_sniffed += 1
+            self.feature_pages.update(record['features'])
+            if self.run['engine'] == ENGINE_LEGACY and not result['cache_hit']:
+                self.skipped_stages.update(name for name, _ in LEGACY_STAGES if not LEGACY_STAGE_FEATURES[name] & features)
+        self.files.append(record)
+
+    def stop(self):
+        """変換の終了時に呼び出し、ここまでの経過時間をスループットの計算に使います。"""
+        self.elapsed = time.perf_counter() - self.start
+
+    def save(self, summary):
+        """集計を計算して保存し、保存先のパスを返します（保存に失敗した場合は None）。"""
+        if self.elapsed is None:
+            self.stop()
+        input_bytes = sum(record['input_bytes'] or 0 for record in self.files)
+        output_bytes = sum(record['output_bytes'] or 0 for record in self.files)
+        run = dict({'type': 'run'}, **self.run)
+        run.update(started=self.started.isoformat(timespec='seconds'),
+                   finished=datetime.datetime.now().isoformat(timespec='seconds'),
+                   pages_processed=len(self.files), input_bytes=input_bytes, output_bytes=output_bytes,
+                   elapsed_seconds=round(self.elapsed, 3),
+                   pages_per_second=round(len(self.files) / self.elapsed, 1) if self.elapsed > 0 else None,
+                   mb_per_second=round(input_bytes / (1024 * 1024) / self.elapsed, 3) if self.elapsed > 0 else None)
+        for name in ('read_seconds', 'convert_seconds', 'write_seconds'):
+            run[name] = round(sum(record[name] or 0.0 for record in self.files), 3)
+        # 記法ごとのページ数と、省いた段階ごとのページ数（キャッシュを使ったページは変換しないため、省いた段階には含めない）
+        run.update(pages_sniffed=self.pages_sniffed,
+                   features={name: self.feature_pages[name] for _, name in FEATURE_NAMES},
+                   stages_skipped={name: self.skipped_stages[name] for name, _ in LEGACY_STAGES} if self.run['engine'] == ENGINE_LEGACY else {})
+        run.update(summary)
+
+        metrics_dir = os.path.join(LOG_DIR, METRICS_DIR)
+        details_path = os.path.join(metrics_dir, f"run_{self.started.strftime('%Y%m%d_%H%M%S_%f')}.jsonl")
+        run['details'] = details_path
+        try:
+            os.makedirs(metrics_dir, exist_ok=True)
+            with open(details_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(run, ensure_ascii=False) + '\n')
+                for record in self.files:
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            runs_path = os.path.join(LOG_DIR, METRICS_RUNS_FILE)
+            with open(runs_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(run, ensure_ascii=False) + '\n')
+            # 監視中は変更のたびに追記されるため、大きくなったら新しい実行の集計だけを残す
+            if os.path.getsize(runs_path) > METRICS_RUNS_MAX_BYTES:
+                with open(runs_path, 'r', encoding='utf-8') as f:
+                    recent_runs = collections.deque(f, maxlen=METRICS_KEEP_RUN_SUMMARIES)
+                with open(runs_path + '.tmp', 'w', encoding='utf-8') as f:
+                    f.writelines(recent_runs)
+                os.replace(runs_path + '.tmp', runs_path)
+            # ファイルごとの記録は新しいものだけを残す
+            for name in sorted(name for name in os.listdir(metrics_dir) if name.startswith('run_'))[:-METRICS_KEEP_RUNS]:
+                os.remove(os.path.join(metrics_dir, name))
+        except OSError as e:
+            error_message = f"警告: 実行の記録 '{details_path}' の保存に失敗しました: {e}"
+            print(error_message, file=sys.stderr)
+            write_error_log(error_message)
+            return None
+        print(f"情報: 実行の記録を '{details_path}' に保存しました。"
+              f"({run['pages_processed']} ファイル、{run['elapsed_seconds']} 秒、{run['pages_per_second']} ページ/秒、{run['mb_per_second']} MB/秒)")
+        return details_path
+# --- 実行の記録 --- END
+
+# --- チェックポイント --- START
+CHECKPOINT_FILE = 'conversion_checkpoint.jsonl' # 全変換・同期変換の途中経過（LOG_DIR 内）
+CHECKPOINT_INTERVAL_FILES = 500 # この件数のファイルを処理するごとに途中経過を保存する
+CHECKPOINT_INTERVAL_SECONDS = 60.0 # 前回の保存からこの秒数が経った場合も途中経過を保存する
+
+class ConversionCheckpoint:
+    """
+    変換の途中経過を保存する間隔を管理し、全変換・同期変換では変換を終えたファイル名を LOG_DIR の CHECKPOINT_FILE に追記します。
+    1行目は変換の設定（ディレクトリ・変換モード・既存の .md を削除したか）、2行目以降は保存ごとの変換を終えたファイル名の一覧です。
+    変換が最後まで終わるとファイルを削除するため、ファイルが残っていれば中断した変換をそこから再開できます。
+    """
+    def __init__(self, pukiwiki_dir, markdown_dir, conversion_mode):
+        self.path = os.path.join(LOG_DIR, CHECKPOINT_FILE)
+        self.pukiwiki_dir = pukiwiki_dir
+        self.markdown_dir = markdown_dir
+        self.conversion_mode = conversion_mode
+        self.journal = conversion_mode in ('full', 'mirror') # 更新変換はタイムスタンプの記録だけで再開できる
+        self._done = []
+        self._processed = 0
+        self._last_saved = time.monotonic()
+
+    @staticmethod
+    def load(pukiwiki_dir, markdown_dir):
+        """
+        pukiwiki_dir → markdown_dir の中断した変換の途中経過を (設定の辞書, 変換を終えたファイル名の集合) で返します。
+        途中経過がない場合や、ほかのディレクトリの変換の途中経過の場合は None を返します。
+        """
+        try:
+            with open(os.path.join(LOG_DIR, CHECKPOINT_FILE), 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if (os.path.normcase(header['pukiwiki_dir']) != os.path.normcase(os.path.abspath(pukiwiki_dir))
+                        or os.path.normcase(header['markdown_dir']) != os.path.normcase(os.path.abspath(markdown_dir))):
+                    return None
+                done = set()
+                for line in f:
+                    try:
+                        done.update(json.loads(line)['done'])
+                    except (ValueError, KeyError):
+                        break # 書き込みの途中で中断した行以降は使わない
+                return header, done
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def start(self, outputs_cleared):
+        """新しく始めた全変換・同期変換の設定を書き込みます（以前の途中経過は破棄します）。"""
+        if not self.journal:
+            return
+        header = {'pukiwiki_dir': os.path.abspath(self.pukiwiki_dir), 'markdown_dir': os.path.abspath(self.markdown_dir),
+                  'mode': self.conversion_mode, 'outputs_cleared': outputs_cleared,
+                  'started': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        self._write('w', header)
+
+    def add(self, filename, ok):
+        """ファイルを1つ処理したことを記録します。変換できたファイルは次の保存で変換済みとして書き込みます。"""
+        self._processed += 1
+        if ok and self.journal:
+            self._done.append(filename)
+
+    def due(self):
+        """途中経過を保存する時期かを返します。"""
+        return self._processed >= CHECKPOINT_INTERVAL_FILES or (
+            self._processed > 0 and time.monotonic() - self._last_saved >= CHECKPOINT_INTERVAL_SECONDS)
+
+    def saved(self):
+        """タイムスタンプの記録を保存した後に呼び出し、その時点までに変換を終えたファイル名を書き込みます。"""
+        if self.journal and self._done:
+            self._write('a', {'done': self._done})
+        self._done = []
+        self._processed = 0
+        self._last_saved = time.monotonic()
+
+    def finish(self):
+        """変換が最後まで終わったので途中経過を削除します。"""
+        if self.journal and os.path.exists(self.path):
+            try:
+                os.remove(self.path)
+            except OSError as e:
+                print(f"警告: 途中経過のファイル '{self.path}' を削除できませんでした: {e}", file=sys.stderr)
+
+    def _write(self, mode, record):
+        try:
+            if not os.path.exists(LOG_DIR):
+                os.makedirs(LOG_DIR)
+            with open(self.path, mode, encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            error_message = f"警告: 途中経過のファイル '{self.path}' への書き込みに失敗しました: {e}"
+            print(error_message, file=sys.stderr)
+            write_error_log(error_message)
+# --- チェックポイント --- END
+
+def find_orphaned_outputs(markdown_dir, filenames):
+    """
+    出力ディレクトリの .md ファイルのうち、filenames（PukiWikiのファイル名）のどれからも出力されないものを返します。
+    タイムスタンプファイルは対象にしません。
+    """
+    expected = {os.path.normcase(get_markdown_filename(filename)) for filename in filenames}
+    expected.add(os.path.normcase(TIMESTAMP_FILE))
+    with os.scandir(markdown_dir) as entries:
+        return sorted(entry.name for entry in entries
+                      if entry.name.endswith('.md') and entry.is_file() and os.path.normcase(entry.name) not in expected)
+
+def delete_orphaned_outputs(markdown_dir, filenames, reporter):
+    """
+    同期変換で、変換元のなくなった .md ファイルだけを確認のうえ削除します。
+    戻り値は削除したファイル数です（確認でキャンセルされた場合は 0）。
+    """
+    try:
+        orphaned = find_orphaned_outputs(markdown_dir, filenames)
+    except OSError as e:
+        error_message = f"出力ディレクトリのファイル一覧取得中にエラー: {e}"
+        print(f"エラー: {error_message}", file=sys.stderr)
+        write_error_log(error_message)
+        return 0
+    if not orphaned:
+        print("情報: 出力ディレクトリに変換元のない .md ファイルはありませんでした。")
+        return 0
+
+    preview = "\n".join(orphaned[:10]) + (f"\n…ほか {len(orphaned) - 10} 個" if len(orphaned) > 10 else "")
+    if not reporter.askyesno("確認", f"出力ディレクトリ '{markdown_dir}' 内の、変換元のない {len(orphaned)} 個の .md ファイルを削除しますか？\n\n{preview}"):
+        print("情報: 変換元のない .md ファイルの削除はキャンセルされました。")
+        return 0
+
+    deleted_count = 0
+    for item in orphaned:
+        item_path = os.path.join(markdown_dir, item)
+        try:
+            os.remove(item_path)
+            print(f"  削除しました: {item_path}")
+            deleted_count += 1
+        except OSError as e_remove:
+            error_message = f"エラー: ファイル '{item_path}' の削除に失敗しました: {e_remove}"
+            print(error_message, file=sys.stderr)
+            write_error_log(error_message)
+    print(f"情報: 変換元のない {deleted_count}個の .md ファイルを削除しました。")
+    return deleted_count
 
-def process_conversion(pukiwiki_dir, markdown_dir, specified_encoding=None, progress_bar=None, status_var=None, root_window=None, conversion_mode='full', auto_update=False, update_interval=60):
+def process_conversion(pukiwiki_dir, markdown_dir, specified_encoding=None, progress_bar=None, status_var=None, root_window=None, conversion_mode='full', auto_update=False, update_interval=60, options=None, reporter=None, changed_files=None, resume=False, cancel_event=None):
     """
     PukiWikiからMarkdownへの変換処理を実行します。
     main()関数からロジックを分離。
     GUIの進捗表示ウィジェットを更新する機能を追加。
     全変換/更新変換の機能を追加。
+    conversion_mode は 'full'（全変換）、'update'（更新変換）、'mirror'（同期変換：既存の .md を削除せずに全ファイルを変換し、
+    内容が変わったファイルだけを書き込んで、変換元のない .md だけを削除する）、'affected'（規則の変更の反映：更新変換に加えて、
+    バージョンが上がった変換規則で変換したファイルを変換し直す。get_rule_affected_files を参照）のいずれかです。
+    options には load_advanced_settings() の詳細設定（変換エンジンなど）を渡します。
+    reporter にはポップアップ通知の送り先を渡します（GUIでは tkinter.messagebox、省略時は ConsoleReporter）。
+    changed_files には、更新変換で確認するファイル名の集合を渡します（監視モードで変更を検出したファイル。省略時は全ファイル）。
+    変換中はタイムスタンプの記録を定期的に保存します（ConversionCheckpoint を参照）。resume が True なら全変換・同期変換を
+    中断した時点から再開し、None なら中断した変換があれば再開するかを reporter で確認します（False は常に最初から変換します）。
+    cancel_event（threading.Event）がセットされると、処理中のファイルの後で変換を中止し、途中経過を保存して戻ります。
+    Ctrl+C（KeyboardInterrupt）で中断された場合は、それまでに変換したファイルを記録してから KeyboardInterrupt を送出し直します。
+    戻り値は処理件数の辞書です（プロファイルを取る設定では 'profile' に ConversionProfile.report の集計結果が入ります）。
+    入力エラーで処理を開始できなかった場合は None を返します。
     """
-    global auto_update_timer, auto_update_running
+    if reporter is None:
+        reporter = ConsoleReporter()
     
     if not pukiwiki_dir or not markdown_dir:
-        messagebox.showerror("エラー", "PukiWikiディレクトリとMarkdown出力ディレクトリの両方を選択してください。")
-        return
+        report_error(reporter, "PukiWikiディレクトリとMarkdown出力ディレクトリの両方を選択してください。")
+        return None
 
     if not os.path.isdir(pukiwiki_dir):
-        messagebox.showerror("エラー", f"PukiWikiディレクトリ '{pukiwiki_dir}' が見つかりません。")
-        return
+        report_error(reporter, f"PukiWikiディレクトリ '{pukiwiki_dir}' が見つかりません。")
+        return None
 
     if not os.path.exists(markdown_dir):
         try:
             os.makedirs(markdown_dir)
             print(f"出力ディレクトリ '{markdown_dir}' を作成しました。")
         except OSError as e:
-            messagebox.showerror("エラー", f"出力ディレクトリ '{markdown_dir}' の作成に失敗しました: {e}")
-            return
+            report_error(reporter, f"出力ディレクトリ '{markdown_dir}' の作成に失敗しました: {e}")
+            return None
     elif not os.path.isdir(markdown_dir):
-        messagebox.showerror("エラー", f"出力先 '{markdown_dir}' はディレクトリではありません。")
-        return
+        report_error(reporter, f"出力先 '{markdown_dir}' はディレクトリではありません。")
+        return None
+
+    # 前回の記録（タイムスタンプ・文字コード）は全変換で timestamps.md が削除される前に読み込んでおく
+    options = options or DEFAULT_ADVANCED_SETTINGS
+    configure_error_log(options)
+    manifest_store = open_manifest_store(markdown_dir, options)
+    previous_timestamps = manifest_store.load(verbose=(conversion_mode in ('update', 'affected')))
+
+    # PukiWikiディレクトリは1回だけ走査し、変更の検出とタイムスタンプファイルの保存で共用する
+    if changed_files is None or conversion_mode != 'update':
+        file_stats = scan_pukiwiki_stats(pukiwiki_dir)
+    else:
+        # 監視モードでは変更を検出したファイルだけを調べ、それ以外のファイルは前回の記録をそのまま使う
+        file_stats = {filename: (entry.get('mtime'), entry.get('size')) for filename, entry in previous_timestamps.items() if filename not in changed_files}
+        file_stats.update(scan_pukiwiki_stats(pukiwiki_dir, changed_files))
+
+    # 中断した全変換・同期変換の再開
+    resume_state = None
+    if conversion_mode in ('full', 'mirror') and resume is not False:
+        resume_state = ConversionCheckpoint.load(pukiwiki_dir, markdown_dir)
+        if resume_state is None:
+            if resume:
+                print("情報: 再開できる中断した変換はありません。最初から変換します。")
+        elif not resume:
+            mode_name = "同期変換" if resume_state[0]['mode'] == 'mirror' else "全変換"
+            if not reporter.askyesno("確認", f"前回中断した{mode_name}（{resume_state[0].get('started', '')} 開始、{len(resume_state[1])} ファイル変換済み）があります。\n"
+                                           f"続きから再開しますか？\n「いいえ」を選ぶと最初から変換します。"):
+                resume_state = None
+    if resume_state is not None:
+        conversion_mode = resume_state[0]['mode']
 
     # 処理対象ファイルの決定
+    renamed_count = 0 # 更新変換で名前の変更を反映した .md ファイルの数
+    removed_count = 0 # 更新変換・同期変換で削除した、変換元のない .md ファイルの数
+    outputs_cleared = False # 全変換で既存の .md ファイルを削除したか（削除した場合は前回の記録を引き継がない）
     if conversion_mode == 'full':
-        # 全変換モード：既存の .md ファイルを削除
-        if os.path.exists(markdown_dir) and os.path.isdir(markdown_dir):
-            confirm_delete = messagebox.askyesno(
+        # 全変換モード：既存の .md ファイルを削除（中断した全変換の再開時は削除しない）
+        if resume_state is not None:
+            outputs_cleared = resume_state[0].get('outputs_cleared', False)
+        elif os.path.exists(markdown_dir) and os.path.isdir(markdown_dir):
+            confirm_delete = reporter.askyesno(
                 "確認",
                 f"出力ディレクトリ '{markdown_dir}' 内の既存の .md ファイルをすべて削除しますか？\n"
                 f"この操作は元に戻せません。"
             )
             if confirm_delete:
+                outputs_cleared = True
                 deleted_count = 0
                 errors_deleting = False
                 try:
@@ -753,50 +2743,78 @@ def process_conversion(pukiwiki_dir, markdown_dir, specified_encoding=None, prog
                                 write_error_log(error_message)
                                 errors_deleting = True
                     if deleted_count > 0:
-                        messagebox.showinfo("情報", f"{deleted_count}個の .md ファイルを削除しました。")
+                        print(f"情報: {deleted_count}個の .md ファイルを削除しました。")
+                        reporter.showinfo("情報", f"{deleted_count}個の .md ファイルを削除しました。")
                     elif not errors_deleting:
-                        messagebox.showinfo("情報", "出力ディレクトリに削除対象の .md ファイルはありませんでした。")
+                        print("情報: 出力ディレクトリに削除対象の .md ファイルはありませんでした。")
+                        reporter.showinfo("情報", "出力ディレクトリに削除対象の .md ファイルはありませんでした。")
                     if errors_deleting:
-                        messagebox.showwarning("警告", "一部の .md ファイルの削除中にエラーが発生しました。詳細はコンソールを確認してください。")
+                        reporter.showwarning("警告", "一部の .md ファイルの削除中にエラーが発生しました。詳細はコンソールを確認してください。")
                 except Exception as e_list:
                     error_message = f"出力ディレクトリのファイル一覧取得中にエラー: {e_list}"
                     print(f"エラー: {error_message}", file=sys.stderr)
                     write_error_log(error_message)
-                    messagebox.showerror("エラー", error_message)
-                    return
+                    reporter.showerror("エラー", error_message)
+                    return None
             else:
-                messagebox.showinfo("情報", "既存の .md ファイルの削除はキャンセルされました。変換処理を続行します。")
+                print("情報: 既存の .md ファイルの削除はキャンセルされました。変換処理を続行します。")
+                reporter.showinfo("情報", "既存の .md ファイルの削除はキャンセルされました。変換処理を続行します。")
         
         # 全変換：すべてのファイルを処理対象とする
-        files_to_process = []
-        for filename in os.listdir(pukiwiki_dir):
-            pukiwiki_filepath = os.path.join(pukiwiki_dir, filename)
-            if os.path.isfile(pukiwiki_filepath) and (filename.endswith('.txt') or filename.endswith('.page')):
-                files_to_process.append(filename)
+        files_to_process = list(file_stats)
         
         print(f"処理開始（全変換）: PukiWikiディレクトリ '{pukiwiki_dir}' -> Markdownディレクトリ '{markdown_dir}'")
+
+    elif conversion_mode == 'mirror':
+        # 同期変換モード：既存の .md ファイルは削除せずにすべてのファイルを変換し、内容が変わったファイルだけを書き込む
+        # （変換元のなくなった .md ファイルは変換の後で削除する）
+        files_to_process = list(file_stats)
+
+        print(f"処理開始（同期変換）: PukiWikiディレクトリ '{pukiwiki_dir}' -> Markdownディレクトリ '{markdown_dir}'")
         
     else:
         # 更新変換モード：更新されたファイルのみを処理対象とする
-        updated_files = get_updated_files(pukiwiki_dir, markdown_dir)
-        files_to_process = updated_files
+        previous_mtimes = {filename: entry.get('mtime') for filename, entry in previous_timestamps.items()}
+        updated_files = get_updated_files(pukiwiki_dir, markdown_dir, previous_timestamps, file_stats)
+        # 削除・名前変更されたページの .md ファイルを削除・名前変更する（名前が変わっただけのページは変換しない）
+        files_to_process, renamed_count, removed_count = propagate_removed_pages(pukiwiki_dir, markdown_dir, previous_timestamps, file_stats, updated_files)
+        if conversion_mode == 'affected':
+            # 規則の変更の反映：変換規則が変わったページも変換する（処理順は PukiWikiディレクトリの走査順に揃える）
+            selected_files = set(files_to_process).union(get_rule_affected_files(previous_timestamps, file_stats, updated_files))
+            files_to_process = [filename for filename in file_stats if filename in selected_files]
         
-        if not files_to_process:
+        if not files_to_process and not renamed_count and not removed_count:
             current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print(f"情報: 更新されたファイルはありません。[{current_time}]")
+            # 内容が同じで更新時刻だけ変わったファイルや、出力のないまま削除されたファイルがあれば、記録を更新する
+            if set(previous_timestamps) != set(previous_mtimes) or any(entry.get('mtime') != previous_mtimes[filename] for filename, entry in previous_timestamps.items()):
+                save_timestamps(pukiwiki_dir, markdown_dir, previous_timestamps, file_stats, manifest_store)
             if status_var:
                 status_var.set(f"ℹ️ 更新されたファイルはありません [{current_time}]")
             # 更新変換モードではポップアップを表示しない
             if conversion_mode != 'update':
-                messagebox.showinfo("情報", f"更新されたファイルはありません。\n\n確認時刻: {current_time}")
+                reporter.showinfo("情報", f"更新されたファイルはありません。\n\n確認時刻: {current_time}")
             
             # 自動更新が有効な場合は次の更新をスケジュール
             if auto_update:
-                schedule_auto_update(pukiwiki_dir, markdown_dir, specified_encoding, progress_bar, status_var, root_window, conversion_mode, auto_update, update_interval)
-            return
+                schedule_auto_update(pukiwiki_dir, markdown_dir, specified_encoding, progress_bar, status_var, root_window, conversion_mode, auto_update, update_interval, options, reporter, cancel_event)
+            return {'total': 0, 'converted': 0, 'errors': 0, 'written': 0, 'skipped': 0, 'deleted': 0, 'renamed': 0, 'cache_hits': 0, 'cache_misses': 0, 'cancelled': False, 'profile': None}
         
-        print(f"処理開始（更新変換）: PukiWikiディレクトリ '{pukiwiki_dir}' -> Markdownディレクトリ '{markdown_dir}'")
+        mode_name = "規則の変更の反映" if conversion_mode == 'affected' else "更新変換"
+        print(f"処理開始（{mode_name}）: PukiWikiディレクトリ '{pukiwiki_dir}' -> Markdownディレクトリ '{markdown_dir}'")
+
+    checkpoint = ConversionCheckpoint(pukiwiki_dir, markdown_dir, conversion_mode)
+    done_files = set()
+    if resume_state is not None:
+        # 前回の途中経過の保存までに変換を終えたファイルは変換しない
+        done_files = resume_state[1]
+        files_to_process = [filename for filename in files_to_process if filename not in done_files]
+        print(f"情報: 前回中断した変換を再開します。（変換済みの {len(file_stats) - len(files_to_process)} ファイルは変換しません）")
+    else:
+        checkpoint.start(outputs_cleared)
 
     print(f"処理対象ファイル数: {len(files_to_process)}")
+    print(f"変換エンジン: {options.get('engine', ENGINE_LEGACY)}")
     file_count = 0
     error_count = 0
 
@@ -807,81 +2825,58 @@ def process_conversion(pukiwiki_dir, markdown_dir, specified_encoding=None, prog
     
     processed_count = 0
 
-    for filename in files_to_process:
-        pukiwiki_filepath = os.path.join(pukiwiki_dir, filename)
-        original_basename, ext = os.path.splitext(filename)
-        decoded_basename = original_basename
-        try:
-            # ファイル名がすべて16進数文字で構成され、かつ偶数長であるかを確認
-            # あまりにも短いファイル名は誤変換の可能性を考慮し、一定長以上(例: 4文字以上)を対象とする
-            if all(c in '0123456789abcdefABCDEF' for c in original_basename) and len(original_basename) % 2 == 0 and len(original_basename) >= 2:
-                decoded_bytes = bytes.fromhex(original_basename)
-                decoded_basename_candidate = decoded_bytes.decode('utf-8')
-                # デコード結果が空文字列や制御文字のみになる場合などを避けるため、
-                # 簡単なチェックとして、デコード後も何らかの表示可能文字が含まれることを期待する。
-                # より厳密には、デコード後の文字列が妥当なファイル名文字だけで構成されているかを確認すべきだが、
-                # ここではPukiWikiのエンコード仕様が不明なため、一旦デコード成功をもって良しとする。
-                # ただし、元のファイル名と全く同じ場合はヘキサエンコードではなかったとみなす。
-                if decoded_basename_candidate != original_basename:
-                    decoded_basename = decoded_basename_candidate
-                    print(f"  情報: ファイル名 '{original_basename}{ext}' を '{decoded_basename}{ext}' にデコードしました。")
-        except ValueError:
-            # fromhexでエラー (奇数長や16進数以外の文字が含まれる場合など)
-            # この場合はヘキサエンコードされたファイル名ではないと判断し、元のファイル名を使用
-            pass
-        except UnicodeDecodeError:
-            error_message = f"  警告: ファイル名 '{original_basename}{ext}' のUTF-8デコードに失敗しました。元のファイル名を使用します。"
-            print(error_message, file=sys.stderr)
-            write_error_log(error_message)
-
-        # Windowsの不正ファイル名文字を安全な文字に置換
-        # 不正な文字: < > : " | ? * および制御文字
-        # また、ファイル名に / が含まれる場合はディレクトリ区切り文字として認識されるため、全角スラッシュに置換
-        invalid_chars = '<>:"|?*'
-        for char in invalid_chars:
-            decoded_basename = decoded_basename.replace(char, '_')
-        
-        # スラッシュとバックスラッシュも安全な文字に置換
-        decoded_basename = decoded_basename.replace('/', '／')  # 全角スラッシュ
-        decoded_basename = decoded_basename.replace('\\', '￥')  # 全角円記号
-        
-        # 制御文字の除去
-        decoded_basename = ''.join(char for char in decoded_basename if ord(char) >= 32)
-        
-        # ファイル名が空になった場合のフォールバック
-        if not decoded_basename.strip():
-            decoded_basename = original_basename
-
-        markdown_filename = decoded_basename + '.md'
-        markdown_filepath = os.path.join(markdown_dir, markdown_filename)
-
-        try:
-            encoding_to_use = specified_encoding
-            if not encoding_to_use:
-                encoding_to_use = detect_encoding(pukiwiki_filepath)
-
-            if not encoding_to_use:
-                error_message = f"警告: ファイル '{pukiwiki_filepath}' の文字コードを自動判別できませんでした。UTF-8として処理を試みます。"
-                print(error_message, file=sys.stderr)
-                write_error_log(error_message)
-                encoding_to_use = 'utf-8' # デフォルトフォールバック
-
-            with open(pukiwiki_filepath, 'r', encoding=encoding_to_use, errors='replace') as f:
-                pukiwiki_content = f.read()
-
-            print(f"  変換中: '{pukiwiki_filepath}' (encoding: {encoding_to_use})")
-            markdown_content = convert_pukiwiki_to_markdown(pukiwiki_content)
+    # 文字コードは前回の判別結果から試し、変換できたファイルは読み込み時の情報をタイムスタンプファイルに記録する
+    # （変換に失敗したファイルは前回の記録のままにし、次回の更新変換で再度変換する）
+    # 既存の .md ファイルを削除した全変換では、途中経過の保存で出力のないファイルを記録しないよう前回の記録を引き継がない
+    if outputs_cleared:
+        manifest = {filename: entry for filename, entry in previous_timestamps.items() if filename in done_files}
+    else:
+        manifest = dict(previous_timestamps)
+    written_count = 0
+    conversion_cache = get_conversion_cache(options)
+    profile = ConversionProfile() if options.get('profile') else None
+    metrics = RunMetrics(pukiwiki_dir, markdown_dir, conversion_mode, options, len(file_stats)) if options.get('metrics', True) else None
+
+    # 結果はファイルの処理順に返るため、ログの順序は並列数に関係なく一定になる
+    cancelled = False
+    results = iter_conversion_results(pukiwiki_dir, markdown_dir, files_to_process, specified_encoding, options, previous_timestamps)
+    try:
+        for result in results:
+            for level, message in result['log']:
+                if level == 'error':
+                    print(message, file=sys.stderr)
+                    write_error_log(message, file=result['filename'])
+                else:
+                    print(message)
+            if conversion_cache is not None:
+                conversion_cache.record(result)
+            if profile is not None and result['profile'] is not None:
+                profile.add(result['filename'], result['profile'])
+            if metrics is not None:
+                metrics.add(result)
+            if result['ok']:
+                encoding = result['encoding'] if not specified_encoding else manifest.get(result['filename'], {}).get('encoding')
+                # ページが含む記法と変換に使った規則のバージョンも記録する（規則の変更の反映で使う）
+                features = result['features']
+                manifest[result['filename']] = {'mtime': result['mtime'], 'size': result['size'], 'hash': result['hash'], 'encoding': encoding,
+                                                'output_hash': result['output_hash'], 'output_mtime': result['output_mtime'],
+                                                'features': ','.join(feature_names(features)) if features is not None else None,
+                                                'rules': format_rule_versions(features) if features is not None else None}
+                file_count += 1
+                if result['written']:
+                    written_count += 1
+            else:
+                error_count += 1
 
-            with open(markdown_filepath, 'w', encoding='utf-8') as f:
-                f.write(markdown_content)
+            # 途中経過の保存（中断しても、次回はここまでに変換したファイルを変換し直さずに済む）
+            checkpoint.add(result['filename'], result['ok'])
+            if checkpoint.due() and processed_count + 1 < total_files:
+                if conversion_cache is not None:
+                    conversion_cache.flush()
+                save_timestamps(pukiwiki_dir, markdown_dir, manifest, file_stats, manifest_store)
+                checkpoint.saved()
+                print(f"情報: 途中経過を保存しました。({processed_count + 1}/{total_files})")
 
-            file_count += 1
-        except Exception as e:
-            error_message = f"エラー: ファイル '{pukiwiki_filepath}' の変換中にエラーが発生しました: {e}"
-            print(error_message, file=sys.stderr)
-            write_error_log(error_message)
-            error_count += 1
-        finally:
             processed_count += 1
             if progress_bar:
                 progress_bar["value"] = processed_count
@@ -889,12 +2884,67 @@ def process_conversion(pukiwiki_dir, markdown_dir, specified_encoding=None, prog
                 if hasattr(progress_bar, 'update_progress_info'):
                     progress_bar.update_progress_info(processed_count, total_files)
             if status_var:
-                status_var.set(f"🔄 処理中: {filename} ({processed_count}/{total_files})")
+                status_var.set(f"🔄 処理中: {result['filename']} ({processed_count}/{total_files})")
             if root_window:
                 root_window.update_idletasks()
 
+            if cancel_event is not None and cancel_event.is_set():
+                cancelled = True
+                break
+    except KeyboardInterrupt:
+        # Ctrl+C で中断された場合も、ここまでに変換したファイルを記録してから中断する（次回は変換し直さずに済む）
+        results.close()
+        if conversion_cache is not None:
+            conversion_cache.flush()
+        save_timestamps(pukiwiki_dir, markdown_dir, manifest, file_stats, manifest_store)
+        checkpoint.saved()
+        flush_error_log()
+        raise
+    results.close()
+    if metrics is not None:
+        metrics.stop()
+    # 完了メッセージでエラーログの確認を促す前に、変換中のエラーをログファイルに書き込んでおく
+    flush_error_log()
+
+    cache_hits = cache_misses = 0
+    if conversion_cache is not None:
+        cache_hits, cache_misses = conversion_cache.hits, conversion_cache.misses
+        conversion_cache.report()
+    profile_report = profile.report() if profile is not None else None
+
+    if cancelled:
+        # 中止した場合は、ここまでの途中経過を保存して戻る（同期変換の削除や連結ファイルの作成は行わない）
+        save_timestamps(pukiwiki_dir, markdown_dir, manifest, file_stats, manifest_store)
+        checkpoint.saved()
+        end_time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        result_message = f"処理を中止しました [{end_time_str}]: {total_files} 個中 {processed_count} 個のファイルを処理し、{file_count} 個を変換しました。"
+        if checkpoint.journal:
+            result_message += "\n次回の全変換・同期変換の開始時に続きから再開できます。"
+        elif conversion_mode == 'affected':
+            result_message += "\n残りのファイルは次回の規則の変更の反映で変換されます。"
+        else:
+            result_message += "\n残りのファイルは次回の更新変換で変換されます。"
+        print(result_message)
+        if status_var:
+            status_var.set(f"⏹️ 処理を中止しました [{end_time_str}]: {processed_count}/{total_files} ファイル")
+        if conversion_mode != 'update' and not auto_update:
+            reporter.showinfo("処理中止", result_message)
+        summary = {'total': total_files, 'converted': file_count, 'errors': error_count,
+                   'written': written_count, 'skipped': file_count - written_count,
+                   'deleted': removed_count, 'renamed': renamed_count, 'cache_hits': cache_hits, 'cache_misses': cache_misses, 'cancelled': True,
+                   'profile': profile_report}
+        if metrics is not None:
+            metrics.save(summary)
+        write_event_log('conversion_cancelled', result_message, mode=conversion_mode, **summary)
+        return summary
+
+    # 同期変換では変換元のなくなった .md ファイルだけを削除する（変換に失敗したファイルの出力は残す）
+    if conversion_mode == 'mirror':
+        removed_count = delete_orphaned_outputs(markdown_dir, file_stats, reporter)
+
     # タイムスタンプファイルの保存（全変換・更新変換ともに実施）
-    save_timestamps(pukiwiki_dir, markdown_dir)
+    save_timestamps(pukiwiki_dir, markdown_dir, manifest, file_stats, manifest_store)
+    checkpoint.finish()
 
     # 処理終了時間を取得
     end_time = datetime.datetime.now()
@@ -907,6 +2957,11 @@ def process_conversion(pukiwiki_dir, markdown_dir, specified_encoding=None, prog
             status_var.set(f"✅ 処理完了 [{end_time_str}]: {file_count}/{total_files} ファイルを変換しました")
 
     result_message = f"処理完了 [{end_time_str}]: {file_count} 個のファイルを変換しました。"
+    result_message += f"\n（書き込み: {written_count} 件、内容が同じため書き込みなし: {file_count - written_count} 件）"
+    if conversion_mode == 'mirror':
+        result_message += f"\n（変換元のない .md ファイルの削除: {removed_count} 件）"
+    elif renamed_count or removed_count:
+        result_message += f"\n（削除・名前変更されたページの反映: 名前の変更 {renamed_count} 件、削除 {removed_count} 件）"
     if error_count > 0:
         result_message += f"\n注意: {error_count} 個のファイルでエラーが発生しました。"
         result_message += f"\nエラーの詳細は '{os.path.join(LOG_DIR, ERROR_LOG_FILE)}' を確認してください。"
@@ -914,12 +2969,13 @@ def process_conversion(pukiwiki_dir, markdown_dir, specified_encoding=None, prog
     
     # 更新変換モードと自動更新時はポップアップを表示しない
     if conversion_mode != 'update' and not auto_update:
-        messagebox.showinfo("処理完了", result_message)
+        reporter.showinfo("処理完了", result_message)
 
     # --- 変換されたMarkdownファイルを1つに連結してlogsディレクトリに保存 --- START
     try:
         # 自動更新がチェックされている場合は連結ファイルを作成しない
-        if file_count > 0 and not auto_update: # 変換されたファイルが1つ以上あり、かつ自動更新が無効の場合のみ実行
+        # 変換・削除・名前変更された .md ファイルが1つ以上あり、かつ自動更新が無効の場合のみ実行
+        if (file_count or renamed_count or removed_count) and not auto_update:
             if not os.path.exists(LOG_DIR):
                 os.makedirs(LOG_DIR)
             
@@ -927,28 +2983,14 @@ def process_conversion(pukiwiki_dir, markdown_dir, specified_encoding=None, prog
             concatenated_filename = f"{today_str}_obsidian.md"
             concatenated_filepath = os.path.join(LOG_DIR, concatenated_filename)
             
-            all_markdown_content = []
-            # markdown_dir 内の .md ファイルをソートして取得 (順序をある程度一定にするため)
-            md_files = sorted([f for f in os.listdir(markdown_dir) if f.endswith('.md') and f != TIMESTAMP_FILE])
-
-            for md_filename in md_files:
-                md_filepath = os.path.join(markdown_dir, md_filename)
-                try:
-                    with open(md_filepath, 'r', encoding='utf-8') as f_md:
-                        content = f_md.read()
-                    all_markdown_content.append(f"\n\n---\n## FILE: {md_filename}\n---\n\n{content}")
-                except Exception as e_read_md:
-                    error_message = f"連結用Markdownファイル '{md_filepath}' の読み込み中にエラー: {e_read_md}"
-                    print(error_message, file=sys.stderr)
-                    write_error_log(error_message)
+            segment_count, reused_count = build_concatenated_markdown(markdown_dir, concatenated_filepath)
             
-            if all_markdown_content:
-                with open(concatenated_filepath, 'w', encoding='utf-8') as f_concat:
-                    f_concat.write("".join(all_markdown_content))
+            if segment_count > 0:
                 print(f"情報: 変換されたMarkdownファイルを連結し、'{concatenated_filepath}' に保存しました。")
+                print(f"情報: 連結ファイルの {segment_count} ページのうち {reused_count} ページは前回の連結ファイルから再利用しました。")
                 # 更新変換モードと自動更新時はポップアップを表示しない
                 if conversion_mode != 'update' and not auto_update:
-                    messagebox.showinfo("追加処理完了", f"変換されたMarkdownファイルを連結し、\n'{concatenated_filepath}'\nに保存しました。\n\n処理完了時刻: {end_time_str}")
+                    reporter.showinfo("追加処理完了", f"変換されたMarkdownファイルを連結し、\n'{concatenated_filepath}'\nに保存しました。\n\n処理完了時刻: {end_time_str}")
             else:
                 print("情報: 連結対象のMarkdownファイルが見つからなかったため、連結ファイルの作成はスキップされました。")
         elif auto_update:
@@ -960,54 +3002,211 @@ def process_conversion(pukiwiki_dir, markdown_dir, specified_encoding=None, prog
         write_error_log(error_message)
         # 更新変換モードと自動更新時はポップアップを表示しない
         if conversion_mode != 'update' and not auto_update:
-            messagebox.showerror("連結エラー", error_message)
+            reporter.showerror("連結エラー", error_message)
     # --- 変換されたMarkdownファイルを1つに連結してlogsディレクトリに保存 --- END
 
     # 自動更新が有効で更新変換モードの場合、次の更新をスケジュール
     if auto_update and conversion_mode == 'update':
-        schedule_auto_update(pukiwiki_dir, markdown_dir, specified_encoding, progress_bar, status_var, root_window, conversion_mode, auto_update, update_interval)
+        schedule_auto_update(pukiwiki_dir, markdown_dir, specified_encoding, progress_bar, status_var, root_window, conversion_mode, auto_update, update_interval, options, reporter, cancel_event)
+
+    summary = {'total': total_files, 'converted': file_count, 'errors': error_count,
+               'written': written_count, 'skipped': file_count - written_count,
+               'deleted': removed_count, 'renamed': renamed_count, 'cache_hits': cache_hits, 'cache_misses': cache_misses, 'cancelled': False,
+               'profile': profile_report}
+    if metrics is not None:
+        metrics.save(summary)
+    write_event_log('conversion_finished', result_message, mode=conversion_mode, **summary)
+    return summary
+
+# --- ディレクトリ監視 --- START
+WATCH_POLL_INTERVAL = 2.0 # 変更通知が使えない場合にディレクトリを走査する間隔（秒）
+WATCH_DEBOUNCE = 1.0 # 最後の変更からこの秒数だけ新しい変更がなければ変換を始める
+WATCH_MAX_DELAY = 10.0 # 変更が続いていても、最初の変更からこの秒数が経ったら変換を始める
+AUTO_UPDATE_THREAD_NAME = 'auto-update' # 自動更新（監視）スレッドの名前
+
+class DirectoryWatcher:
+    """
+    PukiWikiディレクトリの変更を監視し、変更されたファイル名をまとめて返します。
+    watchdog パッケージがインストールされていればファイルシステムの変更通知を使い、
+    なければ poll_interval 秒ごとの os.scandir による走査で変更を検出します。
+    """
+    def __init__(self, pukiwiki_dir, poll_interval=WATCH_POLL_INTERVAL):
+        self.pukiwiki_dir = pukiwiki_dir
+        self.poll_interval = poll_interval
+        self.mode = None # 'notify'（変更通知）または 'poll'（定期走査）
+        self._changed = set()
+        self._lock = threading.Lock()
+        self._notified = threading.Event() # 変更通知を受け取ったとき、または停止時にセットされる
+        self._stopped = threading.Event()
+        self._observer = None
+        self._snapshot = {}
+
+    def start(self):
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            self._snapshot = scan_pukiwiki_stats(self.pukiwiki_dir)
+            self.mode = 'poll'
+            return
+        watcher = self
+
+        class ChangeHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                for path in (event.src_path, getattr(event, 'dest_path', None)):
+                    if path:
+                        watcher._add_change(os.path.basename(path))
+
+        self._observer = Observer()
+        self._observer.schedule(ChangeHandler(), self.pukiwiki_dir, recursive=False)
+        self._observer.start()
+        self.mode = 'notify'
+
+    def stop(self):
+        self._stopped.set()
+        self._notified.set()
+        if self._observer:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def _add_change(self, filename):
+        if filename.endswith('.txt') or filename.endswith('.page'):
+            with self._lock:
+                self._changed.add(filename)
+            self._notified.set()
+
+    def _wait(self, seconds):
+        """seconds 秒（停止されたらすぐに）待ち、その間に新しい変更があったかを返します。"""
+        if self.mode == 'notify':
+            self._notified.wait(seconds)
+            notified = self._notified.is_set() and not self.stopped
+            self._notified.clear()
+            return notified
+        if self._stopped.wait(seconds):
+            return False
+        current = scan_pukiwiki_stats(self.pukiwiki_dir)
+        changed = {name for name, stat in current.items() if self._snapshot.get(name) != stat}
+        changed.update(self._snapshot.keys() - current.keys()) # 削除されたファイル
+        self._snapshot = current
+        for name in changed:
+            self._add_change(name)
+        return bool(changed)
+
+    def wait_for_changes(self, timeout=None, debounce=WATCH_DEBOUNCE, max_delay=WATCH_MAX_DELAY):
+        """
+        変更があるまで待ち、変更が落ち着いたら変更されたファイル名の集合を返します。
+        （debounce 秒間新しい変更がないか、最初の変更から max_delay 秒経つまで待って、連続した編集を1回にまとめます）
+        timeout 秒経っても変更がない場合や、停止された場合は空の集合を返します。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._changed:
+            if self.stopped:
+                return set()
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return set()
+            step = self.poll_interval if self.mode == 'poll' else 1.0
+            self._wait(step if remaining is None else min(step, remaining))
+
+        first_change = time.monotonic()
+        while not self.stopped and time.monotonic() - first_change < max_delay:
+            if not self._wait(max(debounce, self.poll_interval) if self.mode == 'poll' else debounce):
+                break
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        return changed
+# --- ディレクトリ監視 --- END
+
+def schedule_auto_update(pukiwiki_dir, markdown_dir, specified_encoding, progress_bar, status_var, root_window, conversion_mode, auto_update, update_interval, options=None, reporter=None, cancel_event=None):
+    """
+    自動更新を開始します（実行中の場合は何もしません）。
+    PukiWikiディレクトリを監視し、変更されたページだけを数秒以内に更新変換します。
+    変更通知を取りこぼした場合に備え、変更がないまま update_interval 分経ったらディレクトリ全体も確認します。
+    cancel_event がセットされると、実行中の更新変換を中止します（監視の停止は stop_auto_update で行います）。
+    """
+    global auto_update_watcher, auto_update_running, auto_update_thread, auto_update_cancel_event
+    # 監視スレッド内の変換から呼ばれた場合（停止直後を含む）は新たに開始しない
+    if threading.current_thread().name == AUTO_UPDATE_THREAD_NAME:
+        return
+    if auto_update_watcher is not None and not auto_update_watcher.stopped:
+        return
+
+    watcher = DirectoryWatcher(pukiwiki_dir)
+    watcher.start()
+    auto_update_watcher = watcher
+    auto_update_cancel_event = cancel_event
+    if watcher.mode == 'notify':
+        print("情報: 自動更新: ファイルの変更通知でディレクトリを監視します。")
+    else:
+        print(f"情報: 自動更新: {watcher.poll_interval:g} 秒ごとにディレクトリを走査して変更を監視します。")
 
-def schedule_auto_update(pukiwiki_dir, markdown_dir, specified_encoding, progress_bar, status_var, root_window, conversion_mode, auto_update, update_interval):
-    """自動更新をスケジュールします。"""
-    global auto_update_timer, auto_update_running
-    
     def auto_update_task():
         global auto_update_running
-        auto_update_running = True
-        try:
+        while not watcher.stopped:
             if status_var:
-                status_var.set(f"🔄 自動更新実行中...")
-            process_conversion(pukiwiki_dir, markdown_dir, specified_encoding, progress_bar, status_var, root_window, conversion_mode, auto_update, update_interval)
-        finally:
-            auto_update_running = False
-    
-    # 次回実行予定時間を計算
-    next_run_time = datetime.datetime.now() + datetime.timedelta(minutes=update_interval)
-    next_run_str = next_run_time.strftime("%Y-%m-%d %H:%M:%S")
-    
-    if status_var:
-        status_var.set(f"⏰ 次回自動更新: {next_run_str} ({update_interval} 分後)")
-    
-    # 指定された分数後に自動更新を実行
-    auto_update_timer = threading.Timer(update_interval * 60, auto_update_task)
-    auto_update_timer.daemon = True
-    auto_update_timer.start()
+                status_var.set(f"👀 変更を監視中...（全体の確認: {update_interval} 分ごと）")
+            changed_files = watcher.wait_for_changes(timeout=update_interval * 60)
+            if watcher.stopped:
+                break
+            # 手動の変換を実行中の場合は、終わるのを待ってから更新変換する
+            with conversion_lock:
+                if watcher.stopped:
+                    break
+                auto_update_running = True
+                try:
+                    if status_var:
+                        status_var.set(f"🔄 自動更新実行中...")
+                    # 変更を検出したファイルだけを確認する（タイムアウト時はディレクトリ全体を確認する）
+                    process_conversion(pukiwiki_dir, markdown_dir, specified_encoding, progress_bar, status_var, root_window, conversion_mode, auto_update, update_interval, options, reporter, changed_files or None,
+                                       cancel_event=cancel_event)
+                except Exception as e:
+                    error_message = f"自動更新中にエラーが発生しました: {e}"
+                    print(error_message, file=sys.stderr)
+                    write_error_log(error_message)
+                finally:
+                    auto_update_running = False
 
-def stop_auto_update():
-    """自動更新を停止します。"""
-    global auto_update_timer, auto_update_running
-    
-    if auto_update_timer:
-        auto_update_timer.cancel()
-        auto_update_timer = None
-    
+    auto_update_thread = threading.Thread(target=auto_update_task, name=AUTO_UPDATE_THREAD_NAME, daemon=True)
+    auto_update_thread.start()
+
+def stop_auto_update(wait=False, cancel=False):
+    """
+    自動更新を停止します。
+    cancel が True の場合は、schedule_auto_update に渡された cancel_event をセットし、実行中の更新変換をすぐに中止します
+    （自動更新を開始した変換より後に別の変換を始めていても、自動更新による変換を中止できます）。
+    wait が True の場合は、実行中の更新変換が終わる（タイムスタンプの記録の保存を含む）まで待ちます。
+    """
+    global auto_update_watcher, auto_update_running, auto_update_thread, auto_update_cancel_event
+    
+    if cancel and auto_update_cancel_event is not None:
+        auto_update_cancel_event.set()
+    auto_update_cancel_event = None
+    if auto_update_watcher:
+        auto_update_watcher.stop()
+        auto_update_watcher = None
+    
+    if wait and auto_update_thread is not None and auto_update_thread is not threading.current_thread():
+        auto_update_thread.join()
+    auto_update_thread = None
     auto_update_running = False
     print("情報: 自動更新が停止されました。")
 
-def main_gui():
+def main_gui(option_overrides=None):
     """
     GUIアプリケーションのメイン処理
+    option_overrides にはコマンドライン引数で指定された詳細設定（INIより優先）を渡します。
     """
+    # GUIを使わないコマンドライン実行ではtkinterを読み込まないよう、ここでインポートする
+    import tkinter as tk
+    from tkinter import filedialog, messagebox, ttk # ttk をインポート
+
     window = tk.Tk()
     window.title("PukiWiki to Markdown Converter v20250613_0957")
     window.geometry("750x650+100+100")  # +100+100で左上に配置
@@ -1163,7 +3362,36 @@ def main_gui():
         
         save_settings(p_dir, m_dir, enc, conversion_mode, auto_update, update_interval)
         specified_enc = enc if enc != "auto" else None
-        process_conversion(p_dir, m_dir, specified_enc, progress_bar, status_var, window, conversion_mode, auto_update, update_interval)
+        options = load_advanced_settings()
+        options.update(option_overrides or {})
+
+        # 変換はバックグラウンドのスレッドで実行し、進捗は relay を通じて poll_conversion_progress で画面に反映する
+        # （自動更新による変換の実行中も、同じ出力に同時に書き込まないよう開始しない。ロックは変換のスレッドが解放する）
+        if not conversion_lock.acquire(blocking=False):
+            messagebox.showinfo("実行中", "変換（自動更新による変換を含む）を実行中です。終了するまでお待ちください。")
+            return
+        cancel_event = threading.Event()
+
+        def run_conversion():
+            try:
+                process_conversion(p_dir, m_dir, specified_enc, relay.progress_bar, relay.status_var, None, conversion_mode, auto_update, update_interval, options, relay.reporter,
+                                   resume=None, cancel_event=cancel_event)
+            except Exception as e:
+                error_message = f"変換中に予期しないエラーが発生しました: {e}"
+                print(error_message, file=sys.stderr)
+                write_error_log(error_message)
+                relay.reporter.showerror("エラー", error_message)
+            finally:
+                conversion_lock.release()
+                relay.post('finished', True)
+
+        conversion_state['cancel'] = cancel_event
+        conversion_state['thread'] = threading.Thread(target=run_conversion, name=CONVERSION_THREAD_NAME, daemon=True)
+        convert_button.configure(state="disabled")
+        conversion_state['thread'].start()
+
+    relay = GuiRelay()
+    conversion_state = {'thread': None, 'cancel': None} # 実行中の変換のスレッドと中止用のイベント
 
     # --- メインコンテナフレーム ---
     main_frame = ttk.Frame(window, padding="20 20 20 10")
@@ -1245,6 +3473,11 @@ def main_gui():
                                           variable=conversion_mode_var, value="full", style='FullMode.TRadiobutton',
                                           command=save_current_settings)
     full_conversion_radio.pack(anchor="w", padx=10, pady=5)
+
+    mirror_conversion_radio = ttk.Radiobutton(full_mode_container, text="🪞 同期変換（全ファイルを変換、変更されたmdのみ書き込み、不要なmdのみ削除）", 
+                                            variable=conversion_mode_var, value="mirror", style='FullMode.TRadiobutton',
+                                            command=save_current_settings)
+    mirror_conversion_radio.pack(anchor="w", padx=10, pady=(0, 5))
     
     # 更新変換オプションフレーム（視覚的強調用）
     update_mode_container = ttk.Frame(mode_options_frame, style='UpdateModeFrame.TFrame')
@@ -1255,6 +3488,11 @@ def main_gui():
                                             command=save_current_settings)
     update_conversion_radio.pack(anchor="w", padx=10, pady=5)
 
+    affected_conversion_radio = ttk.Radiobutton(update_mode_container, text="🧩 規則の変更の反映（更新されたファイルと、変換規則が変わったファイルのみ変換）", 
+                                              variable=conversion_mode_var, value="affected", style='UpdateMode.TRadiobutton',
+                                              command=save_current_settings)
+    affected_conversion_radio.pack(anchor="w", padx=10, pady=(0, 5))
+
     # 自動更新設定（更新変換選択時のみ有効）
     auto_update_frame = ttk.Frame(mode_frame)
     auto_update_frame.grid(row=1, column=1, columnspan=2, sticky="w", pady=(10, 0))
@@ -1291,12 +3529,20 @@ def main_gui():
     convert_button.pack(side="left", padx=(0, 10))
     
     def stop_auto_update_gui():
-        stop_auto_update()
+        # 実行中の変換（自動更新による変換を含む）を中止し、自動更新も停止する
+        running = (conversion_state['thread'] is not None and conversion_state['thread'].is_alive()) or auto_update_running
+        if conversion_state['cancel'] is not None:
+            conversion_state['cancel'].set()
+        stop_auto_update(cancel=True)
+        if running:
+            if status_var:
+                status_var.set("⏹️ 変換を中止しています...（処理中のファイルが終わり次第、途中経過を保存して停止します）")
+            return
         if status_var:
             status_var.set("🛑 自動更新が停止されました")
         messagebox.showinfo("自動更新停止", "自動更新を停止しました。")
     
-    stop_button = ttk.Button(button_container, text="🛑 自動更新停止", command=stop_auto_update_gui, style='Custom.TButton')
+    stop_button = ttk.Button(button_container, text="🛑 停止", command=stop_auto_update_gui, style='Custom.TButton')
     stop_button.pack(side="left")
 
     # 変換モードに応じて自動更新設定の有効/無効を切り替える関数
@@ -1312,17 +3558,27 @@ def main_gui():
             mode_frame.configure(text=" ⚙️ 変換モード設定 - 📝 更新変換選択中 ")
             # 変換実行ボタンの更新
             convert_button.configure(text="📝 更新変換実行", style='UpdateModeAction.TButton')
+        elif mode == "affected":
+            # 規則の変更の反映は1回だけ実行するため、自動更新は無効化
+            auto_update_check.configure(state="disabled")
+            interval_spinbox.configure(state="disabled")
+            auto_update_var.set("False")
+            update_mode_container.configure(style='UpdateModeSelected.TFrame')
+            full_mode_container.configure(style='FullModeFrame.TFrame')
+            mode_frame.configure(text=" ⚙️ 変換モード設定 - 🧩 規則の変更の反映選択中 ")
+            convert_button.configure(text="🧩 規則の変更の反映実行", style='UpdateModeAction.TButton')
         else:
             auto_update_check.configure(state="disabled")
             interval_spinbox.configure(state="disabled")
-            auto_update_var.set("False")  # 全変換モードでは自動更新を無効化
-            # 全変換選択時の視覚効果
+            auto_update_var.set("False")  # 全変換・同期変換モードでは自動更新を無効化
+            # 全変換・同期変換選択時の視覚効果
             full_mode_container.configure(style='FullModeSelected.TFrame')
             update_mode_container.configure(style='UpdateModeFrame.TFrame')
             # フレーム全体の色も変更
-            mode_frame.configure(text=" ⚙️ 変換モード設定 - 🔄 全変換選択中 ")
+            mode_label = "🪞 同期変換" if mode == "mirror" else "🔄 全変換"
+            mode_frame.configure(text=f" ⚙️ 変換モード設定 - {mode_label}選択中 ")
             # 変換実行ボタンの更新
-            convert_button.configure(text="🔄 全変換実行", style='FullModeAction.TButton')
+            convert_button.configure(text=f"{mode_label}実行", style='FullModeAction.TButton')
         # 状態変更時に保存
         save_current_settings()
     
@@ -1333,7 +3589,7 @@ def main_gui():
     print(f"設定復元: 変換モード={initial_conversion_mode}, 自動更新={initial_auto_update}, 更新間隔={initial_update_interval}")
     
     # 変換モードの初期設定
-    if initial_conversion_mode in ["full", "update"]:
+    if initial_conversion_mode in ["full", "update", "mirror", "affected"]:
         conversion_mode_var.set(initial_conversion_mode)
     else:
         conversion_mode_var.set("full")  # デフォルト値
@@ -1405,8 +3661,14 @@ def main_gui():
     def on_closing():
         """ウィンドウクローズ時の処理"""
         try:
-            # 自動更新を停止
-            stop_auto_update()
+            # 実行中の変換を中止し、自動更新を停止
+            if conversion_state['cancel'] is not None:
+                conversion_state['cancel'].set()
+            stop_auto_update(cancel=True)
+            relay.close()
+            if conversion_state['thread'] is not None:
+                # 処理中のファイルが終わり途中経過が保存されるまで少し待つ
+                conversion_state['thread'].join(timeout=10)
             
             # 現在の設定を保存
             p_dir = pukiwiki_dir_var.get()
@@ -1442,9 +3704,121 @@ def main_gui():
     # プログレス情報更新関数を progress_bar に関連付け
     progress_bar.update_progress_info = update_progress_info
 
+    def poll_conversion_progress():
+        """バックグラウンドの変換の進捗を一定間隔（GUI_REFRESH_INTERVAL_MS）ごとにまとめて画面に反映します。"""
+        latest = relay.take_latest()
+        if 'maximum' in latest:
+            progress_bar["maximum"] = latest['maximum']
+        if 'value' in latest:
+            progress_bar["value"] = latest['value']
+        if 'info' in latest:
+            update_progress_info(*latest['info'])
+        if 'status' in latest:
+            status_var.set(latest['status'])
+        if latest.get('finished'):
+            convert_button.configure(state="normal")
+        relay.run_pending_calls(messagebox)
+        window.after(GUI_REFRESH_INTERVAL_MS, poll_conversion_progress)
+
+    window.after(GUI_REFRESH_INTERVAL_MS, poll_conversion_progress)
     window.mainloop()
 
 
+def build_argument_parser():
+    """コマンドライン引数の定義を作成します。"""
+    parser = argparse.ArgumentParser(description='PukiWiki to Markdown Converter（サブコマンドを省略するとGUIを起動します）')
+    parser.add_argument('--workers', type=int, help='並列変換のプロセス数（1: 並列化しない、0: CPU数）。INIの Workers より優先されます。')
+
+    # サブコマンド共通の引数（省略時はINIファイルの設定を使う）
+    # --workers はサブコマンドの前後どちらにも書けるよう、未指定時に上書きしないようにする
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--workers', type=int, default=argparse.SUPPRESS, help='並列変換のプロセス数（1: 並列化しない、0: CPU数）')
+    conversion = argparse.ArgumentParser(add_help=False, parents=[common])
+    conversion.add_argument('-i', '--pukiwiki-dir', help='PukiWikiデータディレクトリ')
+    conversion.add_argument('-o', '--markdown-dir', help='Markdown出力ディレクトリ')
+    conversion.add_argument('-e', '--encoding', help='文字コード（auto, utf-8, euc-jp, shift_jis など）')
+    conversion.add_argument('--engine', choices=sorted(CONVERTERS), help='変換エンジン')
+    conversion.add_argument('--cache-size', type=int, help='変換結果キャッシュの上限サイズ（MB、0: キャッシュしない）')
+    conversion.add_argument('--log-jsonl', action='store_true', default=None, help='エラーログと同じ内容を logs/conversion_errors.jsonl にも書き込みます')
+    conversion.add_argument('--profile', action='store_true', default=None, help='変換の段階ごとの処理時間を計測し、時間のかかった段階とページを表示します')
+    conversion.add_argument('--manifest', choices=sorted(MANIFEST_STORES), help='タイムスタンプの記録の保存先（markdown: timestamps.md、sqlite: logs/manifest.sqlite3）')
+
+    subparsers = parser.add_subparsers(dest='command', metavar='{convert,update,watch,gui}')
+    convert_parser = subparsers.add_parser('convert', parents=[conversion], help='変換を1回実行します')
+    convert_parser.add_argument('-m', '--mode', choices=['full', 'update', 'mirror', 'affected'],
+                                help='変換モード（省略時はINIの設定。mirror: 同期変換、affected: 変換規則が変わったページと更新されたページだけを変換）')
+    convert_parser.add_argument('--resume', action='store_true', help='中断した全変換・同期変換を続きから再開します')
+    convert_parser.add_argument('-y', '--yes', action='store_true', help='全変換時に既存の .md ファイルを、同期変換時に変換元のない .md ファイルを確認なしで削除します')
+    subparsers.add_parser('update', parents=[conversion], help='更新されたファイルだけを変換します（convert --mode update と同じ）')
+    watch_parser = subparsers.add_parser('watch', parents=[conversion], help='ディレクトリを監視し、変更されたページを更新変換します（Ctrl+C で終了）')
+    watch_parser.add_argument('--interval', type=int, help='変更がないときにディレクトリ全体を確認する間隔（分、省略時はINIの更新間隔）')
+    subparsers.add_parser('gui', parents=[common], help='GUIを起動します（既定）')
+    return parser
+
+def main(argv=None):
+    """
+    コマンドラインのエントリーポイントです。
+    サブコマンドを省略した場合（または gui の場合）はGUIを起動し、それ以外はGUIなしで変換します。
+    戻り値は終了コードです（0: 正常、1: 一部のファイルでエラー、2: 処理を開始できなかった、130: Ctrl+C で中断した）。
+    """
+    args = build_argument_parser().parse_args(argv)
+    option_overrides = {}
+    if args.workers is not None:
+        option_overrides['workers'] = args.workers
+    if getattr(args, 'engine', None):
+        option_overrides['engine'] = args.engine
+    if getattr(args, 'cache_size', None) is not None:
+        option_overrides['cache_size_mb'] = args.cache_size
+    if getattr(args, 'manifest', None):
+        option_overrides['manifest_backend'] = args.manifest
+    if getattr(args, 'log_jsonl', None):
+        option_overrides['log_jsonl'] = True
+    if getattr(args, 'profile', None):
+        option_overrides['profile'] = True
+
+    if args.command in (None, 'gui'):
+        main_gui(option_overrides)
+        return 0
+
+    pukiwiki_dir, markdown_dir, encoding, conversion_mode, auto_update, update_interval = load_settings()
+    pukiwiki_dir = args.pukiwiki_dir or pukiwiki_dir
+    markdown_dir = args.markdown_dir or markdown_dir
+    encoding = args.encoding or encoding
+    specified_encoding = None if encoding.startswith('auto') else encoding
+    options = load_advanced_settings()
+    options.update(option_overrides)
+    reporter = ConsoleReporter(assume_yes=getattr(args, 'yes', False))
+
+    if args.command == 'watch':
+        update_interval = args.interval or update_interval
+        cancel_event = threading.Event()
+        try:
+            # 自動更新と同じく、1回目を今すぐ実行し、以降はディレクトリの変更を監視して変更されたページを変換する
+            with conversion_lock:
+                summary = process_conversion(pukiwiki_dir, markdown_dir, specified_encoding, None, None, None, 'update', True, update_interval, options, reporter,
+                                             cancel_event=cancel_event)
+            if summary is None:
+                return 2
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            # 実行中の更新変換を中止し、タイムスタンプの記録の保存が終わるのを待ってから終了する
+            print("\n情報: 監視を終了します。（実行中の変換があれば、処理中のファイルが終わり次第、記録を保存して終了します）")
+            cancel_event.set()
+            stop_auto_update(wait=True, cancel=True)
+        return 0
+
+    conversion_mode = 'update' if args.command == 'update' else (args.mode or conversion_mode)
+    try:
+        summary = process_conversion(pukiwiki_dir, markdown_dir, specified_encoding, None, None, None, conversion_mode, False, update_interval, options, reporter,
+                                     resume=getattr(args, 'resume', False))
+    except KeyboardInterrupt:
+        print("\n情報: 変換を中断しました。中断までに変換したファイルは記録されています（全変換・同期変換は convert --resume で続きから再開できます）。", file=sys.stderr)
+        return 130
+    if summary is None:
+        return 2
+    return 1 if summary['errors'] else 0
+
+
 if __name__ == '__main__':
-    # main() # 古いコマンドラインベースのmain関数は呼び出さない
-    main_gui() 
\ No newline at end of file
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+インライン記法のスキャナー（scan_inline）のテスト
+
+使い方:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pukiwiki_to_markdown as converter
+
+UNCLOSED_OPENERS = 30 # 閉じていない記法を続ける数
+TIME_LIMIT_SECONDS = 1.0 # 1行の変換にかかってよい時間の上限
+# インライン記法を含まず、行単位では変換できないページ（従来実装と同じ出力になる）
+BLOCK_FALLBACK_CASES = ('-\n>', '+\n|h', '--\n**', '--\n```')
+
+
+class ScanInlineTest(unittest.TestCase):
+    def test_nested(self):
+        self.assertEqual(converter.scan_inline('&color(red){&size(20){x}} &size(1){a'),
+                         '<span style="color: red;"><span style="font-size: 20px;">x</span></span> &size(1){a')
+
+    def test_unclosed_openers_finish_quickly(self):
+        # 閉じていない記法が続く行も、記法の数に比例する程度の時間で変換する（そのまま出力する）
+        for line in ('&size(1){a' * UNCLOSED_OPENERS, '&color(red){' * UNCLOSED_OPENERS,
+                     '&size(1){a' * UNCLOSED_OPENERS + '}', "&color(red){''a" * UNCLOSED_OPENERS + '}'):
+            with self.subTest(line=line[:24]):
+                start = time.perf_counter()
+                converter.scan_inline(line)
+                self.assertLess(time.perf_counter() - start, TIME_LIMIT_SECONDS)
+        self.assertEqual(converter.scan_inline('&size(1){a' * UNCLOSED_OPENERS), '&size(1){a' * UNCLOSED_OPENERS)
+
+    def test_block_fallbacks_match_legacy(self):
+        for text in BLOCK_FALLBACK_CASES:
+            with self.subTest(text=text):
+                self.assertEqual(converter.convert_pukiwiki_to_markdown_scan(text), converter.convert_pukiwiki_to_markdown(text))
+        self.assertEqual(converter.convert_pukiwiki_to_markdown_scan('-\n>'), '- \n>')
+
+
+if __name__ == '__main__':
+    unittest.main()
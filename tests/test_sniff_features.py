@@ -0,0 +1,41 @@
+"""
+記法の事前確認（sniff_features）で段階を省いても出力が変わらないことのテスト
+
+使い方:
+    python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import pukiwiki_to_markdown as converter
+
+# 前の段階の出力が後の段階の記法を作るページと、すべての段階を適用した従来の出力
+REGRESSION_CASES = (
+    # &color の <span> の '">' がエイリアス付きリンクの > になる
+    ('&color([[){#]]}', '<span style="color: []</span>'),
+    # 行をまたぐリンクの並べ替えで | で始まる行ができる
+    ('[[\n>\n]]', '[[\n\n|  |\n| --- |\n\n]]'),
+    # #ref の ![[...]] と後ろの [#アンカー] で [[#アンカー]] リンクができる
+    ('*x [#a]\n#ref([#a]])', '# x \n![[]\n  リンク先 []]]]'),
+)
+
+
+class SniffFeaturesTest(unittest.TestCase):
+    def test_regression_cases(self):
+        for text, expected in REGRESSION_CASES:
+            with self.subTest(text=text):
+                self.assertEqual(converter.convert_pukiwiki_to_markdown(text), expected)
+                self.assertEqual(converter.convert_pukiwiki_to_markdown_stream(text), expected)
+
+    def test_profile_counts_pages_without_stages(self):
+        profile = converter.ConversionProfile()
+        markdown_text, stages = converter.convert_with_profile('テキストだけのページ')
+        self.assertEqual(stages, [])
+        profile.add('plain.txt', stages)
+        self.assertEqual(profile.page_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()